@@ -0,0 +1,93 @@
+# File: bench_alerts.py
+# Description: Cost per reading of the listener's alert rules (alert_engine.py) as the history
+#              behind them grows. For each history length the engine has first seen that many
+#              readings (spread over --devices air and water nodes), then the evaluation cost
+#              of further readings is taken from its own counters (alert_evaluation_seconds_total
+#              / alert_evaluations_total, as /metrics reports it). For comparison, the same
+#              z-score is computed by rescanning each device's stored values, as a check over
+#              the readings table would have to. No broker or database is needed.
+#
+# Usage:   python Test/bench_alerts.py [--history 0,10000,100000,1000000] [--devices 20] [--measure 20000]
+
+import argparse
+import datetime
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from alert_engine import AlertEngine, load_rules
+
+START = datetime.datetime(2026, 1, 1)
+
+
+def synthetic_reading(i, devices):
+    """ (device_id, readings, received_at) of reading i: air and water nodes alternate, 10 s apart. """
+    device = i % devices
+    at = START + datetime.timedelta(seconds=10 * (i // devices))
+    if device % 2 == 0:
+        return f"air_{device:03d}", {'temperature_c': round(random.gauss(28, 1), 2),
+                                     'humidity_pct': round(random.gauss(75, 3), 2),
+                                     'pm2_5_ug_m3': round(random.gauss(20, 2), 2),
+                                     'pm10_ug_m3': round(random.gauss(40, 4), 2),
+                                     'wind_speed_ms': round(random.uniform(0, 6), 2)}, at
+    return f"water_{device:03d}", {'water_level_cm': round(random.gauss(50, 0.3), 2),
+                                   'salinity_ppt': round(random.gauss(2, 0.1), 2)}, at
+
+
+def rescan_zscore(history, value):
+    """ z-score of `value` against every stored value of the device, recomputed from scratch. """
+    mean = sum(history) / len(history)
+    var = sum((v - mean) ** 2 for v in history) / len(history)
+    return (value - mean) / math.sqrt(var) if var > 0 else 0.0
+
+
+def bench(history, devices, measure, rescan_measure):
+    """ (engine µs per reading, rule checks per reading, rescan µs per reading or None) """
+    random.seed(1)
+    engine = AlertEngine(load_rules())
+    stored = {}         # device_id -> [pm2_5 or water_level values], only for the rescan
+    for i in range(history):
+        device_id, readings, at = synthetic_reading(i, devices)
+        engine.evaluate(device_id, readings, at)
+        if rescan_measure:
+            stored.setdefault(device_id, []).append(readings.get('pm2_5_ug_m3', readings.get('water_level_cm')))
+
+    evaluated, checks, seconds = (engine.counters[k] for k in ('evaluated', 'checks', 'evaluation_seconds'))
+    for i in range(history, history + measure):
+        engine.evaluate(*synthetic_reading(i, devices))
+    evaluated = engine.counters['evaluated'] - evaluated
+    per_reading = (engine.counters['evaluation_seconds'] - seconds) / evaluated * 1e6
+    checks = (engine.counters['checks'] - checks) / evaluated
+
+    rescan = None
+    if rescan_measure and history:
+        began = time.perf_counter()
+        for i in range(history, history + rescan_measure):
+            device_id, readings, _ = synthetic_reading(i, devices)
+            values = stored[device_id]
+            value = readings.get('pm2_5_ug_m3', readings.get('water_level_cm'))
+            rescan_zscore(values, value)
+            values.append(value)
+        rescan = (time.perf_counter() - began) / rescan_measure * 1e6
+    return per_reading, checks, rescan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark alert evaluation cost against history length.")
+    parser.add_argument('--history', default='0,10000,100000,1000000')
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--measure', type=int, default=20000, help="readings timed per history length")
+    parser.add_argument('--rescan-measure', type=int, default=200, help="readings timed for the rescan (0 = skip)")
+    args = parser.parse_args()
+
+    print(f"🚀 {len(load_rules())} default rules, {args.devices} devices, {args.measure} timed readings per row\n")
+    print(f"{'history':>9} | {'per device':>10} | {'engine µs/reading':>17} | {'checks/reading':>14} | "
+          f"{'rescan µs/reading':>17}")
+    print("-" * 80)
+    for history in (int(h) for h in args.history.split(',')):
+        per_reading, checks, rescan = bench(history, args.devices, args.measure, args.rescan_measure)
+        print(f"{history:>9} | {history // args.devices:>10} | {per_reading:>17.2f} | {checks:>14.2f} | "
+              f"{'-' if rescan is None else f'{rescan:.1f}':>17}")
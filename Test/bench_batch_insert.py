@@ -0,0 +1,87 @@
+# File: bench_batch_insert.py
+# Description: Measures ingest throughput (rows/sec) of ReadingBatcher at different batch
+#              sizes against the real unified_sensor_db. Uses throw-away 'bench_node_*'
+#              devices and deletes them and their readings afterwards.
+#
+# Usage:   python Test/bench_batch_insert.py [rows_per_run] [batch_size ...]
+# Example: python Test/bench_batch_insert.py 5000 1 50 500
+
+import os
+import random
+import sys
+import time
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest_batcher import ReadingBatcher
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+DEVICE_COUNT = 20
+DEFAULT_ROWS = 5000
+DEFAULT_BATCH_SIZES = [1, 50, 500]
+
+
+def make_message(i):
+    """Alternates between an air-node and a water-node shaped reading."""
+    device_id = f"bench_node_{i % DEVICE_COUNT:03d}"
+    if i % 2:
+        readings = {
+            "temperature_c": round(random.uniform(20, 35), 2),
+            "humidity_pct": round(random.uniform(40, 90), 2),
+            "pm2_5_ug_m3": round(random.uniform(5, 150), 2),
+            "pm10_ug_m3": round(random.uniform(10, 250), 2),
+            "wind_speed_ms": round(random.uniform(0, 12), 2),
+        }
+    else:
+        readings = {
+            "water_level_cm": round(random.uniform(50, 200), 2),
+            "conductivity_us_cm": round(random.uniform(500, 2500), 2),
+        }
+    return device_id, 9.5 + i % 7 / 100, 76.5, readings
+
+
+def run(conn, rows, batch_size):
+    batcher = ReadingBatcher(conn, max_rows=batch_size, max_delay_ms=0, verbose=False)
+    messages = [make_message(i) for i in range(rows)]
+    start = time.perf_counter()
+    for message in messages:
+        batcher.add(*message)
+    batcher.close()
+    elapsed = time.perf_counter() - start
+    return batcher.stats['rows_written'] / elapsed, elapsed
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    # readings has no FK to devices (it is partitioned), so remove both explicitly.
+    cursor.execute("DELETE FROM readings WHERE device_id LIKE 'bench\\_node\\_%'")
+    cursor.execute("DELETE FROM devices WHERE device_id LIKE 'bench\\_node\\_%'")
+    conn.commit()
+    cursor.close()
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    batch_sizes = [int(b) for b in sys.argv[2:]] or DEFAULT_BATCH_SIZES
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    print(f"📊 Inserting {rows} readings from {DEVICE_COUNT} simulated devices per run.\n")
+    print(f"{'batch size':>10} | {'rows/sec':>10} | {'seconds':>8} | speed-up")
+    print("-" * 46)
+    baseline = None
+    try:
+        for batch_size in batch_sizes:
+            cleanup(conn)
+            rate, elapsed = run(conn, rows, batch_size)
+            baseline = baseline or rate
+            print(f"{batch_size:>10} | {rate:>10.0f} | {elapsed:>8.2f} | {rate / baseline:.1f}x")
+    finally:
+        cleanup(conn)
+        conn.close()
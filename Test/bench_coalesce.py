@@ -0,0 +1,155 @@
+# File: bench_coalesce.py
+# Description: Concurrency benchmark of the dashboard endpoints of app.py with and without
+#              request coalescing (COALESCE_WINDOW). N clients, released together like a wall of
+#              screens refreshing, each fetch /get_latest_data, /get_history,
+#              /get_latest_water_data and /get_water_history. Between rounds new readings are
+#              written and the latest-value cache is allowed to go stale, so every round has
+#              fresh data to fetch. Per concurrency level it prints the requests served, the SQL
+#              statements executed, the responses rendered and the request latency.
+#              app.py runs in this process on a throw-away SQLite database (storage.py), so no
+#              MySQL server is needed; the SQL statements are counted on its cursors.
+#
+# Usage:   python Test/bench_coalesce.py [--clients 10,100,500] [--rounds 3]
+
+import argparse
+import datetime
+import logging
+import os
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix='bench_coalesce_')
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['STORAGE_SQLITE_PATH'] = os.path.join(SCRATCH, 'bench.db')
+
+import storage
+from ingest_batcher import ReadingBatcher
+from werkzeug.serving import make_server
+
+import app as dashboard
+
+ENDPOINTS = ('/get_latest_data', '/get_history', '/get_latest_water_data', '/get_water_history')
+
+# Every SQL statement the app sends, whichever thread sends it.
+statements = {'count': 0}
+_statements_lock = threading.Lock()
+_execute = storage.SqliteCursor.execute
+
+
+def _counting_execute(self, operation, params=()):
+    with _statements_lock:
+        statements['count'] += 1
+    return _execute(self, operation, params)
+
+
+def write_readings(count):
+    """ New readings for the air node and both water nodes, as the listener would write them. """
+    conn = storage.connect()
+    batcher = ReadingBatcher(conn, max_rows=count * 3 + 1, max_delay_ms=0, verbose=False, rollups=True)
+    now = datetime.datetime.now()
+    for i in range(count):
+        at = now - datetime.timedelta(seconds=count - i)
+        batcher.add(dashboard.DEVICE_MAP['air'], 9.52, 76.55,
+                    {'temperature_c': round(random.uniform(24, 32), 2), 'humidity_pct': round(random.uniform(60, 90), 2),
+                     'pm2_5_ug_m3': round(random.uniform(5, 80), 2), 'pm10_ug_m3': round(random.uniform(10, 150), 2),
+                     'wind_speed_ms': round(random.uniform(0, 6), 2)}, at)
+        for device_id in dashboard.DEVICE_MAP['water']:
+            batcher.add(device_id, 9.59, 76.52,
+                        {'water_level_cm': round(random.uniform(20, 90), 2), 'salinity_ppt': round(random.uniform(0, 5), 2),
+                         'conductivity_us_cm': round(random.uniform(100, 900), 2), 'tds_ppm': round(random.uniform(50, 500), 2)},
+                        at)
+    batcher.flush()
+    conn.close()
+
+
+def serve():
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)     # no access log line per request
+    server = make_server('127.0.0.1', 0, dashboard.app, threaded=True)
+    server.socket.listen(1024)      # 500 clients connect at once; the default backlog is 128
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def wall_refresh(base_url, clients):
+    """ Release `clients` threads at once, each fetching every dashboard endpoint; returns latencies (s). """
+    barrier = threading.Barrier(clients)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client():
+        barrier.wait()
+        for path in ENDPOINTS:
+            began = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=60) as response:
+                    response.read()
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        print(f"   ⚠️ {len(errors)} failed requests, e.g. {errors[0]}")
+    return latencies
+
+
+def bench(base_url, clients, rounds, window):
+    """ (requests, SQL statements, renders, p50 ms, p99 ms) over `rounds` wall refreshes. """
+    dashboard.request_flights.window = window
+    latencies, queries, renders = [], 0, 0
+    for _ in range(rounds):
+        write_readings(2)
+        time.sleep(dashboard.LATEST_CACHE_MAX_STALENESS + 0.1)     # the cache is due for a refresh
+        queries_before, renders_before = statements['count'], dashboard.request_flights.stats()['executed']
+        latencies += wall_refresh(base_url, clients)
+        queries += statements['count'] - queries_before
+        renders += dashboard.request_flights.stats()['executed'] - renders_before
+    latencies.sort()
+    return (len(latencies), queries, renders, statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99) - 1] * 1000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark request coalescing of the dashboard endpoints.")
+    parser.add_argument('--clients', default='10,100,500')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    socket.setdefaulttimeout(60)
+    storage.SqliteCursor.execute = _counting_execute
+    try:
+        write_readings(200)
+        server, base_url = serve()
+        for path in ENDPOINTS:      # warm the caches and ring buffers first
+            urllib.request.urlopen(base_url + path).read()
+
+        print(f"🚀 {len(ENDPOINTS)} dashboard endpoints per client, {args.rounds} wall refreshes per row, "
+              f"COALESCE_WINDOW={dashboard.COALESCE_WINDOW}s\n")
+        print(f"{'clients':>7} | {'coalescing':<10} | {'requests':>8} | {'SQL stmts':>9} | {'renders':>7} | "
+              f"{'p50 ms':>7} | {'p99 ms':>7}")
+        print("-" * 74)
+        for clients in (int(c) for c in args.clients.split(',')):
+            for label, window in (('off', None), ('on', dashboard.COALESCE_WINDOW)):
+                requests, queries, renders, p50, p99 = bench(base_url, clients, args.rounds, window)
+                print(f"{clients:>7} | {label:<10} | {requests:>8} | {queries:>9} | {renders:>7} | "
+                      f"{p50:>7.1f} | {p99:>7.1f}")
+        server.shutdown()
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
@@ -0,0 +1,149 @@
+# File: bench_export.py
+# Description: Measures /export throughput of data hook api.py (which must be running) in
+#              MB/s and rows/s for each format, plus time to first byte. With --seed N it first
+#              inserts N synthetic readings for throw-away 'bench_export_*' devices spread over
+#              the date range and deletes them afterwards, so a multi-million-row export can be
+#              timed on an otherwise empty database.
+#
+# Usage:   python Test/bench_export.py [--seed ROWS] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+#                                      [--formats ndjson csv parquet] [--url http://localhost:5002]
+# Example: python Test/bench_export.py --seed 2000000 --start 2025-01-01 --end 2025-01-31
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+import mysql.connector
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+DEVICE_COUNT = 20
+SEED_CHUNK_ROWS = 10000
+READ_CHUNK_BYTES = 1 << 16
+
+SQL_SEED = """
+    INSERT INTO readings (device_id, created_at, temperature_c, humidity_pct, pm2_5_ug_m3, pm10_ug_m3,
+                          wind_speed_ms, water_level_cm, conductivity_us_cm)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def seed(conn, rows, start, end):
+    """ Insert `rows` readings evenly spread over [start, end]; returns the seconds it took. """
+    span = (datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(days=1)
+            - datetime.datetime.combine(start, datetime.time())).total_seconds()
+    first = datetime.datetime.combine(start, datetime.time())
+    cursor = conn.cursor()
+    began = time.perf_counter()
+    for offset in range(0, rows, SEED_CHUNK_ROWS):
+        chunk = []
+        for i in range(offset, min(rows, offset + SEED_CHUNK_ROWS)):
+            chunk.append((f"bench_export_{i % DEVICE_COUNT:03d}",
+                          first + datetime.timedelta(seconds=int(i * span / rows)),
+                          round(random.uniform(20, 35), 2), round(random.uniform(40, 90), 2),
+                          round(random.uniform(5, 150), 2), round(random.uniform(10, 250), 2),
+                          round(random.uniform(0, 12), 2), round(random.uniform(50, 200), 2),
+                          round(random.uniform(500, 2500), 2)))
+        cursor.executemany(SQL_SEED, chunk)
+        conn.commit()
+        print(f"\r🌱 Seeded {offset + len(chunk)}/{rows} rows", end='', flush=True)
+    print()
+    cursor.close()
+    return time.perf_counter() - began
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM readings WHERE device_id LIKE 'bench\\_export\\_%'")
+    conn.commit()
+    cursor.close()
+
+
+def count_rows(fmt, path, line_count, gzip_line_count):
+    if fmt == 'ndjson':
+        return line_count
+    if fmt == 'csv':
+        return gzip_line_count - 1     # header
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow.parquet.ParquetFile(path).metadata.num_rows
+
+
+def run(url, fmt, start, end, device_ids):
+    """ Download one export to a temporary file; returns (bytes, rows, seconds, seconds to first byte). """
+    query = f"{url}/export?format={fmt}&start_date={start}&end_date={end}"
+    if device_ids:
+        query += "&device_id=" + ','.join(device_ids)
+    lines = gzip_lines = size = 0
+    inflate = zlib.decompressobj(31)
+    first_byte = None
+    with tempfile.NamedTemporaryFile(suffix='.' + fmt, delete=False) as out:
+        began = time.perf_counter()
+        with urllib.request.urlopen(query) as response:
+            while True:
+                chunk = response.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - began
+                size += len(chunk)
+                out.write(chunk)
+                if fmt == 'ndjson':
+                    lines += chunk.count(b'\n')
+                elif fmt == 'csv':
+                    gzip_lines += inflate.decompress(chunk).count(b'\n')
+        elapsed = time.perf_counter() - began
+    try:
+        rows = count_rows(fmt, out.name, lines, gzip_lines)
+    finally:
+        os.unlink(out.name)
+    return size, rows, elapsed, first_byte or elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the /export endpoint.")
+    parser.add_argument('--url', default='http://localhost:5002')
+    parser.add_argument('--seed', type=int, default=0, help="synthetic rows to insert first (0 = use existing data)")
+    parser.add_argument('--start', type=datetime.date.fromisoformat, default=datetime.date.today() - datetime.timedelta(days=30))
+    parser.add_argument('--end', type=datetime.date.fromisoformat, default=datetime.date.today())
+    parser.add_argument('--formats', nargs='+', default=['ndjson', 'csv', 'parquet'])
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG) if args.seed else None
+    device_ids = []
+    try:
+        if conn:
+            cleanup(conn)
+            seconds = seed(conn, args.seed, args.start, args.end)
+            print(f"🌱 {args.seed} rows in {seconds:.1f}s")
+            device_ids = [f"bench_export_{i:03d}" for i in range(DEVICE_COUNT)]
+
+        print(f"📊 Exporting {args.start} .. {args.end}\n")
+        print(f"{'format':>8} | {'rows':>10} | {'MB':>8} | {'MB/s':>7} | {'rows/s':>9} | {'TTFB ms':>7}")
+        print("-" * 64)
+        for fmt in args.formats:
+            try:
+                size, rows, elapsed, first_byte = run(args.url, fmt, args.start, args.end, device_ids)
+            except urllib.error.HTTPError as e:
+                print(f"{fmt:>8} | ❌ HTTP {e.code}: {e.read().decode(errors='replace')}")
+                continue
+            rate = f"{rows / elapsed:>9.0f}" if rows is not None else f"{'?':>9}"
+            print(f"{fmt:>8} | {rows if rows is not None else '?':>10} | {size / 1e6:>8.1f} | "
+                  f"{size / 1e6 / elapsed:>7.1f} | {rate} | {first_byte * 1000:>7.0f}")
+    finally:
+        if conn:
+            cleanup(conn)
+            conn.close()
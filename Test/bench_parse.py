@@ -0,0 +1,90 @@
+# File: bench_parse.py
+# Description: Parse throughput of the listener's payload decoding (payload_codec.py) for the
+#              payloads the air node can send: the current JSON object with every unused
+#              sensor as null (through the previous json.loads + whitelist code and through
+#              decode()), the compact binary layout, and batches of timestamped readings in
+#              JSON and binary. Prints bytes per payload, µs per payload and readings/sec.
+#              No broker or database is needed.
+#
+# Usage:   python Test/bench_parse.py [readings per batch] [seconds per case]
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import payload_codec
+
+DEVICE_ID = "sensor_node_01"
+LATITUDE, LONGITUDE = 9.5196, 76.5547
+AIR_READING = {"temperature_c": 28.4, "humidity_pct": 71.2, "pm2_5_ug_m3": 35.1,
+               "pm10_ug_m3": 60.3, "wind_speed_ms": 2.4}
+# What air_quality_node.ino publishes: every other sensor key is present as null.
+AIR_SENSORS = dict(AIR_READING, water_level_cm=None, salinity_ppt=None)
+
+
+def legacy_parse(payload):
+    """ The listener's JSON path before payload_codec (one reading per payload). """
+    data = json.loads(payload.decode())
+    device_id = data.get('device_id')
+    sensor_readings = data.get('sensors', {})
+    if not device_id or not isinstance(sensor_readings, dict):
+        return None
+    readings = {key: value for key, value in sensor_readings.items()
+                if key in payload_codec.ALLOWED_SENSOR_KEYS and value is not None}
+    return device_id, data.get('latitude'), data.get('longitude'), readings
+
+
+def payloads(batch_size):
+    """ (name, decode function, payload, readings per payload) """
+    now = int(time.time())
+    single_json = json.dumps({"device_id": DEVICE_ID, "latitude": LATITUDE, "longitude": LONGITUDE,
+                              "sensors": AIR_SENSORS}).encode()
+    batch = [(now - 5 * (batch_size - i), AIR_READING) for i in range(batch_size)]
+    batch_json = json.dumps({"device_id": DEVICE_ID, "latitude": LATITUDE, "longitude": LONGITUDE,
+                             "readings": [{"ts": ts, "sensors": sensors} for ts, sensors in batch]}).encode()
+    return [
+        ('JSON single (legacy path)', legacy_parse, single_json, 1),
+        ('JSON single', payload_codec.decode, single_json, 1),
+        ('binary single', payload_codec.decode,
+         payload_codec.encode_binary(DEVICE_ID, [(0, AIR_READING)], LATITUDE, LONGITUDE), 1),
+        (f'JSON batch of {batch_size}', payload_codec.decode, batch_json, batch_size),
+        (f'binary batch of {batch_size}', payload_codec.decode,
+         payload_codec.encode_binary(DEVICE_ID, batch, LATITUDE, LONGITUDE), batch_size),
+    ]
+
+
+def measure(decode, payload, seconds):
+    """ Best-of-3 seconds per decode() call. """
+    iterations = 1000
+    while True:     # size the loop to roughly `seconds` / 3
+        started = time.perf_counter()
+        for _ in range(iterations):
+            decode(payload)
+        elapsed = time.perf_counter() - started
+        if elapsed > seconds / 3 / 4:
+            break
+        iterations *= 4
+    best = elapsed / iterations
+    for _ in range(2):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            decode(payload)
+        best = min(best, (time.perf_counter() - started) / iterations)
+    return best
+
+
+if __name__ == '__main__':
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 1.5
+    print(f"🚀 Benchmarking payload decoding ({batch_size} readings per batch)...\n")
+    print(f"{'payload':<28} | {'bytes':>6} | {'B/reading':>9} | {'µs/payload':>10} | {'readings/s':>11}")
+    print("-" * 76)
+    baseline = None
+    for name, decode, payload, readings in payloads(batch_size):
+        per_call = measure(decode, payload, seconds)
+        rate = readings / per_call
+        baseline = baseline or rate
+        print(f"{name:<28} | {len(payload):>6} | {len(payload) / readings:>9.1f} | {per_call * 1e6:>10.2f} | "
+              f"{rate:>11.0f}  ({rate / baseline:.1f}x)")
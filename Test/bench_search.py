@@ -0,0 +1,125 @@
+# File: bench_search.py
+# Description: /search of a past day served from the database and from its snapshot files
+#              (day_snapshots.py). Seeds --days days of readings from the three DEVICE_MAP nodes
+#              (air every --interval seconds, water level and water quality alike), compacts
+#              them, then times uncached /search requests both ways (the LRU is cleared before
+#              each one), the read step alone (the SQL query vs. the memory-mapped files) and a
+#              revalidation that ends in a 304. Also prints the size of a day's snapshot files
+#              next to its JSON response.
+#              app.py runs in this process on a throw-away SQLite database (storage.py), so no
+#              MySQL server is needed.
+#
+# Usage:   python Test/bench_search.py [--days 3] [--interval 10] [--repeat 5]
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix='bench_search_')
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['STORAGE_SQLITE_PATH'] = os.path.join(SCRATCH, 'bench.db')
+
+import storage
+from day_snapshots import DaySnapshots, read_columns
+from ingest_batcher import ReadingBatcher
+
+import app as dashboard
+
+
+def seed(days, interval):
+    """ Readings of the air node and both water nodes every `interval` seconds for `days` days before today. """
+    conn = storage.connect()
+    batcher = ReadingBatcher(conn, max_rows=5000, max_delay_ms=0, verbose=False, rollups=False)
+    start = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time())
+    water_level, water_quality = dashboard.DEVICE_MAP['water']
+    for i in range(days * 86400 // interval):
+        at = start + datetime.timedelta(seconds=i * interval)
+        batcher.add(dashboard.DEVICE_MAP['air'], 9.52, 76.55,
+                    {'temperature_c': round(random.uniform(24, 32), 2), 'humidity_pct': round(random.uniform(60, 90), 2),
+                     'pm2_5_ug_m3': round(random.uniform(5, 80), 2), 'pm10_ug_m3': round(random.uniform(10, 150), 2),
+                     'wind_speed_ms': round(random.uniform(0, 6), 2)}, at)
+        batcher.add(water_level, 9.59, 76.52,
+                    {'water_level_cm': round(random.uniform(20, 90), 2), 'salinity_ppt': round(random.uniform(0, 5), 2)}, at)
+        batcher.add(water_quality, 9.59, 76.52, {'tds_ppm': round(random.uniform(50, 500), 2)}, at)
+    batcher.flush()
+    conn.close()
+
+
+def timed(function, repeat):
+    """ (median ms, last result) of `repeat` calls. """
+    timings, result = [], None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - began) * 1000)
+    return statistics.median(timings), result
+
+
+def query_day(day):
+    conn = dashboard.db_pool.acquire()
+    try:
+        sql, params = dashboard.search_query(day)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /search from the database and from day snapshots.")
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--interval', type=int, default=10, help="seconds between readings of each node")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        seed(args.days, args.interval)
+        snapshots = DaySnapshots(os.path.join(SCRATCH, 'snapshots'), settle_seconds=0)
+        conn = storage.connect(autocommit=True)
+        began = time.perf_counter()
+        written = snapshots.compact_pending(conn, max_days=0)
+        compaction = time.perf_counter() - began
+        conn.close()
+
+        day = datetime.date.today() - datetime.timedelta(days=1)
+        manifest = snapshots.manifest(day)
+        client = dashboard.app.test_client()
+
+        def search(use_snapshots):
+            dashboard.day_snapshots = snapshots if use_snapshots else None
+            dashboard.search_cache.clear()
+            return client.get(f'/search?date={day}')
+
+        db_ms, response = timed(lambda: search(False), args.repeat)
+        body_bytes = len(response.get_data())
+        snap_ms, _ = timed(lambda: search(True), args.repeat)
+        query_ms, rows = timed(lambda: query_day(day), args.repeat)
+        day_dir = os.path.join(snapshots.directory, day.isoformat())
+        read_ms, _ = timed(lambda: [read_columns(os.path.join(day_dir, entry['file']), dashboard.SEARCH_METRICS)
+                                    for entry in manifest['devices'].values()], args.repeat)
+        etag = search(True).headers['ETag']
+        revalidate_ms, response = timed(lambda: client.get(f'/search?date={day}', headers={'If-None-Match': etag}),
+                                        args.repeat)
+        assert response.status_code == 304
+
+        files = sum(entry['bytes'] for entry in manifest['devices'].values())
+        print(f"🚀 {len(written)} days compacted in {compaction:.2f}s; {day}: {len(rows)} readings, "
+              f"snapshot files {files / 1024:.0f} KB ({files / len(rows):.1f} B/reading), "
+              f"JSON response {body_bytes / 1024:.0f} KB\n")
+        print(f"{'/search ' + str(day):<28} | {'database':>10} | {'snapshot':>10}")
+        print("-" * 54)
+        print(f"{'uncached request (ms)':<28} | {db_ms:>10.1f} | {snap_ms:>10.1f}")
+        print(f"{'read step only (ms)':<28} | {query_ms:>10.1f} | {read_ms:>10.1f}")
+        print(f"{'304 revalidation (ms)':<28} | {'-':>10} | {revalidate_ms:>10.2f}")
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
@@ -0,0 +1,173 @@
+# File: bench_stats.py
+# Description: Measures /stats latency of data hook api.py (which must be running) for a
+#              30-day window across all devices: the whole window and 1d/1h buckets, with the
+#              sql engine (aggregates pushed down into MySQL) and the numpy engine (raw values
+#              reduced in Python, with percentiles). With --seed N it first inserts N synthetic
+#              readings for throw-away 'bench_stats_*' devices over the window and deletes them
+#              afterwards. With --offline N no server or database is used: N synthetic rows go
+#              straight through readings_stats' numpy path, which shows the in-process share.
+#
+# Usage:   python Test/bench_stats.py [--seed ROWS] [--days 30] [--url http://localhost:5002] [--repeat 3]
+#          python Test/bench_stats.py --offline 1500000
+# Example: python Test/bench_stats.py --seed 1500000
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import readings_stats
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+DEVICE_COUNT = 20
+SEED_CHUNK_ROWS = 10000
+FETCH_ROWS = 20000      # STATS_FETCH_SIZE default of data hook api.py
+
+SQL_SEED = """
+    INSERT INTO readings (device_id, created_at, temperature_c, humidity_pct, pm2_5_ug_m3, pm10_ug_m3,
+                          wind_speed_ms, water_level_cm, conductivity_us_cm)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# (label, extra query arguments)
+CASES = [
+    ('whole window, sql', {'bucket': 'all', 'percentiles': '', 'engine': 'sql'}),
+    ('1d buckets, sql', {'bucket': '1d', 'percentiles': '', 'engine': 'sql'}),
+    ('1h buckets, sql', {'bucket': '1h', 'percentiles': '', 'engine': 'sql'}),
+    ('whole window, numpy + pct', {'bucket': 'all'}),
+    ('1d buckets, numpy + pct', {'bucket': '1d'}),
+    ('1h buckets, numpy + pct', {'bucket': '1h'}),
+]
+
+
+def seed(conn, rows, start, end):
+    """ Insert `rows` readings evenly spread over [start, end). """
+    span = (end - start).total_seconds()
+    cursor = conn.cursor()
+    for offset in range(0, rows, SEED_CHUNK_ROWS):
+        chunk = []
+        for i in range(offset, min(rows, offset + SEED_CHUNK_ROWS)):
+            chunk.append((f"bench_stats_{i % DEVICE_COUNT:03d}", start + datetime.timedelta(seconds=int(i * span / rows)),
+                          round(random.uniform(20, 35), 2), round(random.uniform(40, 90), 2),
+                          round(random.uniform(5, 150), 2), round(random.uniform(10, 250), 2),
+                          round(random.uniform(0, 12), 2), round(random.uniform(50, 200), 2),
+                          round(random.uniform(500, 2500), 2)))
+        cursor.executemany(SQL_SEED, chunk)
+        conn.commit()
+        print(f"\r🌱 Seeded {offset + len(chunk)}/{rows} rows", end='', flush=True)
+    print()
+    cursor.close()
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM readings WHERE device_id LIKE 'bench\\_stats\\_%'")
+    conn.commit()
+    cursor.close()
+
+
+def fetch(url):
+    """ One /stats request; returns (seconds, groups, engine). """
+    began = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        body = json.loads(response.read())
+    return time.perf_counter() - began, len(body['data']), body['engine']
+
+
+def bench_http(base_url, start, end, repeat):
+    print(f"📊 /stats {start:%Y-%m-%d} .. {end:%Y-%m-%d} (all devices, all metrics), best of {repeat}\n")
+    print(f"{'case':<28} | {'groups':>7} | {'best ms':>8} | {'median ms':>9}")
+    print("-" * 62)
+    for label, extra in CASES:
+        query = dict(start_date=start.isoformat(), end_date=end.isoformat(), **extra)
+        url = f"{base_url}/stats?" + '&'.join(f"{k}={v}" for k, v in query.items())
+        timings = []
+        try:
+            for _ in range(repeat):
+                seconds, groups, _ = fetch(url)
+                timings.append(seconds * 1000)
+        except urllib.error.HTTPError as e:
+            print(f"{label:<28} | ❌ HTTP {e.code}: {e.read().decode(errors='replace')[:80]}")
+            continue
+        timings.sort()
+        print(f"{label:<28} | {groups:>7} | {timings[0]:>8.0f} | {timings[len(timings) // 2]:>9.0f}")
+
+
+def bench_offline(rows, days):
+    """ ColumnBatches + summarize() on synthetic fetch batches shaped like columns_query() rows. """
+    if readings_stats.numpy is None:
+        sys.exit("❌ numpy is not installed (pip install numpy)")
+    start = datetime.datetime(2026, 1, 1)
+    end = start + datetime.timedelta(days=days)
+    span = int((end - start).total_seconds())
+    metrics = readings_stats.METRIC_COLUMNS
+    print(f"🧪 Building {rows} synthetic rows ({DEVICE_COUNT} devices, {len(metrics)} metrics, {days} days)...")
+    batches = []
+    for offset in range(0, rows, FETCH_ROWS):
+        batches.append([(f"bench_stats_{i % DEVICE_COUNT:03d}", i * span // rows,
+                         *(round(random.uniform(0, 100), 2) if m != 'salinity_ppt' else None for m in metrics))
+                        for i in range(offset, min(rows, offset + FETCH_ROWS))])
+
+    # The server only ever holds one fetch batch; keep the prepared rows out of the collector's
+    # way so the timings are not dominated by garbage collection passes over them.
+    gc.freeze()
+
+    print(f"\n{'bucket':<8} | {'collect ms':>10} | {'reduce ms':>9} | {'groups':>7} | {'rows/s':>10}")
+    print("-" * 56)
+    for bucket in ('all', '1d', '1h'):
+        began = time.perf_counter()
+        collected = readings_stats.ColumnBatches(metrics)
+        for batch in batches:
+            collected.add(batch)
+        columns = collected.columns()
+        collected_at = time.perf_counter()
+        groups = readings_stats.summarize(collected.device_ids, *columns, start, end,
+                                          readings_stats.parse_bucket(bucket, start, end),
+                                          readings_stats.DEFAULT_PERCENTILES)
+        done = time.perf_counter()
+        print(f"{bucket:<8} | {(collected_at - began) * 1000:>10.0f} | {(done - collected_at) * 1000:>9.0f} | "
+              f"{len(groups):>7} | {rows / (done - began):>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the /stats endpoint.")
+    parser.add_argument('--url', default='http://localhost:5002')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0, help="synthetic rows to insert first (0 = use existing data)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--offline', type=int, default=0, help="rows for the numpy-only benchmark (no server)")
+    args = parser.parse_args()
+
+    if args.offline:
+        bench_offline(args.offline, args.days)
+        sys.exit(0)
+
+    end = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+    start = end - datetime.timedelta(days=args.days)
+    conn = None
+    if args.seed:
+        import mysql.connector
+        conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        if conn:
+            cleanup(conn)
+            seed(conn, args.seed, start, end)
+        bench_http(args.url, start, end, args.repeat)
+    finally:
+        if conn:
+            cleanup(conn)
+            conn.close()
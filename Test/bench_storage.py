@@ -0,0 +1,208 @@
+# File: bench_storage.py
+# Description: Runs the same ingest and query workloads against each storage backend
+#              (storage.py) and prints them side by side:
+#                ingest  - synthetic readings through ReadingBatcher (device registry and rollups
+#                          on, as in the listener) from --writers threads, BATCH rows per commit
+#                queries - the statements behind the dashboard and API endpoints: latest-cache
+#                          refresh, chart history tail, rollup buckets, /stats (sql aggregates
+#                          and the raw columns of the numpy engine) and a raw day for /export
+#              SQLite runs on a throw-away file (or --sqlite-path) and needs nothing installed.
+#              MySQL uses the MYSQL_* settings of storage.py; its 'bench_storage_*' devices are
+#              deleted before and after the run, and it is skipped if the server is unreachable.
+#
+# Usage:   python Test/bench_storage.py [--backends sqlite,mysql] [--rows 100000] [--devices 20]
+#                                       [--days 7] [--writers 2] [--batch 50] [--repeat 5]
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import exporter
+import readings_stats
+import storage
+from device_registry import DeviceRegistry
+from history_buffer import SQL_DEVICE_TAIL
+from ingest_batcher import ReadingBatcher
+from latest_cache import SQL_NEW_ROWS
+from rollups import rollup_query
+
+DEVICE_PREFIX = 'bench_storage_'
+AIR_METRICS = ('temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3', 'wind_speed_ms')
+WATER_METRICS = ('water_level_cm', 'conductivity_us_cm', 'tds_ppm')
+CLEANUP_TABLES = ('readings', 'readings_1m', 'readings_1h', 'readings_1d', 'devices')
+
+
+def synthetic_reading(i, device_count, start, span_seconds, rows):
+    """ (device_id, readings, created_at) of row i: air and water nodes alternate. """
+    device = i % device_count
+    metrics = AIR_METRICS if device % 2 == 0 else WATER_METRICS
+    created_at = start + datetime.timedelta(seconds=int(i * span_seconds / rows))
+    return (f"{DEVICE_PREFIX}{device:03d}", {m: round(random.uniform(0, 500), 2) for m in metrics}, created_at)
+
+
+def cleanup(config, device_ids):
+    conn = storage.connect(config)
+    cursor = conn.cursor()
+    placeholders = ', '.join(['%s'] * len(device_ids))
+    for table in CLEANUP_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE device_id IN ({placeholders})", tuple(device_ids))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def ingest(config, args, start, end):
+    """ Rows/s of args.rows readings written by args.writers threads, each owning its devices. """
+    span = (end - start).total_seconds()
+    registry = DeviceRegistry()
+    errors = []
+
+    def writer(index):
+        conn = storage.connect(config)
+        batcher = ReadingBatcher(conn, max_rows=args.batch, max_delay_ms=0, verbose=False,
+                                 registry=registry, rollups=True)
+        for i in range(index, args.rows, args.writers):
+            device_id, readings, created_at = synthetic_reading(i, args.devices, start, span, args.rows)
+            batcher.add(device_id, None, None, readings, created_at)
+        batcher.flush()
+        if batcher.stats['rows_dropped']:
+            errors.append(batcher.last_error)
+        conn.close()
+
+    # Writer k takes rows k, k + writers, ..., i.e. only devices k, k + writers, ... (as the
+    # listener's dispatch mode shards by device), so writers never touch the same device rows.
+    assert args.devices % args.writers == 0, "--devices must be a multiple of --writers"
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(args.writers)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    if errors:
+        print(f"   ⚠️ Some batches failed: {errors[0]}")
+    return elapsed
+
+
+def query_workloads(device_ids, start, end):
+    """ (label, cursor options, sql, params, fetch size or None for fetchall) """
+    day = (end - datetime.timedelta(days=1)).date()
+    window = readings_stats.aggregate_query(device_ids, readings_stats.METRIC_COLUMNS, start, end, 86400)
+    columns = readings_stats.columns_query(device_ids, readings_stats.METRIC_COLUMNS, start, end)
+    return [
+        ('latest refresh (5000 ids)', {'dictionary': True}, SQL_NEW_ROWS, None, None),
+        ('history tail (120 rows)', {'dictionary': True}, SQL_DEVICE_TAIL, (device_ids[0], 120), None),
+        ('rollup 1h, one device', {'dictionary': True},
+         *rollup_query('1h', device_ids[0], start.date().isoformat(), end.date().isoformat(), order='ASC'), None),
+        ('stats sql, 1d buckets', {}, *window, None),
+        ('stats numpy columns', {'buffered': False}, *columns, 20000),
+        ('export one day (raw)', {'buffered': False, 'raw': True},
+         *exporter.export_query(device_ids, day, day), 5000),
+    ]
+
+
+def run_query(conn, cursor_options, sql, params, fetch_size):
+    """ (seconds, rows) of one execution, including reading every row. """
+    began = time.perf_counter()
+    cursor = conn.cursor(**cursor_options)
+    cursor.execute(sql, params)
+    if fetch_size:
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                break
+            rows += len(batch)
+    else:
+        rows = len(cursor.fetchall())
+    cursor.close()
+    return time.perf_counter() - began, rows
+
+
+def bench_backend(config, args, device_ids, start, end):
+    """ {workload: (value, unit)} for one backend. """
+    results = {}
+    print(f"\n🗄️ {storage.describe(config)}")
+    elapsed = ingest(config, args, start, end)
+    results['ingest'] = (args.rows / elapsed, 'rows/s')
+    print(f"   ingest: {args.rows} rows in {elapsed:.2f}s ({args.rows / elapsed:.0f} rows/s)")
+
+    conn = storage.connect(config, autocommit=True)     # like the API servers' pooled connections
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM readings")
+    max_id = cursor.fetchone()[0]
+    cursor.close()
+    for label, options, sql, params, fetch_size in query_workloads(device_ids, start, end):
+        if params is None:
+            params = (max(0, max_id - 5000), 5000)
+        timings, rows = [], 0
+        for _ in range(args.repeat):
+            seconds, rows = run_query(conn, options, sql, params, fetch_size)
+            timings.append(seconds * 1000)
+        results[label] = (statistics.median(timings), 'ms')
+        print(f"   {label:<28} {statistics.median(timings):>9.1f} ms median ({rows} rows)")
+    conn.close()
+    return results
+
+
+def print_table(results):
+    backends = list(results)
+    print(f"\n{'workload':<28} | " + " | ".join(f"{b:>16}" for b in backends))
+    print("-" * (31 + 19 * len(backends)))
+    for workload in next(iter(results.values())):
+        cells = []
+        for backend in backends:
+            value, unit = results[backend].get(workload, (None, ''))
+            cells.append(f"{'-' if value is None else f'{value:,.1f} {unit}':>16}")
+        print(f"{workload:<28} | " + " | ".join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest and queries per storage backend.")
+    parser.add_argument('--backends', default='sqlite,mysql')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--writers', type=int, default=2, help="writer threads (INGEST_WRITER_THREADS)")
+    parser.add_argument('--batch', type=int, default=50, help="rows per transaction (INGEST_BATCH_MAX_ROWS)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sqlite-path', default='', help="SQLite file to use (default: a temporary one)")
+    args = parser.parse_args()
+
+    end = datetime.datetime.now().replace(microsecond=0)
+    start = end - datetime.timedelta(days=args.days)
+    device_ids = [f"{DEVICE_PREFIX}{d:03d}" for d in range(args.devices)]
+    print(f"🚀 {args.rows} readings from {args.devices} devices over {args.days} days, "
+          f"{args.writers} writer(s), {args.batch} rows per batch")
+
+    results = {}
+    for name in args.backends.split(','):
+        config = storage.backend_config(name)
+        scratch = None
+        if name == 'sqlite' and not args.sqlite_path:
+            scratch = tempfile.mkdtemp(prefix='bench_storage_')
+            config['path'] = os.path.join(scratch, 'bench.db')
+        elif name == 'sqlite':
+            config['path'] = args.sqlite_path
+        try:
+            cleanup(config, device_ids)
+        except storage.Error as e:
+            print(f"\n⏭️ Skipping {name}: {e}")
+            continue
+        try:
+            results[name] = bench_backend(config, args, device_ids, start, end)
+        finally:
+            cleanup(config, device_ids)
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    if results:
+        print_table(results)
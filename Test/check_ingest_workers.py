@@ -0,0 +1,165 @@
+# File: check_ingest_workers.py
+# Description: End-to-end check of the multi-process listener (INGEST_WORKERS > 1). Starts
+#              the in-process stand-in broker from mini_broker.py (or uses --broker host:port,
+#              e.g. a local Mosquitto), runs "mqtt listener.py" with N workers in the given
+#              mode, publishes messages from simulated devices and compares the per-worker
+#              stats the listener writes to INGEST_STATS_FILE:
+#                shared   - every message ingested exactly once, every worker got a share
+#                dispatch - every worker ingested exactly the messages of the devices that
+#                           shard_for() assigns to it
+#              The listener spools into a temporary directory; if MySQL is reachable the
+#              readings are written there too (devices 'check_worker_*') and deleted afterwards.
+#
+# Usage:   python Test/check_ingest_workers.py [--workers 3] [--mode shared|dispatch|both]
+#                                              [--messages 3000] [--devices 50] [--broker host:port]
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ingest_workers import shard_for
+from mini_broker import MiniBroker
+
+LISTENER = os.path.join(ROOT, 'mqtt listener.py')
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+
+
+def read_stats(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def wait_for(condition, timeout, interval=0.5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(interval)
+    return None
+
+
+def publish(host, port, messages, devices):
+    """ Publish `messages` readings round-robin over `devices`; returns per-device counts. """
+    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id="check-ingest-workers")
+    client.connect(host, port, 60)
+    client.loop_start()
+    counts = {}
+    for i in range(messages):
+        device_id = f"check_worker_{i % devices:03d}"
+        payload = {"device_id": device_id, "latitude": 9.5, "longitude": 76.5,
+                   "sensors": {"temperature_c": 20 + i % 10, "humidity_pct": 50}}
+        client.publish("iot/data/air_quality", json.dumps(payload)).wait_for_publish()
+        counts[device_id] = counts.get(device_id, 0) + 1
+    client.disconnect()
+    client.loop_stop()
+    return counts
+
+
+def run(mode, workers, messages, devices, host, port, timeout):
+    workdir = tempfile.mkdtemp(prefix='ingest-workers-')
+    stats_path = os.path.join(workdir, 'stats.json')
+    env = dict(os.environ, MQTT_BROKER_IP=host, MQTT_PORT=str(port), INGEST_WORKERS=str(workers),
+               INGEST_WORKER_MODE=mode, INGEST_STATS_FILE=stats_path, INGEST_STATS_INTERVAL='1',
+               INGEST_SPOOL_DIR=os.path.join(workdir, 'spool'), INGEST_SPOOL_FSYNC='0')
+    listener = subprocess.Popen([sys.executable, LISTENER], env=env, cwd=workdir,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        # Workers report once they are subscribed (after trying MySQL, which may take a while).
+        ready = wait_for(lambda: (read_stats(stats_path) or {}).get('workers', {}).keys() >= set(map(str, range(workers))),
+                         timeout)
+        if not ready:
+            print(f"❌ {mode}: not all {workers} workers came up within {timeout}s")
+            return False
+        time.sleep(1)
+        counts = publish(host, port, messages, devices)
+        done = wait_for(lambda: (lambda s: s and s['totals'].get('enqueued', 0) + s['totals'].get('spilled', 0) >= messages
+                                 and s)(read_stats(stats_path)), timeout)
+        stats = done or read_stats(stats_path)
+    finally:
+        if os.name == 'nt':
+            listener.terminate()
+        else:
+            listener.send_signal(signal.SIGINT)
+        try:
+            listener.wait(60)
+        except subprocess.TimeoutExpired:
+            listener.kill()
+
+    per_worker = {int(i): w.get('enqueued', 0) + w.get('spilled', 0) for i, w in stats['workers'].items()}
+    total = sum(per_worker.values())
+    print(f"\n📊 {mode} mode, {workers} workers: {total}/{messages} messages ingested")
+    for index in sorted(per_worker):
+        print(f"   worker {index}: {per_worker[index]}")
+
+    ok = total == messages
+    if mode == 'shared':
+        ok = ok and all(per_worker.get(i, 0) > 0 for i in range(workers))
+    else:
+        expected = {i: 0 for i in range(workers)}
+        for device_id, count in counts.items():
+            expected[shard_for(device_id, workers)] += count
+        ok = ok and expected == per_worker
+        if expected != per_worker:
+            print(f"   expected by device shard: {expected}")
+    print("✅ passed" if ok else "❌ failed")
+    return ok
+
+
+def cleanup():
+    try:
+        import mysql.connector
+        conn = mysql.connector.connect(**DB_CONFIG)
+    except Exception:
+        return
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM readings WHERE device_id LIKE 'check\\_worker\\_%'")
+    cursor.execute("DELETE FROM devices WHERE device_id LIKE 'check\\_worker\\_%'")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check multi-process ingestion against a broker.")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--mode', choices=['shared', 'dispatch', 'both'], default='both')
+    parser.add_argument('--messages', type=int, default=3000)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--broker', help="host:port of an existing broker (default: in-process stand-in)")
+    parser.add_argument('--timeout', type=int, default=120)
+    args = parser.parse_args()
+
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        port = int(port)
+    else:
+        broker = MiniBroker(port=0).start()
+        host, port = broker.host, broker.port
+        print(f"🧪 Stand-in broker on {host}:{port}")
+
+    modes = ['shared', 'dispatch'] if args.mode == 'both' else [args.mode]
+    try:
+        results = [run(mode, args.workers, args.messages, args.devices, host, port, args.timeout) for mode in modes]
+    finally:
+        cleanup()
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,116 @@
+# File: check_query_plans.py
+# Description: Runs EXPLAIN on every read query issued by app.py and data hook api.py and
+#              exits with status 1 if any of them reads the 'readings' table with a full
+#              table scan (type = ALL). Run it after schema changes or query edits. For the
+#              partitioned table it also prints how many partitions each query touches, so
+#              date-range queries can be checked for partition pruning.
+#
+#              The optimizer may prefer a full scan on a nearly empty table, so run this
+#              against a database with a realistic amount of data (a warning is printed
+#              when 'readings' has fewer than MIN_ROWS_FOR_RELIABLE_PLANS rows).
+#
+# Usage: python Test/check_query_plans.py
+
+import datetime
+import os
+import runpy
+import sys
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as dashboard
+import exporter
+import history_buffer
+import latest_cache
+import readings_stats
+
+data_hook_api = runpy.run_path(os.path.join(ROOT, 'data hook api.py'), run_name='data_hook_api')
+
+DB_CONFIG = data_hook_api['DB_CONFIG']
+MIN_ROWS_FOR_RELIABLE_PLANS = 10000
+EXEMPT_TABLES = {'devices', 'd'}    # a handful of rows; a scan is the cheapest plan
+
+
+def endpoint_queries(cursor):
+    """ (name, sql, params) for every query an endpoint can issue, with representative arguments. """
+    cursor.execute("SELECT COALESCE(MAX(id), 0), DATE(COALESCE(MAX(created_at), NOW())) FROM readings")
+    max_id, last_day = cursor.fetchone()
+    air = dashboard.DEVICE_MAP['air']
+    water = dashboard.DEVICE_MAP['water']
+    day = str(last_day)
+
+    queries = [
+        ('chart history load', history_buffer.SQL_DEVICE_TAIL, (air, dashboard.HISTORY_BUFFER_ROWS)),
+        ('/search', *dashboard.search_query(last_day)),
+        ('latest cache refresh', latest_cache.SQL_NEW_ROWS, (max(0, max_id - 1000), 5000)),
+        ('/export', *exporter.export_query([], last_day, last_day)),
+        ('/export device_id', *exporter.export_query([air], last_day, last_day)),
+        ('latest cache warm-up', latest_cache.SQL_LATEST_METRIC.format(metric='tds_ppm'), (water[-1],)),
+    ]
+    window = (datetime.datetime.combine(last_day, datetime.time()),
+              datetime.datetime.combine(last_day, datetime.time()) + datetime.timedelta(days=1))
+    queries += [
+        ('/stats engine=sql', *readings_stats.aggregate_query([], latest_cache.METRIC_COLUMNS, *window, 3600)),
+        ('/stats engine=sql device_id', *readings_stats.aggregate_query([air], ('temperature_c',), *window, None)),
+        ('/stats engine=numpy', *readings_stats.columns_query([], latest_cache.METRIC_COLUMNS, *window)),
+    ]
+    readings_args = [
+        {},
+        {'device_id': air},
+        {'device_id': air, 'start_date': day, 'end_date': day},
+        {'start_date': day, 'end_date': day},
+        {'device_id': air, 'sort': 'id', 'order': 'ASC', 'limit': '10'},
+        {'device_id': air, 'start_date': day, 'end_date': day, 'resolution': '1m'},
+        {'start_date': day, 'end_date': day, 'resolution': '1h'},
+        {'device_id': air, 'resolution': '1d'},
+        {'device_id': air, 'paginate': '1'},
+        {'start_date': day, 'end_date': day, 'paginate': '1', 'order': 'ASC'},
+        {'device_id': air, 'cursor': data_hook_api['encode_cursor'](
+            {'created_at': datetime.datetime.combine(last_day, datetime.time(12)), 'id': max_id}, 'DESC')},
+    ]
+    for args in readings_args:
+        sql, params = data_hook_api['build_readings_query'](args)
+        queries.append((f"/readings {args}", sql, params))
+    return queries
+
+
+def full_scans(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql.strip().rstrip(';'), params)
+    columns = [c[0] for c in cursor.description]
+    plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return [step for step in plan
+            if step['type'] == 'ALL'
+            and step['table'] and not step['table'].startswith('<')     # <union..>/<derived..> temp tables
+            and step['table'] not in EXEMPT_TABLES], plan
+
+
+if __name__ == '__main__':
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM readings")
+    row_count = cursor.fetchone()[0]
+    if row_count < MIN_ROWS_FOR_RELIABLE_PLANS:
+        print(f"⚠️ Only {row_count} rows in 'readings'; the optimizer may choose scans that it would not choose in production.")
+
+    failures = 0
+    for name, sql, params in endpoint_queries(cursor):
+        scans, plan = full_scans(cursor, sql, params)
+        keys = ', '.join(f"{step['table']}:{step['type']}/{step['key']}" for step in plan)
+        # Partition pruning (migration 002): show how many partitions each readings step touches.
+        pruned = [f"{step['table']}:{len(step['partitions'].split(','))} partition(s)"
+                  for step in plan if step.get('partitions')]
+        if pruned:
+            keys += ' | ' + ', '.join(pruned)
+        if scans:
+            failures += 1
+            print(f"❌ {name}: full scan of {', '.join(step['table'] for step in scans)}  [{keys}]")
+        else:
+            print(f"✅ {name}: [{keys}]")
+
+    cursor.close()
+    conn.close()
+    print(f"\n{failures} quer{'y' if failures == 1 else 'ies'} fall back to a full table scan.")
+    sys.exit(1 if failures else 0)
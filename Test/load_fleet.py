@@ -0,0 +1,334 @@
+# File: load_fleet.py
+# Description: Fleet-scale load generator and end-to-end ingest benchmark. Simulates any
+#              number of air-quality, water-level and water-quality nodes with asyncio, each
+#              publishing the same payload shape as its firmware (plus a 'sent_at' timestamp)
+#              at a configurable interval with jitter. A poller thread watches the readings
+#              table for the simulated devices and matches every new row to the oldest
+#              unmatched message of its device, giving publish-to-row-visible latency.
+#
+#              Reports sustained rows/sec and latency percentiles over the measurement window
+#              (after --warmup) and writes them, with the run configuration, to a JSON report
+#              so runs can be compared to catch regressions. Simulated devices are named
+#              'load_<run>_<kind>_<n>' and deleted afterwards (unless --keep).
+#
+#              The MQTT listener must be running against the same broker and database.
+#              --mini-broker starts the stand-in broker from mini_broker.py in this process
+#              (point the listener at it with MQTT_PORT).
+#
+# Usage:   python Test/load_fleet.py [--air 500] [--water-level 250] [--water-quality 250]
+#                                    [--interval 10] [--jitter 0.1] [--duration 120] [--warmup 20]
+#                                    [--connections 50] [--qos 0] [--broker localhost:1883]
+#                                    [--report load_report.json] [--listener-stats FILE] [--keep]
+# Example: python Test/load_fleet.py --air 2000 --water-level 1000 --water-quality 1000 --interval 5
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mini_broker import CONNACK, CONNECT, PUBACK, PUBLISH, encode_length, encode_string, read_packet, MiniBroker
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+POLL_OVERLAP_IDS = 5000     # ids from concurrent writers can become visible out of order
+POLL_PAGE_ROWS = 20000
+
+# kind -> (topic, sensor generator); mirrors the firmware in sensor_nodes/
+NODE_KINDS = {
+    'air': ('iot/data/air_quality', lambda: {
+        "temperature_c": round(random.uniform(22, 34), 2),
+        "humidity_pct": round(random.uniform(45, 90), 2),
+        "pm2_5_ug_m3": round(random.uniform(5, 150), 2),
+        "pm10_ug_m3": round(random.uniform(10, 250), 2),
+        "wind_speed_ms": round(random.uniform(0, 12), 2),
+        "water_level_cm": None,
+        "salinity_ppt": None,
+    }),
+    'waterlevel': ('iot/data/water_level', lambda: {
+        "water_level_cm": round(random.uniform(50, 200), 2),
+        "salinity_ppt": round(random.uniform(0, 35), 2),
+        "conductivity_us_cm": round(random.uniform(500, 2500), 2),
+    }),
+    'waterquality': ('iot/data/water_quality', lambda: {
+        "tds_ppm": round(random.uniform(250, 1500), 2),
+        "sensor_voltage": round(random.uniform(0.5, 2.3), 3),   # not stored, like the real node
+    }),
+}
+
+
+# --- Minimal asyncio MQTT publisher ---
+class Publisher:
+    """ One MQTT connection shared by a group of simulated nodes. """
+
+    def __init__(self, client_id, qos=0):
+        self.client_id = client_id
+        self.qos = qos
+        self.reader = self.writer = None
+        self._packet_id = 0
+        self._acks = None
+        self.unacked = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        # MQTT 3.1.1, clean session, keepalive disabled (the load run keeps the socket busy).
+        body = encode_string('MQTT') + bytes([4, 0x02, 0, 0]) + encode_string(self.client_id)
+        self.writer.write(bytes([CONNECT << 4]) + encode_length(len(body)) + body)
+        packet_type, _, body = await read_packet(self.reader)
+        if packet_type != CONNACK or body[1] != 0:
+            raise ConnectionError(f"MQTT CONNECT refused: {body!r}")
+        if self.qos:
+            self._acks = asyncio.ensure_future(self._read_acks())
+
+    async def _read_acks(self):
+        while True:
+            packet_type, _, _ = await read_packet(self.reader)
+            if packet_type == PUBACK:
+                self.unacked -= 1
+
+    async def publish(self, topic, payload):
+        body = encode_string(topic)
+        if self.qos:
+            self._packet_id = self._packet_id % 65535 + 1
+            body += self._packet_id.to_bytes(2, 'big')
+            self.unacked += 1
+        body += payload
+        self.writer.write(bytes([PUBLISH << 4 | self.qos << 1]) + encode_length(len(body)) + body)
+        await self.writer.drain()
+
+    async def close(self):
+        if self._acks is not None:
+            self._acks.cancel()
+        self.writer.write(bytes([0xE0, 0]))     # DISCONNECT
+        await self.writer.drain()
+        self.writer.close()
+
+
+# --- Matching published messages to visible rows ---
+class Tracker:
+    def __init__(self, warmup_until):
+        self.warmup_until = warmup_until
+        self._lock = threading.Lock()
+        self._pending = collections.defaultdict(collections.deque)  # device -> sent_at of unmatched messages
+        self.sent = 0
+        self.sent_measured = 0
+        self.visible = 0
+        self.visible_times = []     # wall time each row was seen (for rows/sec)
+        self.latencies = []         # seconds, messages sent after the warm-up only
+
+    def record_sent(self, device_id, sent_at):
+        with self._lock:
+            self._pending[device_id].append(sent_at)
+            self.sent += 1
+            if sent_at >= self.warmup_until:
+                self.sent_measured += 1
+
+    def record_visible(self, device_ids, seen_at):
+        with self._lock:
+            for device_id in device_ids:
+                pending = self._pending.get(device_id)
+                if not pending:
+                    continue        # a row we did not send (or a duplicate)
+                sent_at = pending.popleft()
+                self.visible += 1
+                self.visible_times.append(seen_at)
+                if sent_at >= self.warmup_until:
+                    self.latencies.append(seen_at - sent_at)
+
+    def outstanding(self):
+        with self._lock:
+            return self.sent - self.visible
+
+
+def poll_rows(prefix, tracker, stop, interval):
+    """ Thread: report newly visible readings of the simulated devices to the tracker. """
+    conn = mysql.connector.connect(**dict(DB_CONFIG, autocommit=True))
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM readings")
+    last_id = cursor.fetchone()[0]
+    seen = set()
+    like = prefix.replace('_', '\\_') + '%'
+    while not stop.is_set():
+        started = time.time()
+        cursor.execute("SELECT id, device_id FROM readings WHERE id > %s AND device_id LIKE %s "
+                       "ORDER BY id LIMIT %s", (max(0, last_id - POLL_OVERLAP_IDS), like, POLL_PAGE_ROWS))
+        rows = [(row_id, device_id) for row_id, device_id in cursor.fetchall() if row_id not in seen]
+        if rows:
+            seen.update(row_id for row_id, _ in rows)
+            last_id = max(last_id, rows[-1][0])
+            tracker.record_visible([device_id for _, device_id in rows], time.time())
+        if len(rows) < POLL_PAGE_ROWS:
+            stop.wait(max(0.0, interval - (time.time() - started)))
+    cursor.close()
+    conn.close()
+
+
+# --- Simulated nodes ---
+async def run_node(device_id, kind, publisher, interval, jitter, stop_at, tracker):
+    topic, sensors = NODE_KINDS[kind]
+    latitude, longitude = round(random.uniform(9.4, 9.6), 6), round(random.uniform(76.4, 76.6), 6)
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(random.uniform(0, interval))    # nodes are not in lock-step
+    next_send = loop.time()
+    while loop.time() < stop_at:
+        sent_at = time.time()
+        payload = {"device_id": device_id, "sensors": sensors(), "sent_at": sent_at}
+        if kind != 'waterquality':
+            payload["latitude"], payload["longitude"] = latitude, longitude
+        tracker.record_sent(device_id, sent_at)
+        await publisher.publish(topic, json.dumps(payload).encode())
+        next_send += interval * random.uniform(1 - jitter, 1 + jitter)
+        await asyncio.sleep(max(0.0, next_send - loop.time()))
+
+
+async def run_fleet(args, prefix, host, port, tracker):
+    nodes = ([(f"{prefix}air_{i:05d}", 'air') for i in range(args.air)]
+             + [(f"{prefix}waterlevel_{i:05d}", 'waterlevel') for i in range(args.water_level)]
+             + [(f"{prefix}waterquality_{i:05d}", 'waterquality') for i in range(args.water_quality)])
+    publishers = [Publisher(f"{prefix}pub_{i}", args.qos) for i in range(max(1, min(args.connections, len(nodes))))]
+    for publisher in publishers:
+        await publisher.connect(host, port)
+    stop_at = asyncio.get_running_loop().time() + args.duration
+    await asyncio.gather(*(run_node(device_id, kind, publishers[i % len(publishers)], args.interval,
+                                    args.jitter, stop_at, tracker)
+                           for i, (device_id, kind) in enumerate(nodes)))
+    for publisher in publishers:
+        await publisher.close()
+    return len(nodes)
+
+
+# --- Report ---
+def percentile(values, p):
+    return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1) if values else None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(args, node_count, tracker, window, elapsed_publish):
+    latencies = sorted(tracker.latencies)
+    window_start, window_end = window
+    in_window = sum(1 for t in tracker.visible_times if window_start <= t <= window_end)
+    target_rate = node_count / args.interval
+    listener_stats = None
+    if args.listener_stats and os.path.exists(args.listener_stats):
+        with open(args.listener_stats, encoding='utf-8') as f:
+            listener_stats = json.load(f).get('totals')
+    return {
+        'started_at': datetime.datetime.fromtimestamp(window_start - args.warmup).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'config': {'air': args.air, 'water_level': args.water_level, 'water_quality': args.water_quality,
+                   'interval_s': args.interval, 'jitter': args.jitter, 'duration_s': args.duration,
+                   'warmup_s': args.warmup, 'connections': args.connections, 'qos': args.qos,
+                   'poll_ms': args.poll_ms},
+        'nodes': node_count,
+        'sent': tracker.sent,
+        'visible': tracker.visible,
+        'lost': tracker.sent - tracker.visible,
+        'publish_rate_target': round(target_rate, 1),
+        'publish_rate_actual': round(tracker.sent / elapsed_publish, 1) if elapsed_publish else None,
+        'rows_per_sec': round(in_window / (window_end - window_start), 1) if window_end > window_start else None,
+        'latency_ms': {
+            'samples': len(latencies),
+            'p50': percentile(latencies, 0.50), 'p90': percentile(latencies, 0.90),
+            'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99),
+            'max': round(latencies[-1] * 1000, 1) if latencies else None,
+            'mean': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+        },
+        'listener_stats': listener_stats,
+    }
+
+
+def cleanup(prefix):
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    like = prefix.replace('_', '\\_') + '%'
+    cursor.execute("DELETE FROM readings WHERE device_id LIKE %s", (like,))
+    cursor.execute("DELETE FROM devices WHERE device_id LIKE %s", (like,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate a sensor fleet and measure end-to-end ingest.")
+    parser.add_argument('--air', type=int, default=500)
+    parser.add_argument('--water-level', type=int, default=250)
+    parser.add_argument('--water-quality', type=int, default=250)
+    parser.add_argument('--interval', type=float, default=10.0, help="seconds between messages of one node")
+    parser.add_argument('--jitter', type=float, default=0.1, help="relative jitter of the interval")
+    parser.add_argument('--duration', type=float, default=120.0, help="seconds of publishing")
+    parser.add_argument('--warmup', type=float, default=20.0, help="seconds excluded from the measurements")
+    parser.add_argument('--connections', type=int, default=50, help="MQTT connections the nodes share")
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=0)
+    parser.add_argument('--broker', default='localhost:1883')
+    parser.add_argument('--mini-broker', action='store_true', help="start the stand-in broker in this process")
+    parser.add_argument('--poll-ms', type=int, default=100, help="how often the readings table is polled")
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help="seconds to wait for the last rows")
+    parser.add_argument('--listener-stats', help="INGEST_STATS_FILE of the listener, copied into the report")
+    parser.add_argument('--report', default=f"load_report_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--keep', action='store_true', help="keep the simulated devices and readings")
+    args = parser.parse_args()
+
+    host, port = args.broker.rsplit(':', 1)
+    port = int(port)
+    if args.mini_broker:
+        port = MiniBroker(host, port).start().port
+        print(f"🧪 Stand-in broker on {host}:{port}")
+
+    prefix = f"load_{uuid.uuid4().hex[:6]}_"
+    started = time.time()
+    tracker = Tracker(warmup_until=started + args.warmup)
+    stop_polling = threading.Event()
+    poller = threading.Thread(target=poll_rows, args=(prefix, tracker, stop_polling, args.poll_ms / 1000.0),
+                              name="row-poller", daemon=True)
+    poller.start()
+
+    print(f"🚀 Simulating {args.air} air, {args.water_level} water-level and {args.water_quality} water-quality "
+          f"nodes every {args.interval}s for {args.duration}s (device prefix {prefix}).")
+    try:
+        node_count = asyncio.run(run_fleet(args, prefix, host, port, tracker))
+        publish_end = time.time()
+        print(f"📤 Sent {tracker.sent} messages; waiting for the last rows to become visible...")
+        deadline = time.monotonic() + args.drain_timeout
+        while tracker.outstanding() and time.monotonic() < deadline:
+            time.sleep(0.2)
+        stop_polling.set()
+        poller.join()
+
+        report = build_report(args, node_count, tracker, (started + args.warmup, publish_end), publish_end - started)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        latency = report['latency_ms']
+        print(f"\n📊 {report['visible']}/{report['sent']} rows visible ({report['lost']} missing)")
+        print(f"   publish rate: {report['publish_rate_actual']}/s (target {report['publish_rate_target']}/s)")
+        print(f"   sustained ingest: {report['rows_per_sec']} rows/s")
+        print(f"   publish→visible latency ms: p50 {latency['p50']}  p95 {latency['p95']}  "
+              f"p99 {latency['p99']}  max {latency['max']}  (poll every {args.poll_ms} ms)")
+        print(f"💾 Report written to {args.report}")
+    finally:
+        stop_polling.set()
+        if not args.keep:
+            cleanup(prefix)
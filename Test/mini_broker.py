@@ -0,0 +1,200 @@
+# File: mini_broker.py
+# Description: Minimal in-process MQTT 3.1.1 broker for tests and benchmarks that should not
+#              depend on a local Mosquitto. Supports CONNECT, PUBLISH (QoS 0/1 in, QoS 0 out),
+#              SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, shared subscriptions
+#              ($share/<group>/<filter>, round-robin within a group), PINGREQ and DISCONNECT.
+#              No retained messages, sessions, auth or QoS 2.
+#
+# Usage:   python Test/mini_broker.py [port]         (standalone, default 1883)
+#          broker = MiniBroker(port=0).start()       (in a background thread; see broker.port)
+
+import asyncio
+import sys
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(topic_filter, topic):
+    """ MQTT filter matching with + (one level) and # (all remaining levels). """
+    if topic.startswith('$') and not topic_filter.startswith('$'):
+        return False
+    filter_levels, topic_levels = topic_filter.split('/'), topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def encode_string(text):
+    data = text.encode() if isinstance(text, str) else text
+    return len(data).to_bytes(2, 'big') + data
+
+
+def publish_packet(topic, payload):
+    body = encode_string(topic) + payload
+    return bytes([PUBLISH << 4]) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """ (packet type, flags, body) of the next control packet. """
+    header = await reader.readexactly(1)
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    body = await reader.readexactly(length) if length else b''
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+class _Client:
+    __slots__ = ('writer', 'subscriptions')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscriptions = set()      # raw filters, including $share/... ones
+
+
+class MiniBroker:
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self._server = None
+        self._clients = set()
+        self._groups = {}               # (group, filter) -> deliveries so far, for round-robin
+        self.counters = {'connections': 0, 'received': 0, 'delivered': 0}
+
+    # --- Routing ---
+    def _route(self, topic, payload):
+        packet = publish_packet(topic, payload)
+        shared = {}                     # (group, filter) -> [client, ...]
+        for client in list(self._clients):
+            for raw in client.subscriptions:
+                if raw.startswith('$share/'):
+                    _, group, topic_filter = raw.split('/', 2)
+                    if topic_matches(topic_filter, topic):
+                        shared.setdefault((group, topic_filter), []).append(client)
+                elif topic_matches(raw, topic):
+                    self._send(client, packet)
+                    break               # one copy per client for overlapping filters
+        for key, members in shared.items():
+            # Round-robin over the group's current members.
+            turn = self._groups.get(key, 0)
+            members.sort(key=id)
+            self._send(members[turn % len(members)], packet)
+            self._groups[key] = turn + 1
+
+    def _send(self, client, packet):
+        client.writer.write(packet)
+        self.counters['delivered'] += 1
+
+    # --- Connection handling ---
+    async def _handle(self, reader, writer):
+        client = _Client(writer)
+        try:
+            while True:
+                packet_type, flags, body = await read_packet(reader)
+                if packet_type == CONNECT:
+                    self._clients.add(client)
+                    self.counters['connections'] += 1
+                    writer.write(bytes([CONNACK << 4, 2, 0, 0]))
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic_length = int.from_bytes(body[:2], 'big')
+                    topic = body[2:2 + topic_length].decode()
+                    offset = 2 + topic_length
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write(bytes([PUBACK << 4, 2]) + packet_id)
+                    self.counters['received'] += 1
+                    self._route(topic, body[offset:])
+                elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+                    packet_id, offset, granted = body[:2], 2, bytearray()
+                    while offset < len(body):
+                        length = int.from_bytes(body[offset:offset + 2], 'big')
+                        topic_filter = body[offset + 2:offset + 2 + length].decode()
+                        offset += 2 + length
+                        if packet_type == SUBSCRIBE:
+                            offset += 1         # requested QoS; everything is delivered at QoS 0
+                            client.subscriptions.add(topic_filter)
+                            granted.append(0)
+                        else:
+                            client.subscriptions.discard(topic_filter)
+                    if packet_type == SUBSCRIBE:
+                        writer.write(bytes([SUBACK << 4]) + encode_length(2 + len(granted)) + packet_id + granted)
+                    else:
+                        writer.write(bytes([UNSUBACK << 4, 2]) + packet_id)
+                elif packet_type == PINGREQ:
+                    writer.write(bytes([PINGRESP << 4, 0]))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(client)
+            writer.close()
+
+    # --- Lifecycle ---
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """ Run the broker on a daemon thread; returns once it is listening. """
+        ready = threading.Event()
+
+        def run():
+            async def main():
+                await self.serve()
+                ready.set()
+                async with self._server:
+                    await self._server.serve_forever()
+            try:
+                asyncio.run(main())
+            except asyncio.CancelledError:
+                pass
+
+        threading.Thread(target=run, name="mini-broker", daemon=True).start()
+        ready.wait(5)
+        return self
+
+    def stop(self):
+        if self.loop is not None and self._server is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+
+    async def main():
+        broker = MiniBroker('0.0.0.0', port)
+        server = await broker.serve()
+        print(f"🚀 Mini MQTT broker listening on port {broker.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Mini broker stopped.")
@@ -0,0 +1,442 @@
+# File: alert_engine.py
+# Description: Streaming alert rules for the MQTT listener. Every reading is checked as it
+#              arrives, before it is queued for the database, against per-metric rules:
+#                threshold - value below "min" or above "max"
+#                rate      - change faster than "max_per_minute" (either direction), measured
+#                            over at least "over_seconds" (default 60) so sensor noise between
+#                            two close readings does not count as a rate
+#                zscore    - value more than "z" standard deviations from the device's recent
+#                            mean, tracked as an exponentially weighted mean and variance over
+#                            about "window" readings (no history is kept or scanned); until
+#                            "window" readings have been seen they are the exact running values
+#              Each (rule, device) pair keeps a few numbers of state, so the cost of a reading
+#              depends on the number of rules for its metrics, never on how much history there
+#              is (see Test/bench_alerts.py). Alerts are edge-triggered: a rule fires when it
+#              trips and re-arms once a reading passes it again.
+#
+#              Rules are a JSON list (ALERT_RULES_FILE in the listener), e.g.
+#                [{"metric": "pm2_5_ug_m3", "type": "threshold", "max": 55.4, "severity": "critical"},
+#                 {"metric": "water_level_cm", "type": "rate", "max_per_minute": 5},
+#                 {"metric": "tds_ppm", "type": "zscore", "z": 4, "window": 120,
+#                  "devices": ["water_quality_node_01"]}]
+#              Optional keys: "name" (default <metric>_<type>), "severity" (default warning),
+#              "devices" (default all), "over_seconds" for rate, and for zscore "min_samples"
+#              (readings before it may fire, default window / 4) and "min_stddev" (floor of the
+#              deviation, in the metric's unit, so a flat-lining sensor does not alert on its
+#              first wiggle).
+#
+#              AlertSink publishes the alerts on MQTT (<topic prefix>/<device_id>) and inserts
+#              them into the 'alerts' table from a background thread, so the MQTT callback
+#              never waits for either. Inserts are retried while the database is unreachable;
+#              an alert the database refuses is discarded on its own, not with the ones after it.
+
+import collections
+import datetime
+import json
+import math
+import threading
+import time
+
+import metrics
+from ingest_batcher import UNAVAILABLE_ERRORS
+from payload_codec import ALLOWED_SENSOR_KEYS
+
+KINDS = ('threshold', 'rate', 'zscore')
+SEVERITIES = ('info', 'warning', 'critical')
+
+# Used when no rules file is configured. PM limits are the US EPA 24 h "unhealthy" breakpoints.
+DEFAULT_RULES = [
+    {'metric': 'pm2_5_ug_m3', 'type': 'threshold', 'max': 55.4, 'severity': 'critical'},
+    {'metric': 'pm10_ug_m3', 'type': 'threshold', 'max': 254, 'severity': 'critical'},
+    {'metric': 'pm2_5_ug_m3', 'type': 'zscore', 'z': 4, 'window': 120, 'min_stddev': 1.0},
+    {'metric': 'water_level_cm', 'type': 'rate', 'max_per_minute': 5},
+    {'metric': 'water_level_cm', 'type': 'zscore', 'z': 4, 'window': 120, 'min_stddev': 0.5},
+    {'metric': 'salinity_ppt', 'type': 'zscore', 'z': 4, 'window': 120, 'min_stddev': 0.2},
+    {'metric': 'tds_ppm', 'type': 'threshold', 'max': 500},
+]
+
+SQL_INSERT_ALERT = """
+    INSERT INTO alerts (device_id, rule, metric, kind, severity, value, score, limit_value, message, triggered_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+class Rule:
+    """ One validated rule (see the header for its JSON form). Raises ValueError if it is malformed. """
+    __slots__ = ('name', 'metric', 'kind', 'severity', 'devices', 'minimum', 'maximum',
+                 'max_per_minute', 'over_seconds', 'z', 'alpha', 'min_samples', 'min_stddev')
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError(f"a rule must be an object, not {spec!r}")
+        self.metric = spec.get('metric')
+        self.kind = spec.get('type', 'threshold')
+        if self.metric not in ALLOWED_SENSOR_KEYS:
+            raise ValueError(f"unknown metric {self.metric!r}")
+        if self.kind not in KINDS:
+            raise ValueError(f"unknown rule type {self.kind!r} (one of {', '.join(KINDS)})")
+        self.name = str(spec.get('name') or f"{self.metric}_{self.kind}")
+        self.severity = spec.get('severity', 'warning')
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"{self.name}: unknown severity {self.severity!r}")
+        devices = spec.get('devices')
+        self.devices = frozenset(devices) if devices else None
+
+        self.minimum = _number(spec, 'min')
+        self.maximum = _number(spec, 'max')
+        self.max_per_minute = _number(spec, 'max_per_minute')
+        self.over_seconds = _number(spec, 'over_seconds', 60.0)
+        self.z = _number(spec, 'z', 4.0)
+        window = int(spec.get('window', 120))
+        self.alpha = 2.0 / (window + 1)
+        self.min_samples = int(spec.get('min_samples', max(2, window // 4)))
+        self.min_stddev = _number(spec, 'min_stddev', 0.0)
+        if self.kind == 'threshold' and self.minimum is None and self.maximum is None:
+            raise ValueError(f"{self.name}: a threshold rule needs 'min' and/or 'max'")
+        if self.kind == 'rate' and not self.max_per_minute:
+            raise ValueError(f"{self.name}: a rate rule needs 'max_per_minute'")
+        if self.kind == 'zscore' and (window < 2 or self.z <= 0):
+            raise ValueError(f"{self.name}: a zscore rule needs 'window' >= 2 and 'z' > 0")
+
+    def check(self, state, value, at):
+        """ (tripped, score, limit, message) for one reading; updates `state`. """
+        if self.kind == 'threshold':
+            if self.maximum is not None and value > self.maximum:
+                return True, value, self.maximum, f"{self.metric} = {value:g} above {self.maximum:g}"
+            if self.minimum is not None and value < self.minimum:
+                return True, value, self.minimum, f"{self.metric} = {value:g} below {self.minimum:g}"
+            return False, None, None, None
+
+        if self.kind == 'rate':
+            # Rate since the reference reading, which moves on once over_seconds have passed.
+            # Readings in between keep the previous verdict.
+            last_value, last_at = state.last_value, state.last_at
+            if last_at is None:
+                state.last_value, state.last_at = value, at
+                return False, None, None, None
+            if at - last_at < self.over_seconds:
+                return state.firing, None, None, None
+            state.last_value, state.last_at = value, at
+            rate = (value - last_value) * 60.0 / (at - last_at)
+            if abs(rate) > self.max_per_minute:
+                return True, rate, self.max_per_minute, \
+                    f"{self.metric} changing {rate:+.2f}/min (limit {self.max_per_minute:g}/min)"
+            return False, rate, None, None
+
+        # zscore: the reading is scored against the state before it, then folded in. Weighting the
+        # n-th reading by max(alpha, 1/n) gives the exact mean and variance while warming up,
+        # and the exponentially weighted ones afterwards.
+        tripped, score, message = False, None, None
+        if state.count >= self.min_samples:
+            stddev = max(math.sqrt(state.var), self.min_stddev)
+            if stddev > 0:
+                score = (value - state.mean) / stddev
+                tripped = abs(score) > self.z
+                if tripped:
+                    message = f"{self.metric} = {value:g} is {score:+.1f} sd from its recent mean {state.mean:.2f}"
+        state.count += 1
+        alpha = max(self.alpha, 1.0 / state.count)
+        diff = value - state.mean
+        increment = alpha * diff
+        state.mean += increment
+        state.var = (1.0 - alpha) * (state.var + diff * increment)
+        return tripped, score, self.z if tripped else None, message
+
+
+def _number(spec, key, default=None):
+    value = spec.get(key, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{spec.get('name') or spec.get('metric')}: '{key}' must be a number")
+    return float(value)
+
+
+def compile_rules(specs):
+    """ [Rule, ...] from a list of rule dicts; raises ValueError on the first bad one. """
+    rules = [Rule(spec) for spec in specs]
+    names = collections.Counter(rule.name for rule in rules)
+    duplicates = [name for name, count in names.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"duplicate rule names {duplicates}; give them a 'name'")
+    return rules
+
+
+def load_rules(path=None):
+    """ Rules from a JSON file, or DEFAULT_RULES without one. """
+    if not path:
+        return compile_rules(DEFAULT_RULES)
+    with open(path, encoding='utf-8') as f:
+        specs = json.load(f)
+    if not isinstance(specs, list):
+        raise ValueError(f"{path} must hold a JSON list of rules")
+    return compile_rules(specs)
+
+
+class _State:
+    """ What one rule remembers about one device. """
+    __slots__ = ('firing', 'last_value', 'last_at', 'count', 'mean', 'var')
+
+    def __init__(self):
+        self.firing = False
+        self.last_value = self.last_at = None
+        self.count = 0
+        self.mean = self.var = 0.0
+
+
+class AlertEngine:
+    """
+    Evaluates the rules on each reading. Not thread-safe: call evaluate() from one thread (the
+    MQTT network loop, or a worker's message loop), which is where readings arrive in order.
+    """
+
+    def __init__(self, rules, sink=None):
+        self.rules = list(rules)
+        self.sink = sink
+        self._by_metric = {}        # metric -> [Rule, ...]
+        for rule in self.rules:
+            self._by_metric.setdefault(rule.metric, []).append(rule)
+        self._states = {}           # (rule name, device_id) -> _State
+        self.counters = {'evaluated': 0, 'checks': 0, 'fired': 0, 'evaluation_seconds': 0.0}
+        self.fired_by_rule = collections.Counter()
+
+    def evaluate(self, device_id, readings, received_at=None):
+        """ Check one reading ({metric: value}, received_at None = now); returns the alerts it fired. """
+        began = time.perf_counter()
+        at = time.time() if received_at is None else received_at.timestamp()
+        fired, checks = [], 0
+        by_metric, states = self._by_metric, self._states
+        for metric, value in readings.items():
+            rules = by_metric.get(metric)
+            if rules is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if not math.isfinite(value):
+                continue        # NaN or inf would stick in the rate and z-score state for good
+            for rule in rules:
+                if rule.devices is not None and device_id not in rule.devices:
+                    continue
+                checks += 1
+                key = (rule.name, device_id)
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = _State()
+                tripped, score, limit, message = rule.check(state, value, at)
+                if tripped and not state.firing:
+                    fired.append(self._alert(rule, device_id, value, score, limit, message, at, received_at))
+                state.firing = tripped
+
+        counters = self.counters
+        counters['evaluated'] += 1
+        counters['checks'] += checks
+        if fired:
+            counters['fired'] += len(fired)
+            for alert in fired:
+                self.fired_by_rule[alert['rule']] += 1
+                if self.sink is not None:
+                    self.sink.put(alert)
+        counters['evaluation_seconds'] += time.perf_counter() - began
+        return fired
+
+    @staticmethod
+    def _alert(rule, device_id, value, score, limit, message, at, received_at):
+        triggered_at = received_at or datetime.datetime.fromtimestamp(at)
+        return {'device_id': device_id, 'rule': rule.name, 'metric': rule.metric, 'kind': rule.kind,
+                'severity': rule.severity, 'value': value,
+                'score': None if score is None else round(score, 4), 'limit': limit,
+                'message': message, 'triggered_at': triggered_at.replace(microsecond=0)}
+
+    def stats(self):
+        evaluated = self.counters['evaluated']
+        return {'alert_states': len(self._states),
+                'alerts_evaluated': evaluated, 'alerts_fired': self.counters['fired'],
+                'alert_eval_us_avg': round(self.counters['evaluation_seconds'] / evaluated * 1e6, 2) if evaluated else None,
+                **(self.sink.stats() if self.sink is not None else {})}
+
+    def metric_families(self):
+        """ Evaluation cost and alert counts as Prometheus families (for Registry.register_collector). """
+        counters = self.counters
+        families = [
+            metrics.family('alert_evaluations_total', 'counter', "Readings checked against the alert rules.",
+                           counters['evaluated']),
+            metrics.family('alert_rule_checks_total', 'counter', "Individual rule checks (rules x matching metrics).",
+                           counters['checks']),
+            metrics.family('alert_evaluation_seconds_total', 'counter',
+                           "Time spent evaluating alert rules; divide by alert_evaluations_total for the cost per reading.",
+                           counters['evaluation_seconds']),
+            metrics.family('alerts_fired_total', 'counter', "Alerts raised, by rule.",
+                           samples={(('rule', name),): count for name, count in list(self.fired_by_rule.items())}),
+        ]
+        if self.sink is not None:
+            families += self.sink.metric_families()
+        return families
+
+
+class AlertSink:
+    """
+    Delivers alerts from a background thread: each is published once on MQTT, then inserted
+    into 'alerts' in batches. While the database is unreachable up to `max_pending` alerts
+    are kept (oldest dropped first) and the insert is retried every `retry_seconds`.
+    """
+
+    def __init__(self, connect, publish=None, topic_prefix='iot/alerts', max_pending=10000, retry_seconds=5):
+        self.connect = connect          # () -> connection or None
+        self.publish = publish          # (topic, payload bytes) -> None
+        self.topic_prefix = topic_prefix.rstrip('/')
+        self.max_pending = max_pending
+        self.retry_seconds = retry_seconds
+        self._incoming = collections.deque()
+        self._unwritten = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._conn = None
+        self.counters = {'published': 0, 'publish_failed': 0, 'written': 0, 'dropped': 0, 'rejected': 0}
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='alert-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, alert):
+        with self._cond:
+            self._incoming.append(alert)
+            self._cond.notify()
+
+    def stop(self, timeout=10):
+        """ Deliver what is queued (one more insert attempt) and stop the thread. """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        retry_at = 0.0
+        while True:
+            with self._cond:
+                while not self._incoming and not self._stopping and \
+                        (not self._unwritten or time.monotonic() < retry_at):
+                    self._cond.wait(max(0.0, retry_at - time.monotonic()) if self._unwritten else None)
+                alerts = list(self._incoming)
+                self._incoming.clear()
+                stopping = self._stopping
+            for alert in alerts:
+                self._publish(alert)
+            self._unwritten.extend(alerts)
+            while len(self._unwritten) > self.max_pending:
+                self._unwritten.popleft()
+                self.counters['dropped'] += 1
+            if self._unwritten and (stopping or time.monotonic() >= retry_at):
+                if not self._write():
+                    retry_at = time.monotonic() + self.retry_seconds
+            if stopping:
+                self.counters['dropped'] += len(self._unwritten)
+                self._unwritten.clear()
+                return
+
+    def _publish(self, alert):
+        if self.publish is None:
+            return
+        try:
+            self.publish(f"{self.topic_prefix}/{alert['device_id']}", alert_payload(alert))
+            self.counters['published'] += 1
+        except Exception as e:
+            self.counters['publish_failed'] += 1
+            self.last_error = e
+
+    def _write(self):
+        """
+        Insert every unwritten alert in one transaction. Returns False if it has to be retried
+        (the database is unreachable); alerts the database refuses are discarded one by one.
+        """
+        try:
+            if self._conn is None:
+                self._conn = self.connect()
+                if self._conn is None:
+                    return False
+            rows = [self._row(a) for a in self._unwritten]
+            cursor = self._conn.cursor()
+            try:
+                cursor.executemany(SQL_INSERT_ALERT, rows)
+                self._conn.commit()
+            finally:
+                cursor.close()
+        except Exception as e:
+            self.last_error = e
+            if getattr(e, 'errno', None) not in UNAVAILABLE_ERRORS and \
+                    self._conn is not None and self._conn.is_connected():
+                return self._write_each()
+            print(f"⚠️ Could not store {len(self._unwritten)} alert(s), retrying in {self.retry_seconds}s: {e}")
+            self._drop_connection()
+            return False
+        self.counters['written'] += len(rows)
+        self._unwritten.clear()
+        return True
+
+    def _write_each(self):
+        """ After the batch was refused: insert the alerts one at a time and discard those the database refuses. """
+        try:
+            self._conn.rollback()
+            while self._unwritten:
+                cursor = self._conn.cursor()
+                try:
+                    cursor.execute(SQL_INSERT_ALERT, self._row(self._unwritten[0]))
+                    self._conn.commit()
+                    self.counters['written'] += 1
+                except Exception as e:
+                    if getattr(e, 'errno', None) in UNAVAILABLE_ERRORS:
+                        raise
+                    self._conn.rollback()
+                    self.counters['rejected'] += 1
+                    print(f"❌ Alert refused by the database and discarded: {self._unwritten[0]['message']} ({e})")
+                finally:
+                    cursor.close()
+                self._unwritten.popleft()
+        except Exception as e:
+            self.last_error = e
+            print(f"⚠️ Could not store {len(self._unwritten)} alert(s), retrying in {self.retry_seconds}s: {e}")
+            self._drop_connection()
+            return False
+        return True
+
+    @staticmethod
+    def _row(a):
+        return (a['device_id'], a['rule'], a['metric'], a['kind'], a['severity'], a['value'], a['score'],
+                a['limit'], a['message'], a['triggered_at'])
+
+    def _drop_connection(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def stats(self):
+        return {'alerts_published': self.counters['published'], 'alerts_written': self.counters['written'],
+                'alerts_pending': len(self._unwritten) + len(self._incoming), 'alerts_dropped': self.counters['dropped'],
+                'alerts_rejected': self.counters['rejected']}
+
+    def metric_families(self):
+        return [
+            metrics.family('alerts_published_total', 'counter', "Alerts published on MQTT.", self.counters['published']),
+            metrics.family('alerts_publish_failed_total', 'counter', "Alerts that could not be published on MQTT.",
+                           self.counters['publish_failed']),
+            metrics.family('alerts_written_total', 'counter', "Alerts inserted into the alerts table.",
+                           self.counters['written']),
+            metrics.family('alerts_dropped_total', 'counter',
+                           "Alerts never stored because too many were waiting for the database.",
+                           self.counters['dropped']),
+            metrics.family('alerts_rejected_total', 'counter', "Alerts the database refused to store (discarded).",
+                           self.counters['rejected']),
+            metrics.family('alerts_pending', 'gauge', "Alerts waiting to be inserted.",
+                           len(self._unwritten) + len(self._incoming)),
+        ]
+
+
+def alert_payload(alert):
+    """ JSON body of an alert's MQTT message. """
+    return json.dumps({**alert, 'triggered_at': alert['triggered_at'].isoformat(sep=' ')}).encode()
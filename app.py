@@ -1,15 +1,67 @@
 # File: app.py (FINAL, INTEGRATED & MULTI-NODE VERSION)
 
-from flask import Flask, jsonify, render_template, request
-import mysql.connector
-from mysql.connector import errorcode
+from flask import Flask, Response, jsonify, render_template, request
 import datetime # Import the datetime library for formatting
+import decimal
+import json
+import os
+from werkzeug.http import http_date
+
+import http_cache
+import metrics
+import storage
+from day_snapshots import DaySnapshots
+from db_pool import ConnectionPool
+from history_buffer import RecentHistory
+from latest_cache import LatestValueCache
+from live_stream import ReadingBroadcaster
 
 # --- CONFIGURATION ---
-DB_HOST = "localhost"
-DB_NAME = "unified_sensor_db"
-DB_USER = "root"
-DB_PASS = "saintgits" # Your real password
+# Database: MySQL or an embedded SQLite file, chosen with STORAGE_BACKEND; credentials and
+# paths come from the environment (MYSQL_HOST, MYSQL_PASSWORD, ..., see storage.py).
+DB_CONFIG = storage.CONFIG
+
+# Connection pool: connections are reused across requests instead of reconnecting each time.
+DB_POOL_SIZE = 8            # max open connections
+DB_POOL_TIMEOUT = 5.0       # seconds to wait for a free connection before failing the request
+DB_POOL_MAX_LIFETIME = 1800 # seconds before a connection is closed and replaced
+DB_POOL_PING_AFTER = 30     # ping connections that have been idle longer than this (seconds)
+
+# Latest-value cache: the "latest" endpoints are answered from memory, which is brought
+# up to date with rows newer than the last seen id at most this often (seconds).
+LATEST_CACHE_MAX_STALENESS = 2.0
+
+# Chart history (/get_history, /get_water_history) is served from per-device ring buffers
+# holding the newest HISTORY_BUFFER_ROWS readings of every DEVICE_MAP device (~0.9 KB per
+# 10 rows per device, see /cache_stats). The endpoints return the newest N of them.
+HISTORY_BUFFER_ROWS = 120
+AIR_HISTORY_POINTS = 20
+WATER_HISTORY_POINTS = 40
+
+# /search results of past days cannot change any more, so their rendered JSON is kept in an
+# LRU (bounded by entries and bytes); entries expire after SEARCH_CACHE_TTL seconds so rows
+# replayed late from the listener's spool still show up. Browsers may reuse them as long.
+SEARCH_CACHE_ENTRIES = 32
+SEARCH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+SEARCH_CACHE_TTL = 3600
+
+# Past days are served by /search from per-day, per-device columnar snapshot files (see
+# day_snapshots.py) instead of MySQL. A background job snapshots each day SNAPSHOT_SETTLE_SECONDS
+# after it ended and rewrites any snapshot whose day received late readings; it runs every
+# SNAPSHOT_INTERVAL seconds. SNAPSHOT_DIR = None disables snapshots (every day is queried).
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_INTERVAL = 600
+SNAPSHOT_SETTLE_SECONDS = 3600
+
+# A wall of dashboards refreshing together sends the same four requests (latest and history,
+# air and water) within milliseconds. Concurrent identical requests share one render and its
+# JSON body, which is reused for COALESCE_WINDOW seconds (None disables coalescing).
+COALESCE_WINDOW = 0.5
+
+# Live updates (/stream): one poller looks for new rows this often and pushes them to every
+# connected dashboard over Server-Sent Events.
+STREAM_POLL_INTERVAL = 1.0
+STREAM_HEARTBEAT_SECONDS = 15
 
 # MODIFIED: Updated device IDs and made 'water' a list of all water-related nodes
 DEVICE_MAP = {
@@ -19,170 +71,285 @@ DEVICE_MAP = {
 
 app = Flask(__name__)
 
+db_pool = ConnectionPool(
+    DB_CONFIG, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME, ping_after=DB_POOL_PING_AFTER,
+)
+
+latest_cache = LatestValueCache(
+    db_pool, warm_devices=[DEVICE_MAP['air']] + DEVICE_MAP['water'],
+    max_staleness=LATEST_CACHE_MAX_STALENESS,
+)
+
+recent_history = RecentHistory(
+    db_pool, latest_cache, devices=[DEVICE_MAP['air']] + DEVICE_MAP['water'], capacity=HISTORY_BUFFER_ROWS,
+)
+
+search_cache = http_cache.ResponseCache(maxsize=SEARCH_CACHE_ENTRIES, ttl=SEARCH_CACHE_TTL,
+                                       max_bytes=SEARCH_CACHE_MAX_BYTES)
+
+request_flights = http_cache.SingleFlight(window=COALESCE_WINDOW)
+
+day_snapshots = DaySnapshots(SNAPSHOT_DIR, settle_seconds=SNAPSHOT_SETTLE_SECONDS) if SNAPSHOT_DIR else None
+
+broadcaster = ReadingBroadcaster(latest_cache, poll_interval=STREAM_POLL_INTERVAL,
+                                 heartbeat_seconds=STREAM_HEARTBEAT_SECONDS)
+
+# Prometheus metrics on /metrics: per-route latency split into pool acquisition, DB and
+# serialization time, plus pool and cache gauges (see metrics.py).
+metrics.instrument_flask(app)
+metrics.REGISTRY.register_collector(db_pool.metric_families)
+metrics.REGISTRY.register_collector(lambda: search_cache.metric_families('search'))
+metrics.REGISTRY.register_collector(lambda: request_flights.metric_families('dashboard'))
+if day_snapshots is not None:
+    metrics.REGISTRY.register_collector(lambda: [
+        metrics.family('search_snapshot_days_served_total', 'counter', "/search days served from snapshot files.",
+                       day_snapshots.counters['days_served']),
+        metrics.family('search_snapshot_days_written_total', 'counter', "Days written to snapshot files.",
+                       day_snapshots.counters['days_compacted'] + day_snapshots.counters['days_rewritten']),
+    ])
+metrics.REGISTRY.register_collector(lambda: [
+    metrics.family('sse_clients', 'gauge', "Connected /stream clients.", broadcaster.client_count()),
+    metrics.family('history_buffer_bytes', 'gauge', "Memory held by the chart history ring buffers.",
+                   recent_history.stats()['bytes_total']),
+])
+
+# Dashboard and search responses carry ETag/Last-Modified (unchanged polls get a 304) and large
+# JSON bodies are sent brotli- or gzip-compressed (see http_cache.py).
+compressed_bodies = http_cache.enable_compression(app)
+
 def get_db_connection():
-    # This function is correct and doesn't need changes.
+    # Checks a connection out of the pool; conn.close() hands it back.
     try:
-        conn = mysql.connector.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASS)
-        return conn
-    except mysql.connector.Error as err:
+        return db_pool.acquire()
+    except storage.Error as err:
         print(f"Database connection error: {err}")
         return None
 
+# --- READ QUERIES ---
+# Every query below is written so that MySQL can answer it from an index
+# (see db/migrations/001_readings_indexes.sql); Test/check_query_plans.py EXPLAINs them.
+
+SEARCH_METRICS = ('temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3',
+                  'wind_speed_ms', 'water_level_cm', 'salinity_ppt', 'tds_ppm')
+
+def search_query(day):
+    # Half-open range on the bare column instead of DATE(created_at) = ..., so idx_readings_created is usable.
+    sql = f"""
+        SELECT device_id, created_at, {', '.join(SEARCH_METRICS)}
+        FROM readings 
+        WHERE created_at >= %s AND created_at < %s
+        ORDER BY created_at DESC;
+    """
+    return sql, (day, day + datetime.timedelta(days=1))
+
+def render_search(rows):
+    # Byte for byte what DaySnapshots.search_body() renders for a snapshot day: the compact,
+    # key-sorted JSON jsonify() makes, with metrics as numbers (not DECIMAL strings) and
+    # time_utc for history.html. Dates are formatted up front so the C encoder does the rest.
+    for row in rows:
+        created_at = row['created_at']
+        row['created_at'] = http_date(created_at)
+        row['time_utc'] = created_at.strftime('%Y-%m-%dT%H:%M:%S')
+        for column in SEARCH_METRICS:
+            if isinstance(row[column], decimal.Decimal):
+                row[column] = float(row[column])
+    return json.dumps(rows, sort_keys=True, separators=(',', ':')).encode()
+
+
+def coalesced_response(key, render):
+    # render() -> (JSON body, etag, last_modified) runs once for all concurrent requests with the
+    # same key (see COALESCE_WINDOW); each request still gets its own 304 check.
+    body, etag, last_modified = request_flights.do(key, render)
+    return http_cache.conditional(Response(body, mimetype='application/json'), etag, last_modified)
+
+
 # --- AIR QUALITY API Endpoints ---
-# This section is unchanged as it works perfectly for the single air sensor.
+# The latest reading comes from the in-memory cache; history still queries MySQL.
+AIR_LATEST_COLUMNS = ('device_id', 'temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3',
+                      'wind_speed_ms', 'created_at')
+
 @app.route('/get_latest_data')
 def get_latest_data():
-    sql = """
-        SELECT device_id, temperature_c, humidity_pct, pm2_5_ug_m3, pm10_ug_m3, 
-               wind_speed_ms, created_at
-        FROM readings
-        WHERE device_id = %s ORDER BY created_at DESC LIMIT 1;
-    """
-    params = (DEVICE_MAP['air'],)
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(sql, params)
-        reading = cursor.fetchone()
-        
-        if reading and isinstance(reading.get('created_at'), datetime.datetime):
-            reading['time_utc'] = reading['created_at'].strftime('%Y-%m-%dT%H:%M:%S')
-
-        return jsonify([reading] if reading else [])
+        return coalesced_response('latest-air', render_latest_air)
     except Exception as e:
         print(f"Database fetch error: {e}")
         return jsonify({"error": "Could not retrieve data"}), 500
-    finally:
-        if conn and conn.is_connected(): cursor.close(); conn.close()
+
+def render_latest_air():
+    # Served from the latest-value cache instead of sorting the air node's rows per request.
+    reading = latest_cache.latest_row(DEVICE_MAP['air'])
+
+    # The newest readings.id of the device identifies the response: unchanged polls get a 304.
+    etag = f"latest-air-{reading['id'] if reading else 0}"
+    if reading:
+        reading = {key: reading.get(key) for key in AIR_LATEST_COLUMNS}
+        if isinstance(reading.get('created_at'), datetime.datetime):
+            reading['time_utc'] = reading['created_at'].strftime('%Y-%m-%dT%H:%M:%S')
+
+    return jsonify([reading] if reading else []).get_data(), etag, reading.get('created_at') if reading else None
+
+AIR_HISTORY_COLUMNS = (('temperature_c', 'temperature_c'), ('humidity_pct', 'humidity_pct'),
+                       ('pm2_5_ug_m3', 'pm2_5_ug_m3'), ('pm10_ug_m3', 'pm10_ug_m3'),
+                       ('wind_speed_ms', 'wind_speed_ms'))
+
+# Rendered chart responses, reused until the ring buffers change: name -> (etag, body)
+_history_responses = {}
+
+def render_history(name, device_ids, columns, limit):
+    # The newest `limit` rows of the devices, read from the ring buffers instead of MySQL.
+    # ETag: newest readings.id and rows appended for these devices, so a tab polling an
+    # unchanged chart gets a 304 instead of the same JSON again.
+    recent_history.sync()
+    newest_id, appended, newest_at = recent_history.fingerprint(device_ids)
+    etag = f"{name}-{newest_id}-{appended}"
+    cached = _history_responses.get(name)
+    if cached is None or cached[0] != etag:
+        history = recent_history.history(device_ids, columns, limit)
+        newest_id, appended, newest_at = recent_history.fingerprint(device_ids)
+        etag = f"{name}-{newest_id}-{appended}"     # rows may have arrived in between
+        for row in history:
+            row['time_label'] = row['created_at'].strftime('%H:%M:%S')
+        cached = _history_responses[name] = (etag, jsonify(history).get_data())
+    return cached[1], cached[0], newest_at
 
 @app.route('/get_history')
 def get_history():
-    sql = """
-        SELECT temperature_c, humidity_pct, pm2_5_ug_m3, pm10_ug_m3, wind_speed_ms,
-               created_at
-        FROM readings
-        WHERE device_id = %s ORDER BY created_at DESC LIMIT 20;
-    """
-    params = (DEVICE_MAP['air'],)
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(sql, params)
-        history = list(reversed(cursor.fetchall()))
-        
-        for row in history:
-            if isinstance(row.get('created_at'), datetime.datetime):
-                row['time_label'] = row['created_at'].strftime('%H:%M:%S')
-
-        return jsonify(history)
+        return coalesced_response('history-air', lambda: render_history(
+            'air', [DEVICE_MAP['air']], AIR_HISTORY_COLUMNS, AIR_HISTORY_POINTS))
     except Exception as e:
         print(f"Database history fetch error: {e}")
         return jsonify({"error": "Could not retrieve history"}), 500
-    finally:
-        if conn and conn.is_connected(): cursor.close(); conn.close()
 
 
 # --- IMPLEMENTED: WATER QUALITY API Endpoints ---
 # This section has been upgraded to handle multiple water nodes.
 @app.route('/get_latest_water_data')
 def get_latest_water_data():
-    # IMPLEMENTED: A sophisticated query to get the single latest value for each metric
-    # from the relevant water sensors, creating a unified view for the dashboard gauges.
-    sql = """
-    SELECT 
-        (SELECT water_level_cm FROM readings WHERE device_id = 'sensor_node_02' AND water_level_cm IS NOT NULL ORDER BY created_at DESC LIMIT 1) AS water_level_pct,
-        (SELECT conductivity_us_cm FROM readings WHERE device_id = 'sensor_node_02' AND conductivity_us_cm IS NOT NULL ORDER BY created_at DESC LIMIT 1) AS conductivity_us_cm,
-        (SELECT tds_ppm FROM readings WHERE device_id = 'sensor_node_03' AND tds_ppm IS NOT NULL ORDER BY created_at DESC LIMIT 1) AS tds_ppm,
-        (SELECT MAX(created_at) FROM readings WHERE device_id IN ('sensor_node_02', 'sensor_node_03')) AS created_at
-    """
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(sql)
-        reading = cursor.fetchone()
-
-        if reading and isinstance(reading.get('created_at'), datetime.datetime):
-            reading['time_utc'] = reading['created_at'].strftime('%Y-%m-%dT%H:%M:%S')
-
-        return jsonify([reading] if reading else [])
+        return coalesced_response('latest-water', render_latest_water)
     except Exception as e:
         print(f"Database fetch error in /get_latest_water_data: {e}")
         return jsonify({"error": "Could not retrieve water data"}), 500
-    finally:
-        if conn and conn.is_connected(): cursor.close(); conn.close()
+
+def render_latest_water():
+    # The single latest value for each metric across ALL water nodes in DEVICE_MAP['water'],
+    # creating a unified view for the dashboard gauges. Served from the latest-value cache.
+    water_devices = DEVICE_MAP['water']
+    latest_rows = [latest_cache.latest_row(device_id) for device_id in water_devices]
+    reading = {
+        'water_level_pct': latest_cache.latest_metric(water_devices, 'water_level_cm')[0],
+        'conductivity_us_cm': latest_cache.latest_metric(water_devices, 'conductivity_us_cm')[0],
+        'tds_ppm': latest_cache.latest_metric(water_devices, 'tds_ppm')[0],
+        'created_at': latest_cache.latest_created_at(water_devices),
+    }
+
+    if isinstance(reading.get('created_at'), datetime.datetime):
+        reading['time_utc'] = reading['created_at'].strftime('%Y-%m-%dT%H:%M:%S')
+
+    # Every value above comes from a row no newer than the newest id of the water nodes.
+    etag = f"latest-water-{max((row['id'] for row in latest_rows if row), default=0)}"
+    return jsonify([reading]).get_data(), etag, reading.get('created_at')
 
 
+WATER_HISTORY_COLUMNS = (('water_level_pct', 'water_level_cm'), ('salinity_ppt', 'salinity_ppt'),
+                         ('conductivity_us_cm', 'conductivity_us_cm'), ('tds_ppm', 'tds_ppm'))
+
 @app.route('/get_water_history')
 def get_water_history():
-    # IMPLEMENTED: Fetches a combined history from ALL water nodes using the IN clause.
-    sql_template = """
-        SELECT device_id, water_level_cm AS water_level_pct, salinity_ppt, 
-               conductivity_us_cm, tds_ppm, created_at
-        FROM readings
-        WHERE device_id IN ({}) ORDER BY created_at DESC LIMIT 40; 
-    """ # Increased limit to 40 to get a mix of data
-    
-    water_devices = DEVICE_MAP['water']
-    placeholders = ', '.join(['%s'] * len(water_devices))
-    sql = sql_template.format(placeholders)
-    params = tuple(water_devices)
-
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
+    # IMPLEMENTED: A combined history from ALL water nodes.
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(sql, params)
-        history = list(reversed(cursor.fetchall()))
-        
-        for row in history:
-            if isinstance(row.get('created_at'), datetime.datetime):
-                row['time_label'] = row['created_at'].strftime('%H:%M:%S')
-
-        return jsonify(history)
+        return coalesced_response('history-water', lambda: render_history(
+            'water', DEVICE_MAP['water'], WATER_HISTORY_COLUMNS, WATER_HISTORY_POINTS))
     except Exception as e:
         print(f"Database history fetch error in /get_water_history: {e}")
         return jsonify({"error": "Could not retrieve water history"}), 500
-    finally:
-        if conn and conn.is_connected(): cursor.close(); conn.close()
 
 
-# --- SEARCH Endpoint (Unchanged but will work with all nodes) ---
+# --- LIVE UPDATES (Server-Sent Events) ---
+@app.route('/stream')
+def stream_readings():
+    # ?channel=air|water picks the devices from DEVICE_MAP; ?devices=a,b subscribes explicitly.
+    channel = request.args.get('channel')
+    if channel == 'air':
+        devices = [DEVICE_MAP['air']]
+    elif channel == 'water':
+        devices = DEVICE_MAP['water']
+    elif request.args.get('devices'):
+        devices = request.args.get('devices').split(',')
+    else:
+        devices = [DEVICE_MAP['air']] + DEVICE_MAP['water']
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(broadcaster.stream(devices), mimetype='text/event-stream', headers=headers)
+
+
+# --- SEARCH Endpoint (works with all nodes) ---
 @app.route('/search')
 def search_history():
     query_date = request.args.get('date')
     if not query_date:
         return jsonify({"error": "A date parameter is required."}), 400
-    
-    sql = """
-        SELECT 
-            device_id, created_at,
-            temperature_c, humidity_pct, pm2_5_ug_m3, pm10_ug_m3, 
-            wind_speed_ms, water_level_cm, salinity_ppt, tds_ppm
-        FROM readings 
-        WHERE DATE(created_at) = %s 
-        ORDER BY created_at DESC;
-    """
-    params = (query_date,)
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(sql, params)
-        results = cursor.fetchall()
+        day = datetime.date.fromisoformat(query_date)
+    except ValueError:
+        return jsonify({"error": "The date parameter must be in YYYY-MM-DD format."}), 400
 
-        for row in results:
-            if isinstance(row.get('created_at'), datetime.datetime):
-                row['time_utc'] = row['created_at'].strftime('%Y-%m-%dT%H:%i:%S')
+    # A day before today is closed: its rendered result is cached and browsers may keep it.
+    closed = day < datetime.date.today()
+    max_age = SEARCH_CACHE_TTL if closed else 0
+    snapshot = day_snapshots.manifest(day) if closed and day_snapshots is not None else None
+    if snapshot is not None:
+        # Snapshot days are validated from the manifest alone: a 304 reads no data at all.
+        not_modified = http_cache.not_modified(snapshot['etag'], snapshot['newest_at'], max_age=max_age)
+        if not_modified is not None:
+            return not_modified
+        key = (day, snapshot['etag'])
+        cached = search_cache.get(key)
+        if cached is None:
+            body = day_snapshots.search_body(day, snapshot, SEARCH_METRICS)
+            if body is not None:
+                cached = (body, snapshot['etag'], snapshot['newest_at'])
+                search_cache.put(key, cached, size=len(body))
+    else:
+        cached = search_cache.get(day) if closed else None
+    if cached is None:
+        sql, params = search_query(day)
+        conn = get_db_connection()
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        try:
+            with metrics.phase('db'):
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute(sql, params)
+                results = cursor.fetchall()
 
-        return jsonify(results)
-    except Exception as e:
-        print(f"Database search error: {e}")
-        return jsonify({"error": "Could not perform search"}), 500
-    finally:
-        if conn and conn.is_connected(): cursor.close(); conn.close()
+            newest_at = results[0]['created_at'] if results else None     # ORDER BY created_at DESC
+            body = render_search(results)
+            cached = (body, http_cache.content_etag(body), newest_at)
+            if closed:
+                search_cache.put(day, cached, size=len(body))
+        except Exception as e:
+            print(f"Database search error: {e}")
+            return jsonify({"error": "Could not perform search"}), 500
+        finally:
+            conn.close() # Returns the connection to the pool
+
+    body, etag, newest_at = cached
+    return http_cache.conditional(Response(body, mimetype='application/json'), etag, newest_at, max_age=max_age)
+
+
+@app.route('/pool_stats')
+def pool_stats():
+    return jsonify(db_pool.stats())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({'latest_cache': latest_cache.stats(), 'stream': broadcaster.stats(),
+                    'history': recent_history.stats(), 'search_cache': search_cache.stats(),
+                    'search_snapshots': day_snapshots.stats() if day_snapshots is not None else None,
+                    'compressed_bodies': compressed_bodies.stats(), 'coalescing': request_flights.stats()})
 
 
 # --- HTML Page Routes (UNCHANGED) ---
@@ -197,5 +364,10 @@ def intro_page(): return render_template('intro.html')
 
 if __name__ == '__main__':
     print("🚀 Starting Integrated Dashboard Server (FINAL MULTI-NODE VERSION)...")
-    print(f"   Connected to YOUR database: {DB_NAME}")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    print(f"   Connected to YOUR database: {storage.describe(DB_CONFIG)}")
+    # debug=True runs this file twice: a reloader parent and the serving child. Only the child compacts.
+    if day_snapshots is not None and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        day_snapshots.start(db_pool.acquire, interval=SNAPSHOT_INTERVAL)
+        print(f"🗜️ /search serves closed days from snapshots in '{SNAPSHOT_DIR}'")
+    # threaded=True: each open /stream connection holds a worker thread.
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
@@ -1,26 +1,57 @@
-from flask import Flask, jsonify, request
-import mysql.connector
-from mysql.connector import Error
+from flask import Flask, Response, jsonify, request
 import re
 import os
 
+import base64
+import datetime
+import json
+
+import exporter
+import http_cache
+import metrics
+import readings_stats
+import storage
+from db_pool import ConnectionPool
+from rollups import RESOLUTIONS, choose_resolution, parse_day, rollup_query
+from storage import Error
+
 # --- Configuration ---
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'unified_sensor_db',
-    'user': 'root',
-    'password': 'saintgits' # Directly set your password here
-}
+# MySQL or an embedded SQLite file, chosen with STORAGE_BACKEND (see storage.py).
+DB_CONFIG = storage.CONFIG
+
+# Connection pool: reuse connections across requests instead of reconnecting each time.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+
+# resolution=auto picks the finest rollup with at most this many buckets per device in the range.
+DEFAULT_MAX_POINTS = 1000
+
+# stream=1 responses are written out in chunks of this many rows.
+STREAM_FETCH_SIZE = int(os.getenv('STREAM_FETCH_SIZE', '500'))
+# /export reads raw rows in larger batches; this also bounds the memory one export uses.
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '5000'))
+# /stats with percentiles reads raw values into numpy columns this many rows at a time.
+STATS_FETCH_SIZE = int(os.getenv('STATS_FETCH_SIZE', '20000'))
 
 app = Flask(__name__)
+db_pool = ConnectionPool(DB_CONFIG, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+
+# Prometheus metrics on /metrics: per-route latency split into pool acquisition, DB and
+# serialization time, plus pool gauges (see metrics.py).
+metrics.instrument_flask(app)
+metrics.REGISTRY.register_collector(db_pool.metric_families)
+# Large JSON responses (/readings, /stats, ...) are sent brotli- or gzip-compressed; streamed
+# responses are not touched (see http_cache.py).
+http_cache.enable_compression(app)
 
 def query_db(query, args=()):
-    """ Helper function to query MySQL and return results as dictionaries. """
+    """ Helper function to query the database and return results as dictionaries. """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query, args)
-        results = cursor.fetchall()
+        with db_pool.connection() as conn, metrics.phase('db'):
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, args)
+            results = cursor.fetchall()
+            cursor.close()
         
         # QOL: Clean up data types for clean JSON output
         for row in results:
@@ -32,10 +63,11 @@ def query_db(query, args=()):
     except Error as e:
         print(f"❌ Database query error: {e}")
         return None
-    finally:
-        if 'conn' in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
+
+@app.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    """ Connection pool statistics (checkouts, wait times, recycled connections). """
+    return jsonify(db_pool.stats())
 
 @app.route('/devices', methods=['GET'])
 def get_devices():
@@ -46,10 +78,63 @@ def get_devices():
     else:
         return jsonify({"error": "Failed to retrieve device data."}), 500
 
-@app.route('/readings', methods=['GET'])
-def get_readings():
-    """ UPGRADED ENDPOINT: Get readings, now JOINed with device metadata. """
-    
+# --- Keyset pagination ---
+def encode_cursor(row, order):
+    """ Opaque `next` token pointing just past `row` in (created_at, id) order. """
+    position = {'t': row['created_at'].strftime('%Y-%m-%d %H:%M:%S'), 'i': row['id'], 'o': order}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """ (created_at, id, order) from a token produced by encode_cursor(); ValueError if malformed. """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        created_at = datetime.datetime.strptime(position['t'], '%Y-%m-%d %H:%M:%S')
+        row_id, order = int(position['i']), position['o']
+    except (TypeError, KeyError, ValueError):
+        raise ValueError("invalid cursor")
+    if order not in ('ASC', 'DESC'):
+        raise ValueError("invalid cursor: bad order")
+    return created_at, row_id, order
+
+def page_order(args, keyset=None):
+    """ Direction of a paginated walk: fixed by the cursor once the first page was served. """
+    if keyset:
+        return keyset[2]
+    return 'ASC' if args.get('order', 'DESC').upper() == 'ASC' else 'DESC'
+
+def page_size(args):
+    limit = args.get('limit', '100')
+    return int(limit) if limit.isdigit() and int(limit) > 0 else 100
+
+def requested_resolution(args):
+    """ 'raw', '1m', '1h' or '1d' for the request; 'auto' is resolved from the date range. """
+    resolution = args.get('resolution', 'raw')
+    if resolution != 'auto':
+        return resolution
+    start, end = parse_day(args.get('start_date')), parse_day(args.get('end_date'))
+    max_points = args.get('max_points', '')
+    max_points = int(max_points) if max_points.isdigit() and int(max_points) > 0 else DEFAULT_MAX_POINTS
+    return choose_resolution(start, end + datetime.timedelta(days=1) if end else None, max_points)
+
+def build_readings_query(args):
+    """
+    Build the /readings SQL and parameters from the request arguments.
+    With paginate=1 or a cursor, raw rows are ordered by (created_at, id) and one row more
+    than the page size is fetched so the caller can tell whether another page exists.
+    Raises ValueError for a malformed cursor or a cursor combined with a rollup resolution.
+    """
+    resolution = requested_resolution(args)
+    keyset = decode_cursor(args['cursor']) if args.get('cursor') else None
+    paginate = keyset is not None or args.get('paginate') == '1'
+    if paginate and resolution != 'raw':
+        raise ValueError("pagination is only supported for resolution=raw")
+    if resolution in RESOLUTIONS:
+        # Aggregated buckets from the rollup tables; at most one row per device and bucket.
+        limit = args.get('limit', args.get('max_points', str(DEFAULT_MAX_POINTS)))
+        return rollup_query(resolution, args.get('device_id'), args.get('start_date'), args.get('end_date'),
+                            order=args.get('order', 'DESC'),
+                            limit=int(limit) if limit.isdigit() and int(limit) > 0 else None)
+
     query_params = []
     # QOL: Base query now uses aliases for clarity (r for readings, d for devices)
     base_query = """
@@ -60,46 +145,260 @@ def get_readings():
     where_clauses = []
 
     # Filtering by device_id (exact match on the readings table)
-    device_id = request.args.get('device_id')
+    device_id = args.get('device_id')
     if device_id:
         where_clauses.append("r.device_id = %s")
         query_params.append(device_id)
         
-    # Filtering by date range
-    start_date = request.args.get('start_date')
+    # Filtering by date range. The range is half-open on the bare created_at column
+    # (>= start day, < the day after end day) so the (device_id, created_at) and
+    # (created_at) indexes can be used.
+    start_date = args.get('start_date')
     if start_date:
         where_clauses.append("r.created_at >= %s")
         query_params.append(start_date)
-    end_date = request.args.get('end_date')
+    end_date = args.get('end_date')
     if end_date:
-        where_clauses.append("r.created_at <= %s")
-        query_params.append(f"{end_date} 23:59:59")
-        
+        where_clauses.append("r.created_at < %s + INTERVAL 1 DAY")
+        query_params.append(end_date)
+
+    if paginate:
+        order = page_order(args, keyset)
+        if keyset:
+            # Written out instead of a row comparison so MySQL can use it as an index range.
+            created_at, row_id, _ = keyset
+            op = '<' if order == 'DESC' else '>'
+            where_clauses.append(f"(r.created_at {op} %s OR (r.created_at = %s AND r.id {op} %s))")
+            query_params += [created_at, created_at, row_id]
+        if where_clauses:
+            base_query += " WHERE " + " AND ".join(where_clauses)
+        base_query += f" ORDER BY r.created_at {order}, r.id {order} LIMIT {page_size(args) + 1}"
+        return base_query, tuple(query_params)
+
     if where_clauses:
         base_query += " WHERE " + " AND ".join(where_clauses)
 
     # Sorting (whitelisted to prevent injection)
-    sort_by = request.args.get('sort', 'created_at')
-    order = request.args.get('order', 'DESC')
+    sort_by = args.get('sort', 'created_at')
+    order = args.get('order', 'DESC')
     allowed_sort_columns = ['id', 'device_id', 'created_at'] # We sort by columns on the readings table
     if sort_by in allowed_sort_columns and order.upper() in ['ASC', 'DESC']:
         base_query += f" ORDER BY r.{sort_by} {order.upper()}"
 
     # Limiting results (sanitized)
-    limit = request.args.get('limit', '100')
+    limit = args.get('limit', '100')
     if limit.isdigit() and int(limit) > 0:
         base_query += f" LIMIT {int(limit)}"
-        
+
+    return base_query, tuple(query_params)
+
+# --- Streaming ---
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return app.json.default(value)    # same datetime/Decimal encoding as jsonify()
+
+def stream_batches(query, args=(), fetch_size=None, **cursor_options):
+    """
+    Run `query` on an unbuffered cursor and return (batches, release): `batches` yields lists
+    of up to `fetch_size` rows as they arrive from the server, so memory stays flat whatever
+    the result size. The query runs before this returns, so errors surface here as
+    storage.Error. The pooled connection is held until `batches` is exhausted or
+    release() is called; register release() with the response, since a generator that was
+    never started does not run its finally block when closed.
+    """
+    fetch_size = fetch_size or STREAM_FETCH_SIZE
+    conn = db_pool.acquire()
+    try:
+        with metrics.phase('db'):
+            cursor = conn.cursor(buffered=False, **cursor_options)
+            cursor.execute(query, args)
+    except Error:
+        conn.close()
+        raise
+
+    state = {'finished': False, 'released': False}
+
+    def release():
+        if state['released']:
+            return
+        state['released'] = True
+        if state['finished']:
+            cursor.close()
+            conn.close()
+        else:
+            # Client went away mid-stream (or before the first byte): dropping the connection
+            # is cheaper than reading the rest of the result off the wire just to reuse it.
+            conn.discard()
+
+    def batches():
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows
+            state['finished'] = True
+        finally:
+            release()
+
+    return batches(), release
+
+def json_array(batches, ndjson=False):
+    """ Encode batches of dict rows as one JSON array (or one JSON object per line). """
+    separator = '\n' if ndjson else ','
+    first = True
+    if not ndjson:
+        yield '['
+    for rows in batches:
+        chunk = separator.join(json.dumps(row, default=_json_default) for row in rows)
+        if ndjson:
+            chunk += '\n'
+        elif not first:
+            chunk = ',' + chunk
+        first = False
+        yield chunk
+    if not ndjson:
+        yield ']'
+
+@app.route('/readings', methods=['GET'])
+def get_readings():
+    """
+    UPGRADED ENDPOINT: Get readings, now JOINed with device metadata.
+    resolution=raw|1m|1h|1d|auto selects raw rows or rollup buckets (min/max/avg/count per metric).
+    paginate=1 returns {"data": [...], "next": token} pages in (created_at, id) order; pass the
+    token back as cursor=<token> with the same filters for the following page.
+    stream=1 writes the rows out as they are read (format=ndjson for one object per line).
+    """
+    resolution = requested_resolution(request.args)
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({"error": "resolution must be one of raw, 1m, 1h, 1d, auto."}), 400
+    try:
+        base_query, query_params = build_readings_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    paginate = bool(request.args.get('cursor')) or request.args.get('paginate') == '1'
+
+    if request.args.get('stream') == '1' and not paginate:
+        ndjson = request.args.get('format') == 'ndjson'
+        try:
+            batches, release = stream_batches(base_query, query_params, dictionary=True)
+        except Error as e:
+            print(f"❌ Database query error: {e}")
+            return jsonify({"error": "Failed to retrieve reading data."}), 500
+        response = Response(json_array(batches, ndjson), mimetype='application/x-ndjson' if ndjson else 'application/json')
+        response.call_on_close(release)
+        response.headers['X-Resolution'] = resolution
+        return response
+
     # --- Execute query and return ---
-    readings = query_db(base_query, tuple(query_params))
+    readings = query_db(base_query, query_params)
     
     if readings is not None:
-        return jsonify(readings)
+        if paginate:
+            size = page_size(request.args)
+            keyset = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+            order = page_order(request.args, keyset)
+            has_more = len(readings) > size
+            readings = readings[:size]
+            next_token = encode_cursor(readings[-1], order) if has_more else None
+            response = jsonify({"data": readings, "next": next_token})
+        else:
+            response = jsonify(readings)
+        response.headers['X-Resolution'] = resolution
+        return response
     else:
         return jsonify({"error": "Failed to retrieve reading data.", "query": base_query}), 500
 
+@app.route('/export', methods=['GET'])
+def export_readings():
+    """
+    Bulk export of raw readings for a date range:
+    /export?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD[&device_id=a,b][&format=ndjson|csv|parquet]
+    The file is encoded and sent while the rows are read, so any range can be exported.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in exporter.available_formats():
+        return jsonify({"error": f"format must be one of {', '.join(exporter.available_formats())}."}), 400
+    try:
+        start = datetime.date.fromisoformat(request.args.get('start_date', ''))
+        end = datetime.date.fromisoformat(request.args.get('end_date', ''))
+    except ValueError:
+        return jsonify({"error": "start_date and end_date are required (YYYY-MM-DD)."}), 400
+    if end < start:
+        return jsonify({"error": "end_date is before start_date."}), 400
+    device_ids = [d for d in request.args.get('device_id', '').split(',') if d]
+
+    sql, params = exporter.export_query(device_ids, start, end)
+    try:
+        batches, release = stream_batches(sql, params, fetch_size=EXPORT_FETCH_SIZE, raw=True)
+    except Error as e:
+        print(f"❌ Database query error: {e}")
+        return jsonify({"error": "Failed to export reading data."}), 500
+
+    def done(stats):
+        print(f"📦 Export {start}..{end} as {fmt}: {stats.summary()}")
+
+    content_type, extension = exporter.FORMATS[fmt]
+    response = Response(exporter.encode(fmt, batches, on_done=done), mimetype=content_type)
+    response.call_on_close(release)
+    response.headers['Content-Disposition'] = f'attachment; filename="readings_{start}_{end}.{extension}"'
+    return response
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Per-device, per-metric statistics over a window:
+    /stats?start_date=...&end_date=...[&device_id=a,b][&metric=temperature_c,...][&bucket=all|15m|1h|1d]
+          [&percentiles=50,90,99][&engine=sql|numpy]
+    Dates are YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS. Each group has count/min/max/mean/stddev and the
+    requested percentiles per metric. Without percentiles (percentiles=) the aggregation runs in
+    MySQL; with them, raw values are reduced with numpy (see readings_stats.py).
+    """
+    args = request.args
+    try:
+        start, end = readings_stats.parse_window(args.get('start_date'), args.get('end_date'))
+        bucket_seconds = readings_stats.parse_bucket(args.get('bucket'), start, end)
+        metric_names = readings_stats.parse_metrics(args.get('metric'))
+        percentiles = readings_stats.parse_percentiles(args.get('percentiles'))
+        engine = readings_stats.choose_engine(args.get('engine'), percentiles)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    device_ids = [d for d in args.get('device_id', '').split(',') if d]
+
+    try:
+        if engine == 'sql':
+            sql, params = readings_stats.aggregate_query(device_ids, metric_names, start, end, bucket_seconds)
+            with db_pool.connection() as conn, metrics.phase('db'):
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                cursor.close()
+            groups = readings_stats.from_aggregate_rows(rows, metric_names, start, bucket_seconds)
+        else:
+            sql, params = readings_stats.columns_query(device_ids, metric_names, start, end)
+            batches, release = stream_batches(sql, params, fetch_size=STATS_FETCH_SIZE)
+            collected = readings_stats.ColumnBatches(metric_names)
+            try:
+                for rows in batches:
+                    collected.add(rows)
+            finally:
+                release()
+            groups = readings_stats.summarize(collected.device_ids, *collected.columns(), start, end,
+                                              bucket_seconds, percentiles)
+    except Error as e:
+        print(f"❌ Database query error: {e}")
+        return jsonify({"error": "Failed to compute statistics."}), 500
+
+    return jsonify({"start": start, "end": end, "bucket_seconds": bucket_seconds, "engine": engine,
+                    "percentiles": list(percentiles), "data": groups})
+
 if __name__ == '__main__':
     print("🚀 Starting ADVANCED RELATIONAL API server...")
+    print(f"🗄️ Storage: {storage.describe(DB_CONFIG)}")
     print("📡 Devices endpoint: http://10.239.206.235:5002/devices")
     print("📡 Readings endpoint: http://10.239.206.235:5002/readings")
-    app.run(host='0.0.0.0', port=5002)
\ No newline at end of file
+    print("📡 Export endpoint: http://10.239.206.235:5002/export")
+    print("📡 Stats endpoint: http://10.239.206.235:5002/stats")
+    print("📡 Metrics endpoint: http://10.239.206.235:5002/metrics")
+    app.run(host='0.0.0.0', port=5002, threaded=True)
\ No newline at end of file
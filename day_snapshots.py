@@ -0,0 +1,487 @@
+# File: day_snapshots.py
+# Description: Per-day, per-device columnar snapshots of 'readings' for the /search endpoint of
+#              app.py. A day that has ended never changes, so a background compaction job reads
+#              it from the database once and writes one compressed file per device that only
+#              holds the metrics the device actually reported (an air node's file has no water
+#              columns). /search then serves that day from the files, memory-mapped, instead of
+#              querying the wide, mostly-NULL table again.
+#
+#              Layout:  <directory>/<YYYY-MM-DD>/manifest.json
+#                       <directory>/<YYYY-MM-DD>/<url-quoted device_id>.<generation>.col
+#              The manifest is written last (atomically), so a day without one is not served.
+#              It lists the files, the row count and the newest readings.id of the day, and an
+#              ETag derived from the files. A day is compacted `settle_seconds` after its
+#              midnight. Every pass then looks up the days that received readings since the
+#              pass before last (ids above a watermark, so rows of transactions still open at
+#              the last pass are not missed), compares their snapshots with the table (COUNT,
+#              MAX(id)) and rewrites the ones that changed, however old: late readings, e.g.
+#              replayed from the listener's spool, reach /search.
+#              A day holding a value the format cannot carry exactly (beyond int32 hundredths,
+#              more than two decimals or not finite, all possible on SQLite's REAL columns) gets
+#              a manifest without files, marked "database_only": /search queries it instead.
+#
+#              File format, version 1 (little-endian):
+#                'SNAP'  u8 version  u32 N  N bytes of JSON header
+#                        {"device_id", "day", "rows", "columns": [[name, offset, length], ...]}
+#                then one zlib-compressed int32 array per column, at header offsets:
+#                  "time"     seconds after midnight, ascending, delta-encoded
+#                  <metric>   value x 100 (the columns are DECIMAL(n, 2)), NULL_VALUE for NULL
+#              A column is decompressed only if the reader asks for it.
+#
+# Usage:   python day_snapshots.py [--dir snapshots] [--max-days 0] [--rebuild YYYY-MM-DD ...]
+
+import argparse
+import array
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mmap
+import operator
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+from latest_cache import METRIC_COLUMNS
+
+MAGIC = b'SNAP'
+VERSION = 1
+MANIFEST = 'manifest.json'
+DECIMAL_SCALE = 100
+NULL_VALUE = -2 ** 31
+COMPRESS_LEVEL = 6
+FETCH_ROWS = 5000
+
+_PREFIX = struct.Struct('<4sBI')    # magic, version, header length
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')   # HTTP dates are English whatever the locale
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+_SWAP = sys.byteorder == 'big'      # arrays are stored little-endian
+
+# Ascending, so rows append to each device's columns in file order.
+SQL_DAY_READINGS = f"""
+    SELECT id, device_id, created_at, {', '.join(METRIC_COLUMNS)}
+    FROM readings
+    WHERE created_at >= %s AND created_at < %s
+    ORDER BY created_at, id
+"""
+# Answered from idx_readings_created alone (the secondary index holds the primary key).
+SQL_DAY_SUMMARY = """
+    SELECT COUNT(*), MAX(id) FROM readings WHERE created_at >= %s AND created_at < %s
+"""
+# Not MIN(created_at): SQLite returns an aggregate as text, the bare column as a datetime.
+SQL_FIRST_READING = "SELECT created_at FROM readings ORDER BY created_at LIMIT 1"
+# Days that received readings after a watermark id: a primary key range, only the new rows.
+SQL_CHANGED_DAYS = "SELECT DISTINCT DATE(created_at) FROM readings WHERE id > %s"
+SQL_MAX_ID = "SELECT MAX(id) FROM readings"
+WATERMARK = 'watermark'
+
+
+def _day_range(day):
+    start = datetime.datetime.combine(day, datetime.time())
+    return start, start + datetime.timedelta(days=1)
+
+
+def _to_bytes(values):
+    if _SWAP:
+        values = array.array('i', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _scaled(value):
+    """ A metric value as int32 hundredths, or None if that would not give the same value back. """
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    stored = round(value * DECIMAL_SCALE)
+    if not NULL_VALUE < stored < 2 ** 31 or stored / DECIMAL_SCALE != value:
+        return None
+    return stored
+
+
+def _from_bytes(data):
+    values = array.array('i')
+    values.frombytes(data)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+# --- Files ---
+def encode_device(device_id, day, times, columns):
+    """
+    Bytes of one device's snapshot: `times` are int seconds after midnight (ascending),
+    `columns` {metric: array('i') of hundredths or NULL_VALUE}, one entry per row.
+    """
+    deltas = array.array('i', times)
+    for i in range(len(deltas) - 1, 0, -1):
+        deltas[i] -= deltas[i - 1]
+    layout, blocks, offset = [], [], 0
+    for name, values in [('time', deltas)] + list(columns.items()):
+        block = zlib.compress(_to_bytes(values), COMPRESS_LEVEL)
+        layout.append([name, offset, len(block)])
+        blocks.append(block)
+        offset += len(block)
+    header = json.dumps({'device_id': device_id, 'day': day.isoformat(), 'rows': len(times),
+                         'columns': layout}).encode()
+    return _PREFIX.pack(MAGIC, VERSION, len(header)) + header + b''.join(blocks)
+
+
+def read_columns(path, metrics=None):
+    """
+    (header, {column: array('i')}) of a snapshot file, memory-mapped: "time" as seconds after
+    midnight plus the stored metrics that are in `metrics` (all of them if None), still scaled.
+    Raises ValueError for a file that is not a snapshot.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, version, header_length = _PREFIX.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot")
+        header = json.loads(mapped[_PREFIX.size:_PREFIX.size + header_length])
+        data = _PREFIX.size + header_length
+        view = memoryview(mapped)
+        try:
+            columns = {}
+            for name, offset, length in header['columns']:
+                if name == 'time' or metrics is None or name in metrics:
+                    columns[name] = _from_bytes(zlib.decompress(view[data + offset:data + offset + length]))
+        finally:
+            view.release()      # the map cannot close while a view of it exists
+    columns['time'] = array.array('i', itertools.accumulate(columns['time']))
+    return header, columns
+
+
+def read_device(path, metrics=None):
+    """ (device_id, [created_at, ...] ascending, {metric: [value or None, ...]}) of a snapshot file. """
+    header, columns = read_columns(path, metrics)
+    midnight = datetime.datetime.fromisoformat(header['day'])
+    times = [midnight + datetime.timedelta(seconds=s) for s in columns.pop('time')]
+    values = {name: [None if v == NULL_VALUE else v / DECIMAL_SCALE for v in stored]
+              for name, stored in columns.items()}
+    return header['device_id'], times, values
+
+
+class DaySnapshots:
+    """ Snapshot directory: compaction of closed days and reading them back for /search. """
+
+    def __init__(self, directory, settle_seconds=3600):
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self._manifests = {}        # day -> (mtime_ns, manifest)
+        self._first_day = None
+        self._watermarks = None     # (id checked up to, MAX(id) at the last pass)
+        self._lock = threading.Lock()   # one compaction at a time
+        self._stop = threading.Event()
+        self.counters = {'days_compacted': 0, 'days_rewritten': 0, 'rows_compacted': 0, 'bytes_written': 0,
+                         'days_served': 0, 'days_database_only': 0, 'read_errors': 0, 'compaction_errors': 0}
+        self.last_pass = None
+
+    def _day_dir(self, day):
+        return os.path.join(self.directory, day.isoformat())
+
+    # --- Reading ---
+    def manifest(self, day):
+        """ The manifest of a day /search can serve from its files, or None. """
+        manifest = self._load(day)
+        return None if manifest is None or manifest.get('database_only') else manifest
+
+    def _load(self, day):
+        """ The manifest of a compacted day (database_only or not), or None. Re-read only when the file changes. """
+        path = os.path.join(self._day_dir(day), MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._manifests.get(day)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Unreadable snapshot manifest {path}: {e}")
+            return None
+        manifest['newest_at'] = manifest['newest_at'] and datetime.datetime.fromisoformat(manifest['newest_at'])
+        self._manifests[day] = (mtime, manifest)
+        return manifest
+
+    def search_body(self, day, manifest, columns):
+        """
+        The /search JSON of a compacted day: the bytes app.render_search() makes of the same
+        rows (compact, keys sorted, created_at as an HTTP date, time_utc, None for metrics a
+        device does not have), newest first across devices. It is rendered straight from the
+        columns, with no row objects in between. Returns None if a file is gone (the day was
+        rewritten meanwhile) or unreadable, so the caller can query the database instead.
+        """
+        # Every row of the day shares the date part of created_at and time_utc.
+        created_prefix = f'"{_WEEKDAYS[day.weekday()]}, {day.day:02d} {_MONTHS[day.month - 1]} {day.year:04d} '
+        utc_prefix = f'"{day.isoformat()}T'
+        keys = sorted(('created_at', 'device_id', 'time_utc') + tuple(columns))
+        per_device = []
+        try:
+            for entry in manifest['devices'].values():
+                header, stored = read_columns(os.path.join(self._day_dir(day), entry['file']), columns)
+                seconds = stored.pop('time')
+                clock = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds]
+                fields, series = [], []     # str.format() template per key, and the column of each {} in it
+                for key in keys:
+                    if key == 'created_at':
+                        series.append([f'{created_prefix}{hms} GMT"' for hms in clock])
+                    elif key == 'time_utc':
+                        series.append([f'{utc_prefix}{hms}"' for hms in clock])
+                    elif key in stored:
+                        series.append(['null' if v == NULL_VALUE else repr(v / DECIMAL_SCALE) for v in stored[key]])
+                    else:
+                        literal = json.dumps(header['device_id']) if key == 'device_id' else 'null'
+                        fields.append(f'"{key}":' + literal.replace('{', '{{').replace('}', '}}'))
+                        continue
+                    fields.append(f'"{key}":{{}}')
+                template = '{{' + ','.join(fields) + '}}'
+                rows = list(zip(seconds, map(template.format, *series)))
+                rows.reverse()
+                per_device.append(rows)
+        except (OSError, ValueError, KeyError, zlib.error) as e:
+            self.counters['read_errors'] += 1
+            print(f"⚠️ Could not read the {day} snapshot, querying the database instead: {e}")
+            return None
+        self.counters['days_served'] += 1
+        merged = heapq.merge(*per_device, key=operator.itemgetter(0), reverse=True)
+        return ('[' + ','.join(text for _, text in merged) + ']').encode()
+
+    # --- Compaction ---
+    def closed_through(self, now=None):
+        """ The last day that ended at least settle_seconds ago. """
+        now = now or datetime.datetime.now()
+        return (now - datetime.timedelta(seconds=self.settle_seconds)).date() - datetime.timedelta(days=1)
+
+    def compact_day(self, conn, day, summary=None):
+        """ Write the snapshot of one day from the database, replacing any previous one. Returns the manifest. """
+        start, end = _day_range(day)
+        cursor = conn.cursor()
+        cursor.execute(SQL_DAY_READINGS, (start, end))
+        devices = {}        # device_id -> (times, [array per metric])
+        max_id, newest_at, total = None, None, 0
+        unfit = None        # the first value the format cannot carry
+        while True:
+            batch = cursor.fetchmany(FETCH_ROWS)
+            if not batch:
+                break
+            for row_id, device_id, created_at, *values in batch:
+                device = devices.get(device_id)
+                if device is None:
+                    device = devices[device_id] = (array.array('i'), [array.array('i') for _ in METRIC_COLUMNS])
+                device[0].append(int((created_at - start).total_seconds()))
+                for metric, column, value in zip(METRIC_COLUMNS, device[1], values):
+                    stored = NULL_VALUE if value is None else _scaled(value)
+                    if stored is None:
+                        unfit = unfit or f"{metric} = {value!r} of {device_id} at {created_at}"
+                        stored = NULL_VALUE
+                    column.append(stored)
+                max_id = row_id if max_id is None else max(max_id, row_id)
+            newest_at = batch[-1][2]
+            total += len(batch)
+        cursor.close()
+        if summary is not None and (total, max_id) != summary:
+            print(f"ℹ️ Readings of {day} changed while it was compacted ({summary[0]} -> {total} rows).")
+
+        day_dir = self._day_dir(day)
+        os.makedirs(day_dir, exist_ok=True)
+        previous = self._load(day)
+        generation = format(time.time_ns(), 'x')
+        digest = hashlib.blake2b(digest_size=12)
+        entries = {}
+        if unfit is not None:
+            print(f"⚠️ {day} stays in the database for /search: {unfit} does not fit a snapshot.")
+            devices = {}
+        for device_id in sorted(devices):
+            times, columns = devices[device_id]
+            # Only the metrics this device reported on this day.
+            stored = {metric: column for metric, column in zip(METRIC_COLUMNS, columns)
+                      if any(value != NULL_VALUE for value in column)}
+            data = encode_device(device_id, day, times, stored)
+            name = f"{urllib.parse.quote(device_id, safe='')}.{generation}.col"
+            with open(os.path.join(day_dir, name), 'wb') as f:
+                f.write(data)
+            digest.update(data)
+            entries[device_id] = {'file': name, 'rows': len(times), 'metrics': list(stored), 'bytes': len(data)}
+            self.counters['bytes_written'] += len(data)
+
+        manifest = {'version': VERSION, 'day': day.isoformat(), 'rows': total, 'max_id': max_id,
+                    'newest_at': newest_at.isoformat(sep=' ') if newest_at else None,
+                    'etag': f"snap-{day.isoformat()}-{digest.hexdigest()}",
+                    'compacted_at': datetime.datetime.now().isoformat(sep=' ', timespec='seconds'),
+                    'devices': entries}
+        if unfit is not None:
+            manifest['database_only'] = unfit
+            self.counters['days_database_only'] += 1
+        tmp = os.path.join(day_dir, f"{MANIFEST}.{generation}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, os.path.join(day_dir, MANIFEST))
+
+        # Files of the previous generation; a reader still holding the old manifest falls back to the database.
+        if previous is not None:
+            for entry in previous['devices'].values():
+                try:
+                    os.remove(os.path.join(day_dir, entry['file']))
+                except OSError:
+                    pass
+        self.counters['days_rewritten' if previous is not None else 'days_compacted'] += 1
+        self.counters['rows_compacted'] += total
+        self._manifests.pop(day, None)
+        return self._load(day)
+
+    def compact_pending(self, conn, max_days=31, now=None):
+        """
+        One compaction pass: rewrite the snapshots of days that changed in the table since
+        the pass before last, then snapshot up to `max_days` closed days that have none yet
+        (0 = no limit), oldest first. Returns the days written.
+        """
+        with self._lock:
+            last = self.closed_through(now)
+            written = []
+            current = self._scalar(conn, SQL_MAX_ID)
+            if current is None:
+                return written
+            checked, previous = self._watermarks or (self._load_watermark(), None)
+            if checked is None:
+                checked = current       # no snapshots yet: nothing to re-verify
+            for day in self._changed_days(conn, checked):
+                manifest = self._load(day) if day <= last else None
+                if manifest is None:
+                    continue
+                cursor = conn.cursor()
+                cursor.execute(SQL_DAY_SUMMARY, _day_range(day))
+                count, max_id = cursor.fetchone()
+                cursor.close()
+                if (count, max_id) != (manifest['rows'], manifest['max_id']):
+                    self.compact_day(conn, day, summary=(count, max_id))
+                    written.append(day)
+            # Next pass looks past this pass's MAX(id) only, one pass later, so rows with lower
+            # ids whose transactions were still open now are looked at too.
+            if previous is not None and previous != checked:
+                self._save_watermark(previous)
+            self._watermarks = (previous if previous is not None else checked, current)
+
+            if self._first_day is None:
+                cursor = conn.cursor()
+                cursor.execute(SQL_FIRST_READING)
+                first = cursor.fetchone()
+                cursor.close()
+                if first is None:
+                    return written
+                self._first_day = first[0].date()
+            day = self._first_day
+            while day <= last and (not max_days or len(written) < max_days):
+                if self._load(day) is None:
+                    self.compact_day(conn, day)
+                    written.append(day)
+                day += datetime.timedelta(days=1)
+            self.last_pass = time.time()
+            return written
+
+    @staticmethod
+    def _scalar(conn, sql, params=()):
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+
+    @staticmethod
+    def _changed_days(conn, after_id):
+        cursor = conn.cursor()
+        cursor.execute(SQL_CHANGED_DAYS, (after_id,))
+        # MySQL returns dates, SQLite 'YYYY-MM-DD' text.
+        days = sorted(value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
+                      for value, in cursor.fetchall() if value is not None)
+        cursor.close()
+        return days
+
+    def _load_watermark(self):
+        """
+        The id the last run had checked up to. Without the file, the lowest max_id of any
+        snapshot, since every reading inserted after a snapshot was written has a higher id
+        (None if there are no snapshots).
+        """
+        try:
+            with open(os.path.join(self.directory, WATERMARK), encoding='utf-8') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            pass
+        lowest = None
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                try:
+                    manifest = self._load(datetime.date.fromisoformat(name))
+                except ValueError:
+                    continue
+                if manifest is not None and manifest['max_id'] is not None:
+                    lowest = manifest['max_id'] if lowest is None else min(lowest, manifest['max_id'])
+        return lowest
+
+    def _save_watermark(self, watermark):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, WATERMARK)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(watermark))
+        os.replace(path + '.tmp', path)
+
+    def start(self, acquire, interval=600):
+        """ Run compact_pending() every `interval` seconds on a connection from acquire() (closed after). """
+        def run():
+            delay = 5       # the first pass soon after startup
+            while not self._stop.wait(delay):
+                delay = interval
+                try:
+                    conn = acquire()
+                except Exception as e:
+                    self.counters['compaction_errors'] += 1
+                    print(f"⚠️ Snapshot compaction skipped, no database connection: {e}")
+                    continue
+                try:
+                    days = self.compact_pending(conn)
+                    if days:
+                        print(f"🗜️ Snapshots written for {len(days)} day(s): {days[0]} .. {days[-1]}")
+                except Exception as e:
+                    self.counters['compaction_errors'] += 1
+                    print(f"⚠️ Snapshot compaction failed: {e}")
+                finally:
+                    conn.close()
+        threading.Thread(target=run, name='snapshot-compactor', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {**self.counters, 'directory': self.directory, 'closed_through': self.closed_through().isoformat(),
+                'last_pass_age_s': round(time.time() - self.last_pass, 1) if self.last_pass else None}
+
+
+if __name__ == '__main__':
+    import storage
+
+    parser = argparse.ArgumentParser(description="Write per-day snapshots of closed days for /search.")
+    parser.add_argument('--dir', default='snapshots')
+    parser.add_argument('--max-days', type=int, default=0, help="days to snapshot in this run (0 = all pending)")
+    parser.add_argument('--rebuild', nargs='*', default=[], metavar='YYYY-MM-DD', help="rewrite these days")
+    args = parser.parse_args()
+
+    snapshots = DaySnapshots(args.dir)
+    conn = storage.connect(storage.CONFIG)
+    try:
+        for text in args.rebuild:
+            manifest = snapshots.compact_day(conn, datetime.date.fromisoformat(text))
+            print(f"🗜️ {text}: {manifest['rows']} readings, {len(manifest['devices'])} device file(s)"
+                  + (" (database only)" if manifest.get('database_only') else ""))
+        days = snapshots.compact_pending(conn, max_days=args.max_days)
+        print(f"✅ {len(days)} day(s) written to '{args.dir}'. {snapshots.stats()}")
+    finally:
+        conn.close()
@@ -23,9 +23,12 @@ CREATE TABLE devices (
 
 
 -- Table 2: Stores the actual time-series data from all sensors.
--- This is the new, fully updated version with all necessary columns.
+-- Range-partitioned on created_at (migration 002): db/partition_maintenance.py splits the
+-- catch-all partition into monthly/daily partitions and drops or archives expired ones.
+-- Partitioned tables cannot have foreign keys, so device_id is not enforced by an FK;
+-- the ingestion service always upserts the device before its readings.
 CREATE TABLE readings (
-    id INT PRIMARY KEY AUTO_INCREMENT,
+    id BIGINT NOT NULL AUTO_INCREMENT,
     device_id VARCHAR(255) NOT NULL,
     
     -- Air Quality Sensor Columns
@@ -41,7 +44,113 @@ CREATE TABLE readings (
     conductivity_us_cm DECIMAL(8, 2) NULL, -- This column was missing
     tds_ppm DECIMAL(7, 2) NULL,            -- This column was missing
     
-    -- Timestamp and the critical link to the 'devices' table
+    -- Timestamp; part of the primary key because the table is partitioned on it
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
-    FOREIGN KEY (device_id) REFERENCES devices(device_id) ON DELETE CASCADE
-);
\ No newline at end of file
+    PRIMARY KEY (id, created_at),
+
+    -- Time-range indexes (migration 001): latest-N per device, per-device and per-day ranges.
+    INDEX idx_readings_device_created (device_id, created_at),
+    INDEX idx_readings_created (created_at)
+)
+PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+
+-- Tables 3-5: Per-device rollups (migration 003), maintained by the ingestion service.
+-- 1-minute buckets
+CREATE TABLE readings_1m (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1m_bucket (bucket_start)
+);
+
+-- 1-hour buckets
+CREATE TABLE readings_1h (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1h_bucket (bucket_start)
+);
+
+-- 1-day buckets
+CREATE TABLE readings_1d (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1d_bucket (bucket_start)
+);
+
+
+-- Table 6: Replay position of the MQTT listener's on-disk spool (migration 004).
+-- Updated in the same transaction as the replayed readings, so a batch is never replayed twice.
+CREATE TABLE spool_checkpoints (
+    spool_id VARCHAR(64) PRIMARY KEY,
+    segment BIGINT NOT NULL,
+    position BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP NOT NULL
+);
+
+
+-- Table 7: Alerts raised by the MQTT listener's rule engine (migration 005, see alert_engine.py).
+-- No foreign key to devices: an alert can be stored before its device row is committed.
+CREATE TABLE alerts (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    device_id VARCHAR(255) NOT NULL,
+    rule VARCHAR(64) NOT NULL,
+    metric VARCHAR(64) NOT NULL,
+    kind VARCHAR(16) NOT NULL,          -- threshold | rate | zscore
+    severity VARCHAR(16) NOT NULL,      -- info | warning | critical
+    value DOUBLE NOT NULL,
+    score DOUBLE NULL,
+    limit_value DOUBLE NULL,
+    message VARCHAR(255) NOT NULL,
+    triggered_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    INDEX idx_alerts_device_triggered (device_id, triggered_at),
+    INDEX idx_alerts_triggered (triggered_at)
+);
+
+
+-- Table 8: Schema migrations already contained in this file (see db/migrate.py).
+CREATE TABLE schema_migrations (
+    version VARCHAR(255) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+INSERT INTO schema_migrations (version) VALUES
+    ('001_readings_indexes'),
+    ('002_partition_readings'),
+    ('003_rollup_tables'),
+    ('004_spool_checkpoints'),
+    ('005_alerts');
\ No newline at end of file
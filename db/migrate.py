@@ -0,0 +1,78 @@
+# File: migrate.py
+# Description: Applies the SQL files in db/migrations/ in filename order, once each.
+#              Applied versions are recorded in the 'schema_migrations' table, so running
+#              this again only applies new migrations. A fresh database created from
+#              db/db.sql already contains every migration and is marked as such.
+#
+# Usage: python db/migrate.py [--dry-run]
+
+import glob
+import os
+import sys
+
+import mysql.connector
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def split_statements(sql):
+    """ Split a migration file on ';' at end of line, dropping '--' comment lines. """
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    statements, current = [], []
+    for line in lines:
+        current.append(line)
+        if line.rstrip().endswith(';'):
+            statements.append('\n'.join(current).strip().rstrip(';'))
+            current = []
+    if '\n'.join(current).strip():
+        statements.append('\n'.join(current).strip())
+    return statements
+
+
+def pending_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+    files = sorted(glob.glob(os.path.join(MIGRATIONS_DIR, '*.sql')))
+    return [(os.path.splitext(os.path.basename(f))[0], f) for f in files
+            if os.path.splitext(os.path.basename(f))[0] not in applied]
+
+
+if __name__ == '__main__':
+    dry_run = '--dry-run' in sys.argv
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        todo = pending_migrations(cursor)
+        if not todo:
+            print("✅ Database schema is up to date.")
+        for version, path in todo:
+            with open(path, encoding='utf-8') as f:
+                statements = split_statements(f.read())
+            print(f"🔧 Applying {version} ({len(statements)} statement(s))" + (" [dry run]" if dry_run else ""))
+            if dry_run:
+                continue
+            # MySQL DDL commits implicitly, so a migration is recorded only after all of it ran.
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+            conn.commit()
+            print(f"✅ {version} applied.")
+    except mysql.connector.Error as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,11 @@
+-- Migration 001: indexes for the time-range queries used by the dashboards and APIs.
+--
+-- (device_id, created_at) serves "latest N rows of a device" (ORDER BY created_at DESC LIMIT n)
+-- and per-device date ranges without a filesort. (created_at) serves date ranges across all
+-- devices, e.g. /search for a whole day.
+--
+-- Apply with: python db/migrate.py
+
+ALTER TABLE readings
+    ADD INDEX idx_readings_device_created (device_id, created_at),
+    ADD INDEX idx_readings_created (created_at);
@@ -0,0 +1,26 @@
+-- Migration 002: range-partition 'readings' by created_at and widen the key to BIGINT.
+--
+-- MySQL restrictions this has to satisfy:
+--   * Partitioned InnoDB tables cannot take part in foreign keys, so the readings -> devices
+--     FK is dropped. Readings are no longer deleted automatically with their device; expired
+--     data is removed per partition by db/partition_maintenance.py instead.
+--   * Every unique key must contain the partitioning column, so the primary key becomes
+--     (id, created_at). id stays AUTO_INCREMENT and is still unique on its own in practice.
+--   * A TIMESTAMP column can only be range-partitioned through UNIX_TIMESTAMP(), which the
+--     optimizer understands for partition pruning on created_at ranges.
+--
+-- The table starts with a single catch-all partition. Run db/partition_maintenance.py right
+-- after this migration (and then daily) to split it into monthly or daily partitions.
+-- Note: this rebuilds the table; on a large table run it in a maintenance window.
+
+ALTER TABLE readings DROP FOREIGN KEY readings_ibfk_1;
+
+ALTER TABLE readings
+    MODIFY id BIGINT NOT NULL AUTO_INCREMENT,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, created_at);
+
+ALTER TABLE readings
+    PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (
+        PARTITION p_future VALUES LESS THAN MAXVALUE
+    );
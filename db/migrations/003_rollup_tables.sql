@@ -0,0 +1,106 @@
+-- Migration 003: per-device rollup tables at 1-minute, 1-hour and 1-day resolution.
+--
+-- One row per (device, bucket) with min / max / sum / count for every metric; the average is
+-- sum / count at query time, which keeps the rows mergeable. The ingestion service updates
+-- all three tables in the same transaction as the raw INSERT (see rollups.py), and
+-- /readings?resolution=1m|1h|1d|auto reads from them.
+--
+-- The INSERT ... SELECT statements below backfill the rollups from the existing readings.
+-- Stop the MQTT listener while this migration runs, or rows ingested meanwhile are counted twice.
+
+-- 1-minute buckets
+CREATE TABLE readings_1m (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1m_bucket (bucket_start)
+);
+
+-- 1-hour buckets
+CREATE TABLE readings_1h (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1h_bucket (bucket_start)
+);
+
+-- 1-day buckets
+CREATE TABLE readings_1d (
+    device_id VARCHAR(255) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INT NOT NULL DEFAULT 0,
+    temperature_c_min DOUBLE NULL, temperature_c_max DOUBLE NULL, temperature_c_sum DOUBLE NOT NULL DEFAULT 0, temperature_c_count INT NOT NULL DEFAULT 0,
+    humidity_pct_min DOUBLE NULL, humidity_pct_max DOUBLE NULL, humidity_pct_sum DOUBLE NOT NULL DEFAULT 0, humidity_pct_count INT NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min DOUBLE NULL, pm2_5_ug_m3_max DOUBLE NULL, pm2_5_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm2_5_ug_m3_count INT NOT NULL DEFAULT 0,
+    pm10_ug_m3_min DOUBLE NULL, pm10_ug_m3_max DOUBLE NULL, pm10_ug_m3_sum DOUBLE NOT NULL DEFAULT 0, pm10_ug_m3_count INT NOT NULL DEFAULT 0,
+    wind_speed_ms_min DOUBLE NULL, wind_speed_ms_max DOUBLE NULL, wind_speed_ms_sum DOUBLE NOT NULL DEFAULT 0, wind_speed_ms_count INT NOT NULL DEFAULT 0,
+    water_level_cm_min DOUBLE NULL, water_level_cm_max DOUBLE NULL, water_level_cm_sum DOUBLE NOT NULL DEFAULT 0, water_level_cm_count INT NOT NULL DEFAULT 0,
+    salinity_ppt_min DOUBLE NULL, salinity_ppt_max DOUBLE NULL, salinity_ppt_sum DOUBLE NOT NULL DEFAULT 0, salinity_ppt_count INT NOT NULL DEFAULT 0,
+    conductivity_us_cm_min DOUBLE NULL, conductivity_us_cm_max DOUBLE NULL, conductivity_us_cm_sum DOUBLE NOT NULL DEFAULT 0, conductivity_us_cm_count INT NOT NULL DEFAULT 0,
+    tds_ppm_min DOUBLE NULL, tds_ppm_max DOUBLE NULL, tds_ppm_sum DOUBLE NOT NULL DEFAULT 0, tds_ppm_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start),
+    INDEX idx_readings_1d_bucket (bucket_start)
+);
+
+-- Backfill from existing raw readings.
+INSERT INTO readings_1m (device_id, bucket_start, samples, temperature_c_min, temperature_c_max, temperature_c_sum, temperature_c_count, humidity_pct_min, humidity_pct_max, humidity_pct_sum, humidity_pct_count, pm2_5_ug_m3_min, pm2_5_ug_m3_max, pm2_5_ug_m3_sum, pm2_5_ug_m3_count, pm10_ug_m3_min, pm10_ug_m3_max, pm10_ug_m3_sum, pm10_ug_m3_count, wind_speed_ms_min, wind_speed_ms_max, wind_speed_ms_sum, wind_speed_ms_count, water_level_cm_min, water_level_cm_max, water_level_cm_sum, water_level_cm_count, salinity_ppt_min, salinity_ppt_max, salinity_ppt_sum, salinity_ppt_count, conductivity_us_cm_min, conductivity_us_cm_max, conductivity_us_cm_sum, conductivity_us_cm_count, tds_ppm_min, tds_ppm_max, tds_ppm_sum, tds_ppm_count)
+SELECT device_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:%i:00'), COUNT(*),
+       MIN(temperature_c), MAX(temperature_c), COALESCE(SUM(temperature_c), 0), COUNT(temperature_c),
+       MIN(humidity_pct), MAX(humidity_pct), COALESCE(SUM(humidity_pct), 0), COUNT(humidity_pct),
+       MIN(pm2_5_ug_m3), MAX(pm2_5_ug_m3), COALESCE(SUM(pm2_5_ug_m3), 0), COUNT(pm2_5_ug_m3),
+       MIN(pm10_ug_m3), MAX(pm10_ug_m3), COALESCE(SUM(pm10_ug_m3), 0), COUNT(pm10_ug_m3),
+       MIN(wind_speed_ms), MAX(wind_speed_ms), COALESCE(SUM(wind_speed_ms), 0), COUNT(wind_speed_ms),
+       MIN(water_level_cm), MAX(water_level_cm), COALESCE(SUM(water_level_cm), 0), COUNT(water_level_cm),
+       MIN(salinity_ppt), MAX(salinity_ppt), COALESCE(SUM(salinity_ppt), 0), COUNT(salinity_ppt),
+       MIN(conductivity_us_cm), MAX(conductivity_us_cm), COALESCE(SUM(conductivity_us_cm), 0), COUNT(conductivity_us_cm),
+       MIN(tds_ppm), MAX(tds_ppm), COALESCE(SUM(tds_ppm), 0), COUNT(tds_ppm)
+FROM readings
+GROUP BY device_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:%i:00');
+
+INSERT INTO readings_1h (device_id, bucket_start, samples, temperature_c_min, temperature_c_max, temperature_c_sum, temperature_c_count, humidity_pct_min, humidity_pct_max, humidity_pct_sum, humidity_pct_count, pm2_5_ug_m3_min, pm2_5_ug_m3_max, pm2_5_ug_m3_sum, pm2_5_ug_m3_count, pm10_ug_m3_min, pm10_ug_m3_max, pm10_ug_m3_sum, pm10_ug_m3_count, wind_speed_ms_min, wind_speed_ms_max, wind_speed_ms_sum, wind_speed_ms_count, water_level_cm_min, water_level_cm_max, water_level_cm_sum, water_level_cm_count, salinity_ppt_min, salinity_ppt_max, salinity_ppt_sum, salinity_ppt_count, conductivity_us_cm_min, conductivity_us_cm_max, conductivity_us_cm_sum, conductivity_us_cm_count, tds_ppm_min, tds_ppm_max, tds_ppm_sum, tds_ppm_count)
+SELECT device_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00'), COUNT(*),
+       MIN(temperature_c), MAX(temperature_c), COALESCE(SUM(temperature_c), 0), COUNT(temperature_c),
+       MIN(humidity_pct), MAX(humidity_pct), COALESCE(SUM(humidity_pct), 0), COUNT(humidity_pct),
+       MIN(pm2_5_ug_m3), MAX(pm2_5_ug_m3), COALESCE(SUM(pm2_5_ug_m3), 0), COUNT(pm2_5_ug_m3),
+       MIN(pm10_ug_m3), MAX(pm10_ug_m3), COALESCE(SUM(pm10_ug_m3), 0), COUNT(pm10_ug_m3),
+       MIN(wind_speed_ms), MAX(wind_speed_ms), COALESCE(SUM(wind_speed_ms), 0), COUNT(wind_speed_ms),
+       MIN(water_level_cm), MAX(water_level_cm), COALESCE(SUM(water_level_cm), 0), COUNT(water_level_cm),
+       MIN(salinity_ppt), MAX(salinity_ppt), COALESCE(SUM(salinity_ppt), 0), COUNT(salinity_ppt),
+       MIN(conductivity_us_cm), MAX(conductivity_us_cm), COALESCE(SUM(conductivity_us_cm), 0), COUNT(conductivity_us_cm),
+       MIN(tds_ppm), MAX(tds_ppm), COALESCE(SUM(tds_ppm), 0), COUNT(tds_ppm)
+FROM readings
+GROUP BY device_id, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00');
+
+INSERT INTO readings_1d (device_id, bucket_start, samples, temperature_c_min, temperature_c_max, temperature_c_sum, temperature_c_count, humidity_pct_min, humidity_pct_max, humidity_pct_sum, humidity_pct_count, pm2_5_ug_m3_min, pm2_5_ug_m3_max, pm2_5_ug_m3_sum, pm2_5_ug_m3_count, pm10_ug_m3_min, pm10_ug_m3_max, pm10_ug_m3_sum, pm10_ug_m3_count, wind_speed_ms_min, wind_speed_ms_max, wind_speed_ms_sum, wind_speed_ms_count, water_level_cm_min, water_level_cm_max, water_level_cm_sum, water_level_cm_count, salinity_ppt_min, salinity_ppt_max, salinity_ppt_sum, salinity_ppt_count, conductivity_us_cm_min, conductivity_us_cm_max, conductivity_us_cm_sum, conductivity_us_cm_count, tds_ppm_min, tds_ppm_max, tds_ppm_sum, tds_ppm_count)
+SELECT device_id, DATE(created_at), COUNT(*),
+       MIN(temperature_c), MAX(temperature_c), COALESCE(SUM(temperature_c), 0), COUNT(temperature_c),
+       MIN(humidity_pct), MAX(humidity_pct), COALESCE(SUM(humidity_pct), 0), COUNT(humidity_pct),
+       MIN(pm2_5_ug_m3), MAX(pm2_5_ug_m3), COALESCE(SUM(pm2_5_ug_m3), 0), COUNT(pm2_5_ug_m3),
+       MIN(pm10_ug_m3), MAX(pm10_ug_m3), COALESCE(SUM(pm10_ug_m3), 0), COUNT(pm10_ug_m3),
+       MIN(wind_speed_ms), MAX(wind_speed_ms), COALESCE(SUM(wind_speed_ms), 0), COUNT(wind_speed_ms),
+       MIN(water_level_cm), MAX(water_level_cm), COALESCE(SUM(water_level_cm), 0), COUNT(water_level_cm),
+       MIN(salinity_ppt), MAX(salinity_ppt), COALESCE(SUM(salinity_ppt), 0), COUNT(salinity_ppt),
+       MIN(conductivity_us_cm), MAX(conductivity_us_cm), COALESCE(SUM(conductivity_us_cm), 0), COUNT(conductivity_us_cm),
+       MIN(tds_ppm), MAX(tds_ppm), COALESCE(SUM(tds_ppm), 0), COUNT(tds_ppm)
+FROM readings
+GROUP BY device_id, DATE(created_at);
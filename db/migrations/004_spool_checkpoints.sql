@@ -0,0 +1,12 @@
+-- Migration 004: replay position of the MQTT listener's on-disk spool (ingest_spool.py).
+--
+-- The spool replayer updates its row in the same transaction as the readings it replays, so
+-- after a crash the listener resumes from the last committed batch and never inserts one twice.
+-- spool_id is generated per spool directory (its spool.id file).
+
+CREATE TABLE spool_checkpoints (
+    spool_id VARCHAR(64) PRIMARY KEY,
+    segment BIGINT NOT NULL,
+    position BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP NOT NULL
+);
@@ -0,0 +1,22 @@
+-- Migration 005: alerts raised by the MQTT listener's rule engine (alert_engine.py).
+--
+-- One row per alert, inserted in batches from a background thread after the alert has been
+-- published on MQTT. triggered_at is the time of the reading that tripped the rule. There is
+-- no foreign key to devices: an alert can be stored before the writers commit its device row.
+
+CREATE TABLE alerts (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    device_id VARCHAR(255) NOT NULL,
+    rule VARCHAR(64) NOT NULL,
+    metric VARCHAR(64) NOT NULL,
+    kind VARCHAR(16) NOT NULL,          -- threshold | rate | zscore
+    severity VARCHAR(16) NOT NULL,      -- info | warning | critical
+    value DOUBLE NOT NULL,              -- the reading
+    score DOUBLE NULL,                  -- the reading, its rate per minute or its z-score
+    limit_value DOUBLE NULL,            -- the bound it crossed
+    message VARCHAR(255) NOT NULL,
+    triggered_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    INDEX idx_alerts_device_triggered (device_id, triggered_at),
+    INDEX idx_alerts_triggered (triggered_at)
+);
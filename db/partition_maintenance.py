@@ -0,0 +1,169 @@
+# File: partition_maintenance.py
+# Description: Keeps the range partitions of 'readings' (migration 002) in shape:
+#                * pre-creates partitions for the next AHEAD periods by splitting the
+#                  catch-all p_future partition (cheap while p_future is empty)
+#                * expires partitions older than RETENTION periods, either by dropping them
+#                  (instant, no row-by-row DELETE) or by archiving them: the partition is
+#                  swapped into its own table readings_archive_<partition> with EXCHANGE
+#                  PARTITION (a metadata operation) and can then be dumped or moved.
+#              Partitions are monthly (pYYYYMM) or daily (pYYYYMMDD). The granularity can be
+#              changed at any time; it only affects partitions created from then on.
+#              Run it daily (cron / Task Scheduler), and once right after migration 002.
+#
+# Usage: python db/partition_maintenance.py [--granularity month|day] [--ahead N]
+#                                           [--retention N] [--expire drop|archive|keep] [--dry-run]
+
+import argparse
+import datetime
+import sys
+
+import mysql.connector
+
+# --- Configuration ---
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'unified_sensor_db',
+    'user': 'root',
+    'password': 'saintgits'
+}
+DEFAULT_GRANULARITY = 'month'
+DEFAULT_AHEAD = 3           # periods to create beyond the current one
+DEFAULT_RETENTION = 24      # periods to keep, including the current one
+DEFAULT_EXPIRE = 'drop'     # drop | archive | keep
+CATCH_ALL = 'p_future'
+
+
+# --- Period arithmetic ---
+def period_start(day, granularity):
+    return day.replace(day=1) if granularity == 'month' else day
+
+
+def add_periods(start, count, granularity):
+    if granularity == 'day':
+        return start + datetime.timedelta(days=count)
+    month_index = start.year * 12 + start.month - 1 + count
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(start, granularity):
+    return start.strftime('p%Y%m' if granularity == 'month' else 'p%Y%m%d')
+
+
+# --- Inspecting the table ---
+def load_partitions(cursor):
+    """ [(name, upper bound as 'YYYY-MM-DD' or None for MAXVALUE, approx rows)] in order. """
+    cursor.execute("""
+        SELECT PARTITION_NAME,
+               IF(PARTITION_DESCRIPTION = 'MAXVALUE', NULL,
+                  DATE(FROM_UNIXTIME(PARTITION_DESCRIPTION))) AS upper_bound,
+               TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'readings'
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    partitions = cursor.fetchall()
+    if not partitions or partitions[0][0] is None:
+        raise SystemExit("❌ 'readings' is not partitioned. Run python db/migrate.py first.")
+    if partitions[-1][0] != CATCH_ALL:
+        raise SystemExit(f"❌ Expected the last partition to be '{CATCH_ALL}'.")
+    return partitions
+
+
+def first_new_period(cursor, partitions, granularity, today):
+    """ Start of the first period that has no partition yet. """
+    bounded = [p for p in partitions if p[1] is not None]
+    if bounded:
+        return bounded[-1][1]
+    # Only the catch-all exists (right after migration 002): start at the oldest data.
+    cursor.execute("SELECT DATE(MIN(created_at)) FROM readings")
+    oldest = cursor.fetchone()[0] or today
+    return period_start(oldest, granularity)
+
+
+# --- Planning ---
+def plan_new_partitions(start, granularity, ahead, today):
+    """ (name, upper bound) for every period from `start` up to the current period + ahead. """
+    last = add_periods(period_start(today, granularity), ahead, granularity)
+    new, current = [], start
+    while current <= last:
+        upper = add_periods(current, 1, granularity)
+        new.append((partition_name(current, granularity), upper))
+        current = upper
+    return new
+
+
+def expired_partitions(partitions, granularity, retention, today):
+    """ Partitions whose whole range lies before the retention cutoff. """
+    cutoff = add_periods(period_start(today, granularity), -(retention - 1), granularity)
+    return [name for name, upper, _ in partitions if upper is not None and upper <= cutoff]
+
+
+# --- Applying ---
+def split_catch_all(cursor, new_partitions):
+    definitions = ',\n        '.join(
+        f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{upper} 00:00:00'))"
+        for name, upper in new_partitions)
+    cursor.execute(f"""
+        ALTER TABLE readings REORGANIZE PARTITION {CATCH_ALL} INTO (
+        {definitions},
+        PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE)
+    """)
+
+
+def archive_partition(cursor, name):
+    archive = f"readings_archive_{name}"
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive} LIKE readings")
+    cursor.execute(f"ALTER TABLE {archive} REMOVE PARTITIONING")
+    cursor.execute(f"ALTER TABLE readings EXCHANGE PARTITION {name} WITH TABLE {archive}")
+    return archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming and expire old 'readings' partitions.")
+    parser.add_argument('--granularity', choices=['month', 'day'], default=DEFAULT_GRANULARITY)
+    parser.add_argument('--ahead', type=int, default=DEFAULT_AHEAD, help="periods to pre-create")
+    parser.add_argument('--retention', type=int, default=DEFAULT_RETENTION, help="periods to keep (0 = forever)")
+    parser.add_argument('--expire', choices=['drop', 'archive', 'keep'], default=DEFAULT_EXPIRE)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    today = datetime.date.today()
+    try:
+        partitions = load_partitions(cursor)
+
+        new_partitions = plan_new_partitions(
+            first_new_period(cursor, partitions, args.granularity, today), args.granularity, args.ahead, today)
+        if new_partitions:
+            print(f"🧱 Creating {len(new_partitions)} partition(s): {new_partitions[0][0]} … {new_partitions[-1][0]}")
+            if not args.dry_run:
+                split_catch_all(cursor, new_partitions)
+        else:
+            print("✅ Upcoming partitions already exist.")
+
+        expired = []
+        if args.retention > 0 and args.expire != 'keep':
+            expired = expired_partitions(load_partitions(cursor) if not args.dry_run else partitions,
+                                         args.granularity, args.retention, today)
+        for name in expired:
+            if args.dry_run:
+                print(f"🗑️ Would {args.expire} expired partition {name}")
+                continue
+            if args.expire == 'archive':
+                archive = archive_partition(cursor, name)
+                print(f"📦 Moved partition {name} into table {archive}")
+            cursor.execute(f"ALTER TABLE readings DROP PARTITION {name}")
+            print(f"🗑️ Dropped expired partition {name}")
+        if not expired:
+            print("✅ No partitions past the retention period.")
+    except mysql.connector.Error as e:
+        print(f"❌ Partition maintenance failed: {e}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
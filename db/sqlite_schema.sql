@@ -0,0 +1,131 @@
+-- SQLite schema of the embedded storage backend (STORAGE_BACKEND=sqlite, see storage.py).
+-- Mirrors db/db.sql table for table and index for index; storage.py runs it when a process
+-- first connects to a file, so every statement must stay idempotent (IF NOT EXISTS).
+-- Differences to the MySQL schema:
+--   * DECIMAL columns are REAL; values come back as floats
+--   * timestamps are local 'YYYY-MM-DD HH:MM:SS' text (declared TIMESTAMP/DATETIME so they are
+--     read back as datetime objects) and default to local time, as MySQL's CURRENT_TIMESTAMP does
+--   * readings is not partitioned; AUTOINCREMENT keeps ids increasing even after deletes,
+--     which latest_cache.py relies on
+--   * there is no schema_migrations table: db/migrate.py only applies to MySQL
+
+
+-- Table 1: Stores metadata about each unique sensor device.
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    device_type TEXT NULL,
+    friendly_name TEXT NULL,
+    latitude REAL NULL,
+    longitude REAL NULL,
+    first_seen TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    last_seen TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+
+-- Table 2: Stores the actual time-series data from all sensors.
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+
+    -- Air Quality Sensor Columns
+    temperature_c REAL NULL,
+    humidity_pct REAL NULL,
+    pm2_5_ug_m3 REAL NULL,
+    pm10_ug_m3 REAL NULL,
+    wind_speed_ms REAL NULL,
+
+    -- Water Quality Sensor Columns
+    water_level_cm REAL NULL,
+    salinity_ppt REAL NULL,
+    conductivity_us_cm REAL NULL,
+    tds_ppm REAL NULL,
+
+    created_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+-- Time-range indexes: latest-N per device, per-device and per-day ranges.
+CREATE INDEX IF NOT EXISTS idx_readings_device_created ON readings (device_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_readings_created ON readings (created_at);
+
+
+-- Tables 3-5: Per-device rollups, maintained by the ingestion service.
+-- 1-minute buckets
+CREATE TABLE IF NOT EXISTS readings_1m (
+    device_id TEXT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    temperature_c_min REAL NULL, temperature_c_max REAL NULL, temperature_c_sum REAL NOT NULL DEFAULT 0, temperature_c_count INTEGER NOT NULL DEFAULT 0,
+    humidity_pct_min REAL NULL, humidity_pct_max REAL NULL, humidity_pct_sum REAL NOT NULL DEFAULT 0, humidity_pct_count INTEGER NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min REAL NULL, pm2_5_ug_m3_max REAL NULL, pm2_5_ug_m3_sum REAL NOT NULL DEFAULT 0, pm2_5_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    pm10_ug_m3_min REAL NULL, pm10_ug_m3_max REAL NULL, pm10_ug_m3_sum REAL NOT NULL DEFAULT 0, pm10_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    wind_speed_ms_min REAL NULL, wind_speed_ms_max REAL NULL, wind_speed_ms_sum REAL NOT NULL DEFAULT 0, wind_speed_ms_count INTEGER NOT NULL DEFAULT 0,
+    water_level_cm_min REAL NULL, water_level_cm_max REAL NULL, water_level_cm_sum REAL NOT NULL DEFAULT 0, water_level_cm_count INTEGER NOT NULL DEFAULT 0,
+    salinity_ppt_min REAL NULL, salinity_ppt_max REAL NULL, salinity_ppt_sum REAL NOT NULL DEFAULT 0, salinity_ppt_count INTEGER NOT NULL DEFAULT 0,
+    conductivity_us_cm_min REAL NULL, conductivity_us_cm_max REAL NULL, conductivity_us_cm_sum REAL NOT NULL DEFAULT 0, conductivity_us_cm_count INTEGER NOT NULL DEFAULT 0,
+    tds_ppm_min REAL NULL, tds_ppm_max REAL NULL, tds_ppm_sum REAL NOT NULL DEFAULT 0, tds_ppm_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_readings_1m_bucket ON readings_1m (bucket_start);
+
+-- 1-hour buckets
+CREATE TABLE IF NOT EXISTS readings_1h (
+    device_id TEXT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    temperature_c_min REAL NULL, temperature_c_max REAL NULL, temperature_c_sum REAL NOT NULL DEFAULT 0, temperature_c_count INTEGER NOT NULL DEFAULT 0,
+    humidity_pct_min REAL NULL, humidity_pct_max REAL NULL, humidity_pct_sum REAL NOT NULL DEFAULT 0, humidity_pct_count INTEGER NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min REAL NULL, pm2_5_ug_m3_max REAL NULL, pm2_5_ug_m3_sum REAL NOT NULL DEFAULT 0, pm2_5_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    pm10_ug_m3_min REAL NULL, pm10_ug_m3_max REAL NULL, pm10_ug_m3_sum REAL NOT NULL DEFAULT 0, pm10_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    wind_speed_ms_min REAL NULL, wind_speed_ms_max REAL NULL, wind_speed_ms_sum REAL NOT NULL DEFAULT 0, wind_speed_ms_count INTEGER NOT NULL DEFAULT 0,
+    water_level_cm_min REAL NULL, water_level_cm_max REAL NULL, water_level_cm_sum REAL NOT NULL DEFAULT 0, water_level_cm_count INTEGER NOT NULL DEFAULT 0,
+    salinity_ppt_min REAL NULL, salinity_ppt_max REAL NULL, salinity_ppt_sum REAL NOT NULL DEFAULT 0, salinity_ppt_count INTEGER NOT NULL DEFAULT 0,
+    conductivity_us_cm_min REAL NULL, conductivity_us_cm_max REAL NULL, conductivity_us_cm_sum REAL NOT NULL DEFAULT 0, conductivity_us_cm_count INTEGER NOT NULL DEFAULT 0,
+    tds_ppm_min REAL NULL, tds_ppm_max REAL NULL, tds_ppm_sum REAL NOT NULL DEFAULT 0, tds_ppm_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_readings_1h_bucket ON readings_1h (bucket_start);
+
+-- 1-day buckets
+CREATE TABLE IF NOT EXISTS readings_1d (
+    device_id TEXT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    temperature_c_min REAL NULL, temperature_c_max REAL NULL, temperature_c_sum REAL NOT NULL DEFAULT 0, temperature_c_count INTEGER NOT NULL DEFAULT 0,
+    humidity_pct_min REAL NULL, humidity_pct_max REAL NULL, humidity_pct_sum REAL NOT NULL DEFAULT 0, humidity_pct_count INTEGER NOT NULL DEFAULT 0,
+    pm2_5_ug_m3_min REAL NULL, pm2_5_ug_m3_max REAL NULL, pm2_5_ug_m3_sum REAL NOT NULL DEFAULT 0, pm2_5_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    pm10_ug_m3_min REAL NULL, pm10_ug_m3_max REAL NULL, pm10_ug_m3_sum REAL NOT NULL DEFAULT 0, pm10_ug_m3_count INTEGER NOT NULL DEFAULT 0,
+    wind_speed_ms_min REAL NULL, wind_speed_ms_max REAL NULL, wind_speed_ms_sum REAL NOT NULL DEFAULT 0, wind_speed_ms_count INTEGER NOT NULL DEFAULT 0,
+    water_level_cm_min REAL NULL, water_level_cm_max REAL NULL, water_level_cm_sum REAL NOT NULL DEFAULT 0, water_level_cm_count INTEGER NOT NULL DEFAULT 0,
+    salinity_ppt_min REAL NULL, salinity_ppt_max REAL NULL, salinity_ppt_sum REAL NOT NULL DEFAULT 0, salinity_ppt_count INTEGER NOT NULL DEFAULT 0,
+    conductivity_us_cm_min REAL NULL, conductivity_us_cm_max REAL NULL, conductivity_us_cm_sum REAL NOT NULL DEFAULT 0, conductivity_us_cm_count INTEGER NOT NULL DEFAULT 0,
+    tds_ppm_min REAL NULL, tds_ppm_max REAL NULL, tds_ppm_sum REAL NOT NULL DEFAULT 0, tds_ppm_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, bucket_start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_readings_1d_bucket ON readings_1d (bucket_start);
+
+
+-- Table 6: Replay position of the MQTT listener's on-disk spool.
+CREATE TABLE IF NOT EXISTS spool_checkpoints (
+    spool_id TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+
+
+-- Table 7: Alerts raised by the MQTT listener's rule engine (alert_engine.py).
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    value REAL NOT NULL,
+    score REAL NULL,
+    limit_value REAL NULL,
+    message TEXT NOT NULL,
+    triggered_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_device_triggered ON alerts (device_id, triggered_at);
+CREATE INDEX IF NOT EXISTS idx_alerts_triggered ON alerts (triggered_at);
@@ -0,0 +1,241 @@
+# File: db_pool.py
+# Description: Size-bounded database connection pool shared by app.py and data hook api.py
+#              (MySQL or SQLite connections, see storage.py).
+#              Connections are reused across requests so a request no longer pays for a
+#              TCP connect + auth handshake. On checkout an idle connection is pinged if it
+#              has been idle for a while and recycled once it exceeds its maximum lifetime.
+#              When every connection is busy, acquire() waits up to `timeout` seconds and
+#              then raises PoolTimeout.
+
+import collections
+import contextlib
+import threading
+import time
+
+import metrics
+import storage
+from storage import Error
+
+ACQUIRE_SECONDS = metrics.REGISTRY.histogram(
+    'db_pool_acquire_seconds', "Time to check a connection out of the pool, including waiting and connecting.")
+
+
+class PoolTimeout(Error):
+    """ Raised when no connection could be checked out within the pool timeout. """
+
+
+_CREATE = object()   # handed to a waiter in place of a connection: "open a new one"
+
+
+class _Entry:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled connection. close() hands it back to the pool instead of
+    disconnecting, so existing `conn.close()` call sites work unchanged.
+    """
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise Error(msg="Connection has already been returned to the pool")
+        return getattr(self._entry.conn, name)
+
+    def is_connected(self):
+        return self._entry is not None and self._entry.conn.is_connected()
+
+    def close(self):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool.release(entry)
+
+    def discard(self):
+        """
+        Close the underlying connection instead of returning it, e.g. when a streamed
+        result was abandoned half-way and draining the rest would cost more than reconnecting.
+        """
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool._discard(entry)
+
+
+class ConnectionPool:
+    """ Thread-safe pool of at most `size` connections opened with storage.connect(config). """
+
+    def __init__(self, config, size=5, timeout=5.0, max_lifetime=1800, ping_after=30):
+        # Pooled connections run in autocommit mode: a long-lived connection left inside a
+        # REPEATABLE READ transaction would keep serving the same snapshot to every request.
+        self.config = dict(config, autocommit=True)
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._idle = collections.deque()
+        self._waiters = collections.deque()     # one [entry] slot per thread waiting in acquire()
+        self._open = 0                  # connections that exist (idle + checked out + being opened)
+        self._cond = threading.Condition()
+        self.counters = {
+            'acquired': 0, 'created': 0, 'recycled': 0, 'health_failures': 0,
+            'timeouts': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0,
+        }
+
+    # --- Checkout / return ---
+    def acquire(self):
+        """ Check out a healthy connection, waiting up to `timeout` seconds for one. """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            with self._cond:
+                if self._idle and not self._waiters:
+                    entry = self._idle.pop()    # LIFO keeps the hottest connections in use
+                elif self._open < self.size and not self._waiters:
+                    self._open += 1
+                    entry = _CREATE
+                else:
+                    # Queue up: release() hands connections to waiters in FIFO order, so a
+                    # thread that returns and immediately re-acquires cannot starve the others.
+                    slot = [None]
+                    self._waiters.append(slot)
+                    while slot[0] is None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._waiters.remove(slot)
+                            self.counters['timeouts'] += 1
+                            raise PoolTimeout(msg=f"No free database connection after {self.timeout}s "
+                                                  f"(pool size {self.size})")
+                        self._cond.wait(remaining)
+                    entry = slot[0]
+
+            if entry is _CREATE:
+                entry = self._create()
+            elif not self._healthy(entry):
+                self._discard(entry)
+                continue
+
+            waited = (time.monotonic() - started) * 1000
+            ACQUIRE_SECONDS.observe(waited / 1000)
+            metrics.record_phase('acquire', waited / 1000)
+            with self._cond:
+                self.counters['acquired'] += 1
+                self.counters['wait_ms_total'] += waited
+                self.counters['wait_ms_max'] = max(self.counters['wait_ms_max'], waited)
+            return PooledConnection(self, entry)
+
+    def release(self, entry):
+        """ Return a connection to the pool, dropping it if it is broken or too old. """
+        conn = entry.conn
+        # Only local flags are checked here; is_connected() would cost a round trip.
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            self._discard(entry)
+            return
+        if self._expired(entry):
+            with self._cond:
+                self.counters['recycled'] += 1
+            self._discard(entry)
+            return
+        entry.last_used = time.monotonic()
+        self._hand_over(entry)
+
+    def _hand_over(self, entry):
+        """ Give a connection (or the right to open one) to the oldest waiter, else park it. """
+        with self._cond:
+            if self._waiters:
+                self._waiters.popleft()[0] = entry
+                self._cond.notify_all()
+            elif entry is _CREATE:
+                self._open -= 1
+            else:
+                self._idle.append(entry)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ `with pool.connection() as conn:` checks a connection out and always returns it. """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # --- Health and lifetime ---
+    def _create(self):
+        try:
+            entry = _Entry(storage.connect(self.config))
+        except Exception:
+            self._hand_over(_CREATE)
+            raise
+        with self._cond:
+            self.counters['created'] += 1
+        return entry
+
+    def _expired(self, entry):
+        return self.max_lifetime and time.monotonic() - entry.created_at > self.max_lifetime
+
+    def _healthy(self, entry):
+        if self._expired(entry):
+            with self._cond:
+                self.counters['recycled'] += 1
+            return False
+        if time.monotonic() - entry.last_used < self.ping_after:
+            return True
+        try:
+            entry.conn.ping(reconnect=False)
+            return True
+        except Error:
+            with self._cond:
+                self.counters['health_failures'] += 1
+            return False
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Error:
+            pass
+        # The slot is free again: let the next waiter open a replacement connection.
+        self._hand_over(_CREATE)
+
+    # --- Introspection ---
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            stats = dict(self.counters, size=self.size, open=self._open, idle=idle, in_use=self._open - idle)
+        stats['wait_ms_avg'] = round(stats['wait_ms_total'] / stats['acquired'], 3) if stats['acquired'] else 0.0
+        stats['wait_ms_total'] = round(stats['wait_ms_total'], 3)
+        stats['wait_ms_max'] = round(stats['wait_ms_max'], 3)
+        return stats
+
+    def metric_families(self):
+        """ Pool gauges and counters for metrics.Registry.register_collector(). """
+        stats = self.stats()
+        return [
+            metrics.family('db_pool_size', 'gauge', "Maximum number of pooled connections.", stats['size']),
+            metrics.family('db_pool_connections', 'gauge', "Open pooled connections by state.",
+                           samples={(('state', 'idle'),): stats['idle'], (('state', 'in_use'),): stats['in_use']}),
+            metrics.family('db_pool_acquired_total', 'counter', "Connections checked out.", stats['acquired']),
+            metrics.family('db_pool_created_total', 'counter', "Connections opened.", stats['created']),
+            metrics.family('db_pool_recycled_total', 'counter', "Connections closed for exceeding their lifetime.",
+                           stats['recycled']),
+            metrics.family('db_pool_timeouts_total', 'counter', "Checkouts that gave up waiting for a connection.",
+                           stats['timeouts']),
+        ]
+
+    def close_all(self):
+        """ Close idle connections (checked-out ones are closed when returned). """
+        with self._cond:
+            idle, self._idle = list(self._idle), collections.deque()
+        for entry in idle:
+            self._discard(entry)
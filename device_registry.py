@@ -0,0 +1,88 @@
+# File: device_registry.py
+# Description: In-memory copy of the 'devices' table used by the ingestion writers, so
+#              that a reading only causes a write to 'devices' when something changed:
+#                * unknown device or moved latitude/longitude -> INSERT ... ON DUPLICATE KEY UPDATE
+#                * last_seen older than the staleness window    -> batched UPDATE of last_seen
+#                * otherwise                                     -> nothing
+#              The registry is only updated after the writing transaction has committed,
+#              so a failed batch never hides a device row that readings depend on (FK).
+
+import threading
+import time
+
+SQL_LOAD_DEVICES = """
+    SELECT device_id, latitude, longitude,
+           TIMESTAMPDIFF(SECOND, last_seen, NOW()) AS age_seconds
+    FROM devices;
+"""
+
+
+def _coord(value):
+    """
+    Normalise a coordinate the way DECIMAL(.., 6) stores it so payload floats compare equal.
+    Payloads are validated when parsed (payload_codec.coordinate()); anything else that is
+    not a number, e.g. in a record spooled by an older version, compares as None.
+    """
+    try:
+        return None if value is None else round(float(value), 6)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class DeviceRegistry:
+    """ Thread-safe cache of device location and last_seen write time. """
+
+    def __init__(self, stale_after_seconds=60):
+        self.stale_after = max(0, int(stale_after_seconds))
+        self._lock = threading.Lock()
+        self._devices = {}      # device_id -> [latitude, longitude, monotonic time of last write]
+        self.counters = {'upserts': 0, 'touches': 0, 'skipped': 0}
+
+    def load(self, conn):
+        """ Seed the registry from the devices table. Returns the number of devices loaded. """
+        cursor = conn.cursor()
+        cursor.execute(SQL_LOAD_DEVICES)
+        now = time.monotonic()
+        with self._lock:
+            for device_id, latitude, longitude, age_seconds in cursor.fetchall():
+                self._devices[device_id] = [_coord(latitude), _coord(longitude), now - (age_seconds or 0)]
+        cursor.close()
+        return len(self._devices)
+
+    def plan(self, devices):
+        """
+        Split {device_id: (latitude, longitude)} into the rows that need an upsert and the
+        device ids whose last_seen only needs refreshing. Both lists are sorted by device id.
+        """
+        upserts, touches = [], []
+        now = time.monotonic()
+        with self._lock:
+            # Keyed on str(): a stray non-string id must reach the SQL (and its salvage), not break the sort.
+            for device_id, (latitude, longitude) in sorted(devices.items(), key=lambda item: str(item[0])):
+                known = self._devices.get(device_id)
+                if known is None or known[0] != _coord(latitude) or known[1] != _coord(longitude):
+                    upserts.append((device_id, latitude, longitude))
+                elif now - known[2] >= self.stale_after:
+                    touches.append(device_id)
+                else:
+                    self.counters['skipped'] += 1
+        return upserts, touches
+
+    def record(self, upserts, touches):
+        """ Remember what a committed transaction wrote. """
+        now = time.monotonic()
+        with self._lock:
+            for device_id, latitude, longitude in upserts:
+                self._devices[device_id] = [_coord(latitude), _coord(longitude), now]
+            for device_id in touches:
+                if device_id in self._devices:
+                    self._devices[device_id][2] = now
+            self.counters['upserts'] += len(upserts)
+            self.counters['touches'] += len(touches)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,185 @@
+# File: exporter.py
+# Description: Bulk export of raw readings for the /export endpoint of data hook api.py.
+#              Rows come from an unbuffered cursor in raw mode (the bytes MySQL sends, no
+#              Decimal/datetime objects are built) and are encoded one fetch batch at a time
+#              as NDJSON, gzip'd CSV or Parquet. Memory is bounded by one batch (one row group
+#              for Parquet), however many rows the export has.
+#              Parquet needs pyarrow (`pip install pyarrow`); without it only NDJSON and CSV
+#              are offered.
+
+import json
+import re
+import time
+import zlib
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from latest_cache import METRIC_COLUMNS
+
+EXPORT_COLUMNS = ('id', 'device_id', 'created_at') + METRIC_COLUMNS
+
+# format -> (content type, file extension)
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+CSV_GZIP_LEVEL = 6
+PARQUET_ROW_GROUP_ROWS = 100000
+
+_CSV_NEEDS_QUOTING = re.compile(rb'[,"\r\n]')
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def export_query(device_ids, start_date, end_date):
+    """ SQL and params for raw readings of `device_ids` (all devices if empty) in [start, end] days. """
+    where = ["created_at >= %s", "created_at < %s + INTERVAL 1 DAY"]
+    params = [start_date, end_date]
+    if device_ids:
+        where.append(f"device_id IN ({', '.join(['%s'] * len(device_ids))})")
+        params += list(device_ids)
+    sql = (f"SELECT {', '.join(EXPORT_COLUMNS)} FROM readings "
+           f"WHERE {' AND '.join(where)} ORDER BY created_at, id")
+    return sql, tuple(params)
+
+
+# --- Encoders: iterables of raw row batches -> iterables of bytes ---
+def _ndjson(batches):
+    """ One object per line; NULL metrics are left out, as in the live stream events. """
+    metric_keys = [f',"{m}":'.encode() for m in METRIC_COLUMNS]
+    for rows in batches:
+        lines = []
+        for row_id, device_id, created_at, *metrics in rows:
+            fields = [b'{"id":', row_id, b',"device_id":', json.dumps(device_id.decode()).encode(),
+                      b',"created_at":"', created_at, b'"']
+            for key, value in zip(metric_keys, metrics):
+                if value is not None:
+                    fields += (key, value)
+            fields.append(b'}\n')
+            lines.append(b''.join(fields))
+        yield b''.join(lines)
+
+
+def _csv_gzip(batches):
+    compressor = zlib.compressobj(CSV_GZIP_LEVEL, zlib.DEFLATED, 31)     # wbits 31 = gzip container
+    yield compressor.compress(','.join(EXPORT_COLUMNS).encode() + b'\r\n')
+    for rows in batches:
+        lines = []
+        for row in rows:
+            device_id = row[1]
+            if _CSV_NEEDS_QUOTING.search(device_id):
+                device_id = b'"' + bytes(device_id).replace(b'"', b'""') + b'"'
+            lines.append(b','.join([row[0], device_id] + [b'' if v is None else v for v in row[2:]]))
+        lines.append(b'')
+        chunk = compressor.compress(b'\r\n'.join(lines))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """ Write-only file object for ParquetWriter; what was written is taken out after each row group. """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def _parquet_schema():
+    return pyarrow.schema([('id', pyarrow.int64()), ('device_id', pyarrow.string()),
+                           ('created_at', pyarrow.timestamp('s'))]
+                          + [(m, pyarrow.float64()) for m in METRIC_COLUMNS])
+
+
+def _parquet(batches, row_group_rows=PARQUET_ROW_GROUP_ROWS):
+    """ Columnar batches are converted from the raw text by Arrow casts, not row by row in Python. """
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    pending, pending_rows = [], 0
+
+    def write_row_group():
+        writer.write_table(pyarrow.Table.from_batches(pending, schema=schema), row_group_size=row_group_rows)
+        pending.clear()
+        return sink.take()
+
+    for rows in batches:
+        arrays = [pyarrow.array(column, type=pyarrow.binary()).cast(pyarrow.string()).cast(field.type)
+                  for column, field in zip(zip(*rows), schema)]
+        pending.append(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        pending_rows += len(rows)
+        if pending_rows >= row_group_rows:
+            pending_rows = 0
+            yield write_row_group()
+    if pending:
+        yield write_row_group()
+    writer.close()
+    yield sink.take()
+
+
+_ENCODERS = {'ndjson': _ndjson, 'csv': _csv_gzip, 'parquet': _parquet}
+
+
+class ExportStats:
+    """ Rows and bytes written by one export, for the throughput log line. """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.seconds = 0.0
+
+    def mb_per_second(self):
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (f"{self.rows} rows, {self.bytes / 1e6:.1f} MB in {self.seconds:.1f}s "
+                f"({self.mb_per_second():.1f} MB/s, {self.rows / self.seconds if self.seconds else 0:.0f} rows/s)")
+
+
+def encode(fmt, batches, on_done=None):
+    """
+    Generator of the export file's bytes in format `fmt` for an iterable of raw row batches.
+    `on_done(stats)` is called once the whole file has been produced.
+    """
+    stats = ExportStats()
+
+    def counted(batches):
+        for rows in batches:
+            stats.rows += len(rows)
+            yield rows
+
+    for chunk in _ENCODERS[fmt](counted(batches)):
+        if chunk:
+            stats.bytes += len(chunk)
+            yield chunk
+    stats.seconds = time.monotonic() - stats.started
+    if on_done:
+        on_done(stats)
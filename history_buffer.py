@@ -0,0 +1,192 @@
+# File: history_buffer.py
+# Description: Recent-history store behind the dashboard chart endpoints (/get_history and
+#              /get_water_history). Every tracked device gets a fixed-size ring of typed
+#              arrays: timestamps and row ids plus one float column per metric, with NaN
+#              standing in for NULL. The rings are loaded from MySQL on first use and then
+#              fed by the LatestValueCache with every batch of new rows, so a chart poll
+#              reads a few dozen array slots instead of querying and sorting 'readings'.
+
+import array
+import datetime
+import sys
+import threading
+
+from latest_cache import METRIC_COLUMNS
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NAN = float('nan')
+
+SQL_DEVICE_TAIL = f"""
+    SELECT id, device_id, {', '.join(METRIC_COLUMNS)}, created_at
+    FROM readings
+    WHERE device_id = %s ORDER BY created_at DESC, id DESC LIMIT %s;
+"""
+
+
+def to_seconds(created_at):
+    """ Naive created_at as float seconds since EPOCH (and back with from_seconds). """
+    return (created_at - EPOCH).total_seconds()
+
+
+def from_seconds(seconds):
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class DeviceRing:
+    """ The newest `capacity` readings of one device; the oldest slot is overwritten first. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array.array('d', [NAN]) * capacity
+        self.ids = array.array('q', [0]) * capacity
+        self.columns = {metric: array.array('d', [NAN]) * capacity for metric in METRIC_COLUMNS}
+        self.head = 0           # slot written next
+        self.size = 0
+        self.appended = 0       # rows ever stored; with newest_id, identifies the ring's contents
+        self.newest_id = 0
+        self.newest_seconds = NAN
+        self._unordered = 0     # appends until an out-of-order row has left the window
+
+    def append(self, row):
+        """ Store one reading row (dict). Returns False for duplicates and rows older than a full window. """
+        row_id = row['id']
+        seconds = to_seconds(row['created_at'])
+        if row_id in self.ids:
+            return False
+        if self.size == self.capacity and seconds < self.timestamps[self.head]:
+            return False        # a late commit older than everything kept
+        last = self.timestamps[self.head - 1] if self.size else None
+        if last is not None and seconds < last:
+            self._unordered = self.capacity
+        elif self._unordered:
+            self._unordered -= 1
+
+        slot = self.head
+        self.ids[slot] = row_id
+        self.timestamps[slot] = seconds
+        for metric, column in self.columns.items():
+            value = row.get(metric)
+            column[slot] = NAN if value is None else float(value)
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.appended += 1
+        if row_id > self.newest_id:
+            self.newest_id, self.newest_seconds = row_id, seconds
+        return True
+
+    def newest(self, count):
+        """ Slot indexes of the newest `count` readings, oldest first. """
+        count = min(count, self.size)
+        if not self._unordered:
+            start = self.head - count
+            return [(start + k) % self.capacity for k in range(count)]
+        # Writers commit concurrently, so a row can arrive after a newer one; sort by time then.
+        slots = sorted(((self.head - self.size + k) % self.capacity for k in range(self.size)),
+                       key=lambda slot: (self.timestamps[slot], self.ids[slot]))
+        return slots[len(slots) - count:]
+
+    def memory_bytes(self):
+        return sum(sys.getsizeof(a) for a in (self.timestamps, self.ids, *self.columns.values()))
+
+
+class RecentHistory:
+    """ DeviceRings for a fixed set of devices, kept current by a LatestValueCache. """
+
+    def __init__(self, pool, latest_cache, devices, capacity=120):
+        self.pool = pool
+        self.cache = latest_cache
+        self.capacity = max(1, int(capacity))
+        self.rings = {device_id: DeviceRing(self.capacity) for device_id in devices}
+        self.version = 0        # bumped whenever a ring changes; lets callers reuse rendered responses
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.counters = {'rows_appended': 0, 'reads': 0}
+        latest_cache.add_listener(self.extend)
+
+    # --- Feeding the rings ---
+    def extend(self, rows):
+        """ LatestValueCache listener: append new rows of tracked devices. """
+        with self._lock:
+            appended = 0
+            for row in rows:
+                ring = self.rings.get(row['device_id'])
+                if ring is not None and ring.append(row):
+                    appended += 1
+            if appended:
+                self.counters['rows_appended'] += appended
+                self.version += 1
+
+    def load(self):
+        """ Fill every ring with the device's newest `capacity` rows. """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            for device_id in self.rings:
+                cursor.execute(SQL_DEVICE_TAIL, (device_id, self.capacity))
+                self.extend(list(reversed(cursor.fetchall())))
+            cursor.close()
+        self._loaded = True
+
+    def sync(self):
+        # The cache warms up first, so every row after the loaded tail reaches extend().
+        self.cache.sync()
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load()
+
+    # --- Reading ---
+    def history(self, device_ids, columns, limit):
+        """
+        The newest `limit` readings across `device_ids`, oldest first, as dicts.
+        `columns` are (output key, metric) pairs; 'device_id' and 'created_at' are always included.
+        """
+        self.sync()
+        limit = min(limit, self.capacity)
+        picked = []
+        with self._lock:
+            self.counters['reads'] += 1
+            for device_id in device_ids:
+                ring = self.rings.get(device_id)
+                if ring is None:
+                    continue
+                for slot in ring.newest(limit):
+                    picked.append((ring.timestamps[slot], ring.ids[slot], device_id,
+                                   [ring.columns[metric][slot] for _, metric in columns]))
+        if len(device_ids) > 1:
+            picked.sort()
+            picked = picked[len(picked) - limit:] if len(picked) > limit else picked
+
+        rows = []
+        for seconds, _, device_id, values in picked:
+            row = {'device_id': device_id}
+            for (key, _), value in zip(columns, values):
+                row[key] = None if value != value else round(value, 2)   # NaN -> NULL
+            row['created_at'] = from_seconds(seconds)
+            rows.append(row)
+        return rows
+
+    def fingerprint(self, device_ids):
+        """
+        (newest readings.id, rows appended, newest created_at or None) over the rings of
+        `device_ids`. It changes whenever their history does, late out-of-order rows included,
+        so it can key an ETag. Call sync() first to see the newest rows.
+        """
+        newest_id, appended, newest_seconds = 0, 0, None
+        with self._lock:
+            for device_id in device_ids:
+                ring = self.rings.get(device_id)
+                if ring is None:
+                    continue
+                appended += ring.appended
+                if ring.newest_id > newest_id:
+                    newest_id, newest_seconds = ring.newest_id, ring.newest_seconds
+        return newest_id, appended, None if newest_seconds is None else from_seconds(newest_seconds)
+
+    def stats(self):
+        with self._lock:
+            per_device = {device_id: {'rows': ring.size, 'bytes': ring.memory_bytes()}
+                          for device_id, ring in self.rings.items()}
+            counters = dict(self.counters)
+        return dict(counters, capacity=self.capacity, devices=per_device,
+                    bytes_total=sum(d['bytes'] for d in per_device.values()))
@@ -0,0 +1,255 @@
+# File: http_cache.py
+# Description: HTTP caching helpers for the Flask servers.
+#              - conditional(): weak ETag + Last-Modified on a response, answered with an empty
+#                304 when the client already has that version (If-None-Match/If-Modified-Since)
+#              - ResponseCache: bounded LRU of rendered bodies whose entries also expire after a
+#                TTL; app.py keeps /search results of closed days in one
+#              - SingleFlight: concurrent identical requests share one in-flight render (and its
+#                result for a short window), e.g. a wall of dashboards refreshing at once
+#              - enable_compression(): brotli or gzip for JSON responses above COMPRESS_MIN_BYTES.
+#                Brotli needs the `brotli` package (`pip install brotli`); without it gzip is used.
+#                Compressed bodies are memoized per (path, ETag, encoding), so a cached response is
+#                compressed once, not on every request.
+
+import collections
+import gzip
+import hashlib
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import metrics
+
+COMPRESS_MIN_BYTES = 1024       # smaller bodies fit in a packet or two; not worth the CPU
+COMPRESS_MIMETYPES = ('application/json',)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5              # ~gzip -6 speed with smaller output; 11 is far too slow per request
+
+
+def content_etag(body):
+    """ ETag value derived from the bytes of a body, for responses without a cheaper version key. """
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def conditional(response, etag, last_modified=None, max_age=0):
+    """
+    Tag `response` and turn it into a 304 if the request's validators match. Weak ETags
+    stay valid when the body is compressed. max_age=0 makes browsers revalidate every time
+    (a cheap 304 while nothing changed); a positive max_age lets them reuse their copy.
+    `last_modified` is a naive local datetime like created_at.
+    """
+    from flask import request
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified.astimezone()
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" if max_age else 'no-cache'
+    return response.make_conditional(request)
+
+
+def not_modified(etag, last_modified=None, max_age=0):
+    """ The 304 for the current request if its validators already match, else None (render the body then). """
+    from flask import Response
+    response = conditional(Response(), etag, last_modified, max_age)
+    return response if response.status_code == 304 else None
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU of at most `maxsize` entries and `max_bytes` of values; every entry also
+    expires `ttl` seconds after it was stored.
+    """
+
+    def __init__(self, maxsize=128, ttl=3600, max_bytes=None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()   # key -> (expires_at, size, value), oldest use first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, key):
+        """ The cached value, or None if absent or expired. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.counters['expired'] += 1
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[2]
+
+    def put(self, key, value, size=0):
+        """ Store `value` (`size` bytes, counted against max_bytes), evicting least recently used entries. """
+        if self.max_bytes is not None and size > self.max_bytes:
+            return      # would evict everything else and still not fit
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.maxsize or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes,
+                        maxsize=self.maxsize, max_bytes=self.max_bytes, ttl=self.ttl)
+
+    def metric_families(self, name):
+        """ Hit/miss/eviction counters and size gauges labelled cache=<name>. """
+        stats = self.stats()
+        label = (('cache', name),)
+        return [
+            metrics.family('response_cache_hits_total', 'counter', "Responses served from a response cache.",
+                           samples={label: stats['hits']}),
+            metrics.family('response_cache_misses_total', 'counter', "Response cache lookups that had to render.",
+                           samples={label: stats['misses']}),
+            metrics.family('response_cache_evictions_total', 'counter',
+                           "Entries evicted to stay within the entry or byte limit.", samples={label: stats['evictions']}),
+            metrics.family('response_cache_bytes', 'gauge', "Bytes held by a response cache.",
+                           samples={label: stats['bytes']}),
+        ]
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'expires')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.error = None
+        self.expires = None         # monotonic time the result stops being reused; None while running
+
+
+class SingleFlight:
+    """
+    Request coalescing: do(key, function) runs `function` once for all concurrent callers with
+    the same key. The first caller runs it; callers arriving meanwhile wait and get the same
+    result (or exception), and later callers reuse the result until `window` seconds after it
+    completed. Failures are not reused. window=0 only shares in-flight calls; None disables
+    coalescing (every call runs).
+    """
+
+    def __init__(self, window=0.5):
+        self.window = window
+        self._flights = {}          # key -> _Flight, the running or most recent call
+        self._lock = threading.Lock()
+        self.counters = {'executed': 0, 'joined': 0, 'reused': 0}
+
+    def do(self, key, function):
+        if self.window is None:
+            with self._lock:
+                self.counters['executed'] += 1
+            return function()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and (flight.expires is None or flight.expires > time.monotonic()):
+                self.counters['joined' if flight.expires is None else 'reused'] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.counters['executed'] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    flight.expires = time.monotonic() + self.window
+                elif self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, window=self.window, keys=len(self._flights))
+
+    def metric_families(self, name):
+        """ Calls by outcome (executed / joined an in-flight call / reused a recent result), labelled flight=<name>. """
+        stats = self.stats()
+        return [metrics.family('coalesced_calls_total', 'counter',
+                               "Coalesced calls by outcome: executed, joined an in-flight call, reused a recent result.",
+                               samples={(('flight', name), ('outcome', outcome)): stats[outcome]
+                                        for outcome in ('executed', 'joined', 'reused')})]
+
+
+# --- Compression ---
+def choose_encoding(accept_encodings):
+    """ 'br', 'gzip' or None for a request's Accept-Encoding (werkzeug MIMEAccept-like object). """
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def enable_compression(app, min_bytes=COMPRESS_MIN_BYTES, memo=None):
+    """
+    Compress JSON responses of at least `min_bytes` for clients that accept it. Streamed
+    responses (stream=1, /export, /stream) and 304s are left alone. `memo` is a
+    ResponseCache for compressed bodies of tagged responses; returned for /cache_stats.
+    """
+    from flask import request
+
+    memo = memo or ResponseCache(maxsize=256, ttl=3600, max_bytes=32 << 20)
+
+    @app.after_request
+    def _compress(response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+            return response
+        body = response.get_data()
+        if len(body) < min_bytes:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        etag, _ = response.get_etag()
+        key = (request.path, etag, encoding)
+        data = memo.get(key) if etag else None
+        if data is None:
+            with metrics.phase('compress'):
+                data = compress(body, encoding)
+            if etag:
+                memo.put(key, data, size=len(data))
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return memo
@@ -0,0 +1,302 @@
+# File: ingest_batcher.py
+# Description: Buffers parsed sensor readings and writes them to the database in batches.
+#              A batch is flushed when it holds BATCH_MAX_ROWS messages or when the
+#              oldest buffered message is BATCH_MAX_DELAY_MS old, whichever comes first.
+#              Each flush is one transaction: one multi-row device upsert plus one
+#              multi-row INSERT per distinct column set. With a DeviceRegistry attached,
+#              only new/moved devices are upserted and stale last_seen values are
+#              refreshed with a single UPDATE. With rollups enabled the same transaction
+#              also merges the batch into the 1m/1h/1d rollup tables (see rollups.py).
+#              If the database refuses part of the data (a value out of range, a wrong type),
+#              the flush is redone in salvage mode: still one transaction, but each INSERT runs
+#              under a savepoint and is split in halves until only the refused rows are left
+#              out, so one bad reading does not cost the rest of the batch.
+
+import datetime
+import threading
+import time
+
+import metrics
+from rollups import rollup_upserts
+from storage import Error, errorcode
+
+INSERT_SECONDS = metrics.REGISTRY.histogram(
+    'ingest_batch_insert_seconds', "Time to write and commit one batch transaction (successful batches).")
+BATCH_ROWS = metrics.REGISTRY.histogram(
+    'ingest_batch_rows', "Readings per committed batch.", buckets=metrics.SIZE_BUCKETS)
+BATCH_FAILURES = metrics.REGISTRY.counter(
+    'ingest_batch_failures_total', "Batches that could not be written (readings dropped or spooled).")
+
+# Errors after which the connection is unusable and must be re-opened.
+CONNECTION_LOST_ERRORS = (
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_CONNECTION_ERROR,
+)
+# Errors caused by concurrent writers; the whole transaction can simply be retried.
+TRANSIENT_ERRORS = (
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+)
+ER_NO_REFERENCED_ROW_2 = errorcode.ER_NO_REFERENCED_ROW_2
+# The database is down or overloaded rather than refusing the data: worth spooling and retrying.
+UNAVAILABLE_ERRORS = CONNECTION_LOST_ERRORS + TRANSIENT_ERRORS
+# The statement itself is wrong, whatever rows it carries: splitting the batch cannot help.
+STATEMENT_ERRORS = (
+    errorcode.ER_PARSE_ERROR,
+    errorcode.ER_NO_SUCH_TABLE,
+)
+
+SQL_UPSERT_DEVICE = """
+    INSERT INTO devices (device_id, latitude, longitude)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        latitude = VALUES(latitude),
+        longitude = VALUES(longitude),
+        last_seen = CURRENT_TIMESTAMP
+"""
+
+SQL_TOUCH_DEVICES = "UPDATE devices SET last_seen = CURRENT_TIMESTAMP WHERE device_id IN ({})"
+
+
+class ReadingBatcher:
+    """ Groups readings by column set and flushes them with executemany() in one commit. """
+
+    def __init__(self, conn, max_rows=50, max_delay_ms=1000, reconnect=None, verbose=True, registry=None,
+                 rollups=False):
+        self.conn = conn
+        self.verbose = verbose
+        self.registry = registry        # optional DeviceRegistry; None upserts every device
+        self.rollups = rollups          # also merge the batch into the 1m/1h/1d rollup tables
+        self.max_rows = max(1, int(max_rows))
+        self.max_delay = max(0, int(max_delay_ms)) / 1000.0
+        self.reconnect = reconnect      # callable returning a fresh connection or None
+
+        self._lock = threading.RLock()
+        self._devices = {}              # device_id -> (latitude, longitude), last one wins
+        self._groups = {}               # (column, ...) -> [row tuple, ...]
+        self._pending = 0               # buffered messages
+        self._oldest = None             # monotonic time of the oldest buffered message
+        self._stop = threading.Event()
+        self._timer = None
+
+        self.stats = {'messages': 0, 'rows_written': 0, 'batches': 0, 'rows_dropped': 0}
+        self.last_error = None          # exception that made the last flush fail, None after a success
+        self.last_refused = []          # [(row dict, error), ...] left out by the last (salvaged) flush
+
+    # --- Buffering ---
+    def add(self, device_id, latitude, longitude, readings, received_at=None):
+        """ Buffer one message. `readings` maps whitelisted column names to values. """
+        received_at = received_at or datetime.datetime.now()
+        with self._lock:
+            self._devices[device_id] = (latitude, longitude)
+            if readings:
+                columns = ('device_id', 'created_at') + tuple(sorted(readings))
+                row = (device_id, received_at) + tuple(readings[c] for c in columns[2:])
+                self._groups.setdefault(columns, []).append(row)
+            self._pending += 1
+            self.stats['messages'] += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._pending >= self.max_rows:
+                self.flush()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def discard(self):
+        """ Drop everything buffered without writing it. Returns the number of messages dropped. """
+        with self._lock:
+            dropped = self._pending
+            self._devices, self._groups = {}, {}
+            self._pending, self._oldest = 0, None
+            return dropped
+
+    # --- Flushing ---
+    def flush(self, statements=()):
+        """
+        Write everything buffered so far in a single transaction. Returns rows written.
+        `statements` are extra (sql, params) pairs executed in the same transaction.
+        """
+        with self._lock:
+            self.last_refused = []
+            if not self._pending:
+                return 0
+            devices, groups = self._devices, self._groups
+            self._devices, self._groups = {}, {}
+            self._pending, self._oldest = 0, None
+
+            row_count = sum(len(rows) for rows in groups.values())
+            retried = salvage = False
+            while True:
+                try:
+                    started = time.perf_counter()
+                    refused = self._write(devices, groups, statements, salvage)
+                    INSERT_SECONDS.observe(time.perf_counter() - started)
+                    written = row_count - len(refused)
+                    BATCH_ROWS.observe(written)
+                    self.stats['rows_written'] += written
+                    self.stats['rows_dropped'] += len(refused)
+                    self.stats['batches'] += 1
+                    self.last_error = None
+                    self.last_refused = refused
+                    if refused:
+                        print(f"⚠️ {len(refused)} readings refused by the database and dropped "
+                              f"(e.g. {refused[0][0]['device_id']}: {refused[0][1]}); {written} stored.")
+                    elif self.verbose:
+                        print(f"✔️ Stored {row_count} readings from {len(devices)} device(s) in one batch.")
+                    return written
+                except Error as e:
+                    self._rollback()
+                    if e.errno in TRANSIENT_ERRORS and not retried:
+                        retried = True
+                        continue
+                    if e.errno == ER_NO_REFERENCED_ROW_2 and self.registry is not None and not retried:
+                        # A device row vanished behind the registry's back; upsert them all again.
+                        for device_id in devices:
+                            self.registry.forget(device_id)
+                        retried = True
+                        continue
+                    if e.errno in CONNECTION_LOST_ERRORS and not retried and self._reopen():
+                        retried = True
+                        continue
+                    if (not salvage and e.errno not in UNAVAILABLE_ERRORS and e.errno not in STATEMENT_ERRORS
+                            and self.conn is not None and self.conn.is_connected()):
+                        salvage = True      # the data was refused: find the rows responsible
+                        continue
+                    print(f"❌ Batch insert error, {row_count} readings not written: {e}")
+                    self.last_error = e
+                    if e.errno in CONNECTION_LOST_ERRORS or self.conn is None or not self.conn.is_connected():
+                        self._drop_connection()     # reconnect on the next flush
+                except Exception as e:
+                    self._rollback()
+                    if not salvage and self.conn is not None and self.conn.is_connected():
+                        salvage = True      # e.g. a value the driver cannot convert
+                        continue
+                    print(f"❌ Unexpected batch insert error, dropping {row_count} readings: {e}")
+                    self.last_error = e
+                break
+            BATCH_FAILURES.inc()
+            self.stats['rows_dropped'] += row_count
+            return 0
+
+    def _write(self, devices, groups, statements=(), salvage=False):
+        """
+        Write one batch in one transaction. Returns the readings left out as
+        [({column: value}, error), ...], which is only ever non-empty in salvage mode.
+        """
+        if self.conn is None and not self._reopen():
+            raise Error(msg="No database connection available",
+                        errno=errorcode.CR_SERVER_GONE_ERROR)
+        cursor = self.conn.cursor()
+        refused = []
+        try:
+            if salvage:
+                self.conn.start_transaction()   # the savepoints below must nest inside it
+            # Sorted so concurrent writers lock device rows in the same order.
+            if self.registry is None:
+                upserts, touches = [(d, lat, lon) for d, (lat, lon) in
+                                    sorted(devices.items(), key=lambda item: str(item[0]))], []
+            else:
+                upserts, touches = self.registry.plan(devices)
+            if upserts:
+                # A refused device row is reported through its readings, which then fail as well.
+                upserts = self._executemany(cursor, SQL_UPSERT_DEVICE, upserts, salvage, [])
+            if touches:
+                # One statement refreshes last_seen for every stale device in the batch.
+                placeholders = ', '.join(['%s'] * len(touches))
+                cursor.execute(SQL_TOUCH_DEVICES.format(placeholders), tuple(touches))
+            written = {}
+            for columns, rows in groups.items():
+                placeholders = ', '.join(['%s'] * len(columns))
+                sql = f"INSERT INTO readings ({', '.join(columns)}) VALUES ({placeholders})"
+                # mysql-connector rewrites executemany() INSERTs into one multi-row statement.
+                left_out = []
+                written[columns] = self._executemany(cursor, sql, rows, salvage, left_out)
+                refused += [(dict(zip(columns, row)), e) for row, e in left_out]
+            if self.rollups:
+                for sql, rows in rollup_upserts(written):
+                    if rows:
+                        cursor.executemany(sql, rows)
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            self.conn.commit()
+            if self.registry is not None:
+                self.registry.record(upserts, touches)
+        finally:
+            cursor.close()
+        return refused
+
+    def _executemany(self, cursor, sql, rows, salvage, refused):
+        """
+        executemany() that returns the rows written. In salvage mode a refused statement is
+        rolled back to a savepoint and retried on each half of its rows; a single row that is
+        still refused is left out and appended to `refused` as (row, error).
+        """
+        if not salvage:
+            cursor.executemany(sql, rows)
+            return rows
+        cursor.execute("SAVEPOINT salvage")
+        try:
+            cursor.executemany(sql, rows)
+        except Exception as e:
+            if getattr(e, 'errno', None) in UNAVAILABLE_ERRORS + STATEMENT_ERRORS:
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT salvage")
+            cursor.execute("RELEASE SAVEPOINT salvage")
+            if len(rows) == 1:
+                refused.append((rows[0], e))
+                return []
+            middle = len(rows) // 2
+            return (self._executemany(cursor, sql, rows[:middle], salvage, refused) +
+                    self._executemany(cursor, sql, rows[middle:], salvage, refused))
+        cursor.execute("RELEASE SAVEPOINT salvage")
+        return rows
+
+    def _rollback(self):
+        try:
+            if self.conn is not None and self.conn.is_connected():
+                self.conn.rollback()
+        except Error:
+            pass
+
+    def _drop_connection(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Error:
+                pass
+        self.conn = None
+
+    def _reopen(self):
+        if self.reconnect is None:
+            return False
+        print("⚠️ Database connection lost. Reconnecting...")
+        self.conn = self.reconnect()
+        return self.conn is not None
+
+    # --- Time-based flushing ---
+    def start(self):
+        """ Start the background thread that enforces the max-delay limit. """
+        if self.max_delay > 0 and self._timer is None:
+            self._timer = threading.Thread(target=self._run_timer, name="batch-flusher", daemon=True)
+            self._timer.start()
+        return self
+
+    def _run_timer(self):
+        tick = min(self.max_delay, 0.05)
+        while not self._stop.wait(tick):
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+            if due:
+                self.flush()
+
+    def close(self):
+        """ Stop the timer and flush whatever is still buffered. """
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        return self.flush()
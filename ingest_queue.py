@@ -0,0 +1,300 @@
+# File: ingest_queue.py
+# Description: Decouples MQTT receive from database writes. The paho callback only parses
+#              a message and puts it on a bounded IngestQueue; a WriterPool of threads, each
+#              with its own MySQL connection, drains the queue in batches via ReadingBatcher.
+#
+#              When the queue is full the configured backpressure policy applies:
+#                block        - the callback waits for room (stalls the MQTT network loop)
+#                drop_oldest  - the oldest queued message is discarded to make room
+#                spill        - the new message is appended to the on-disk spool and
+#                               replayed into MySQL by the SpoolReplayer (see ingest_spool.py).
+#                               A spiller thread does the appends in batches, one fsync each,
+#                               so the MQTT loop and the writers never wait on the disk.
+#
+#              With a spool attached, a batch that fails because MySQL is unreachable is
+#              appended to the spool instead of being dropped, and writers keep spooling
+#              (a local append, no database round trip) until the replayer has caught up.
+
+import collections
+import datetime
+import threading
+import time
+
+import metrics
+from ingest_batcher import UNAVAILABLE_ERRORS, ReadingBatcher
+from ingest_spool import SpoolReplayer, to_record
+
+COMMIT_LATENCY_SECONDS = metrics.REGISTRY.histogram(
+    'ingest_commit_latency_seconds', "Time from enqueueing a reading until it was committed (or spooled).")
+
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+# One queued message: the parsed reading plus the time it was enqueued.
+QueuedReading = collections.namedtuple(
+    'QueuedReading', 'device_id latitude longitude readings received_at enqueued_at')
+
+
+class IngestQueue:
+    """ Bounded FIFO of parsed readings with an explicit overflow policy. """
+
+    def __init__(self, maxsize=10000, policy='block', spool=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {POLICIES}")
+        if policy == 'spill' and spool is None:
+            raise ValueError("The 'spill' policy needs a spool")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.spool = spool              # SegmentSpool used by the 'spill' policy
+
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.counters = {'received': 0, 'enqueued': 0, 'dropped': 0, 'spilled': 0}
+
+        self._overflow = []             # spool records waiting for the spiller thread
+        self._spiller = None
+        if policy == 'spill':
+            self._spiller = threading.Thread(target=self._run_spiller, name="queue-spiller", daemon=True)
+            self._spiller.start()
+
+    def put(self, device_id, latitude, longitude, readings, received_at=None):
+        """ Enqueue one parsed message. Returns False if it was dropped. """
+        item = QueuedReading(device_id, latitude, longitude, readings,
+                             received_at or datetime.datetime.now(), time.monotonic())
+        with self._cond:
+            self.counters['received'] += 1
+            if self._closed:
+                self.counters['dropped'] += 1
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'block':
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                elif self.policy == 'drop_oldest':
+                    self._items.popleft()
+                    self.counters['dropped'] += 1
+                else:
+                    self._overflow.append(to_record(*item[:5]))
+                    self.counters['spilled'] += 1
+                    self._cond.notify_all()     # wake the spiller
+                    return True
+            self._items.append(item)
+            self.counters['enqueued'] += 1
+            self._cond.notify_all()
+        return True
+
+    def get_batch(self, max_items, max_wait):
+        """
+        Wait for at least one item, then keep collecting until `max_items` are gathered or
+        `max_wait` seconds have passed since the first one arrived. Returns [] once closed and empty.
+        """
+        batch = []
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_items:
+                if self._items:
+                    batch.append(self._items.popleft())
+                    continue
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._cond.notify_all()     # wake producers blocked on a full queue
+        return batch
+
+    def _run_spiller(self):
+        """ Append overflowing messages to the spool outside the lock; whatever piles up meanwhile is the next batch. """
+        while True:
+            with self._cond:
+                while not self._overflow and not self._closed:
+                    self._cond.wait()
+                records, self._overflow = self._overflow, []
+                closed = self._closed
+            if records:
+                try:
+                    self.spool.append(records)
+                except OSError as e:
+                    print(f"❌ Could not spill {len(records)} readings to the spool: {e}")
+            elif closed:
+                return
+
+    def close(self):
+        """ Stop accepting messages; writers drain what is left and then exit. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._spiller is not None:
+            self._spiller.join()        # the last overflowing messages are in the spool before it closes
+
+    def depth(self):
+        return len(self._items)
+
+
+class WriterPool:
+    """ N writer threads, each owning one MySQL connection, draining an IngestQueue. """
+
+    def __init__(self, ingest_queue, connect, workers=2, batch_rows=50, batch_delay_ms=1000, registry=None,
+                 rollups=False, spool=None, replay_batch_rows=5000):
+        self.queue = ingest_queue
+        self.connect = connect          # callable returning a new connection or None
+        self.registry = registry        # DeviceRegistry shared by all writers, or None
+        self.rollups = rollups
+        self.workers = max(1, int(workers))
+        self.batch_rows = max(1, int(batch_rows))
+        self.batch_delay = max(0, int(batch_delay_ms)) / 1000.0
+        self.spool = spool              # SegmentSpool absorbing batches while MySQL is unavailable
+
+        # Cleared while the spool has a backlog: writers then append to the spool instead of
+        # writing to MySQL, which keeps rows in order. The replayer sets it once caught up.
+        self.db_available = threading.Event()
+        self.replayer = None
+        if spool is not None:
+            self.replayer = SpoolReplayer(spool, connect, self.db_available, batch_rows=replay_batch_rows,
+                                          registry=registry, rollups=rollups)
+        else:
+            self.db_available.set()
+
+        self._threads = []
+        self._batchers = []
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=2048)    # enqueue-to-commit (or spool), seconds
+        self.counters = {'committed': 0, 'failed': 0, 'spooled': 0}
+
+    def start(self):
+        if self.replayer is not None:
+            self.replayer.start()
+        for n in range(self.workers):
+            batcher = ReadingBatcher(self.connect(), max_rows=self.batch_rows, max_delay_ms=0,
+                                     reconnect=self.connect, verbose=False, registry=self.registry,
+                                     rollups=self.rollups)
+            thread = threading.Thread(target=self._run, args=(batcher,), name=f"db-writer-{n}", daemon=True)
+            self._batchers.append(batcher)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def _run(self, batcher):
+        while True:
+            batch = self.queue.get_batch(self.batch_rows, self.batch_delay)
+            if not batch:
+                break
+            try:
+                self._write_batch(batcher, batch)
+            except Exception as e:
+                # Whatever went wrong, this thread has to keep draining the queue: with every
+                # writer gone ingestion would stop silently (and 'block' would stall MQTT).
+                print(f"❌ Writer error, {len(batch)} readings not written: {e}")
+                batcher.discard()       # so they are not written later, as part of another batch
+                with self._lock:
+                    self.counters['failed'] += len(batch)
+        if batcher.conn is not None and batcher.conn.is_connected():
+            batcher.conn.close()
+
+    def _write_batch(self, batcher, batch):
+        if not self.db_available.is_set():
+            self._spool(batch)
+            return
+        batches_before, dropped_before = batcher.stats['batches'], batcher.stats['rows_dropped']
+        added = []
+        for item in batch:
+            try:
+                batcher.add(item.device_id, item.latitude, item.longitude, item.readings, item.received_at)
+            except Exception as e:      # a malformed reading is skipped, not the batch
+                print(f"❌ Writer skipped a reading of {item.device_id!r}: {e}")
+                with self._lock:
+                    self.counters['failed'] += 1
+                continue
+            added.append(item)
+        batch = added
+        if not batch:
+            return
+        batcher.flush()
+        if batcher.stats['batches'] > batches_before:
+            committed_at = time.monotonic()
+            latencies = [committed_at - item.enqueued_at for item in batch]
+            COMMIT_LATENCY_SECONDS.observe_many(latencies)
+            refused = batcher.stats['rows_dropped'] - dropped_before    # left out by a salvaged flush
+            with self._lock:
+                self.counters['committed'] += len(batch) - refused
+                self.counters['failed'] += refused
+                self._latencies.extend(latencies)
+        elif self.spool is not None and (batcher.conn is None or
+                                         getattr(batcher.last_error, 'errno', None) in UNAVAILABLE_ERRORS):
+            # MySQL is down or overloaded: keep the batch on disk and let the replayer retry.
+            self.db_available.clear()
+            self._spool(batch)
+        else:
+            with self._lock:
+                self.counters['failed'] += len(batch)
+
+    def _spool(self, batch):
+        self.spool.append([to_record(*item[:5]) for item in batch])
+        spooled_at = time.monotonic()
+        latencies = [spooled_at - item.enqueued_at for item in batch]
+        COMMIT_LATENCY_SECONDS.observe_many(latencies)
+        with self._lock:
+            self.counters['spooled'] += len(batch)
+            self._latencies.extend(latencies)
+
+    def stop(self, timeout=30):
+        """ Close the queue, let writers drain it (to MySQL or the spool), and wait for them to exit. """
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self.replayer is not None:
+            self.replayer.stop(timeout)
+            self.spool.close()
+
+    def stats(self):
+        """ Snapshot of queue depth, drop/spill counts, enqueue-to-commit latency (ms) and the spool backlog. """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+        return {
+            'queue_depth': self.queue.depth(),
+            'queue_max': self.queue.maxsize,
+            'policy': self.queue.policy,
+            **self.queue.counters,
+            **counters,
+            'latency_ms_p50': pct(0.50),
+            'latency_ms_p95': pct(0.95),
+            'latency_ms_max': round(latencies[-1] * 1000, 1) if latencies else None,
+            **({'device_' + k: v for k, v in self.registry.counters.items()} if self.registry else {}),
+            **(self.replayer.stats() if self.replayer else {}),
+        }
+
+    def metric_families(self):
+        """ Queue, writer and spool counters as Prometheus families (for Registry.register_collector). """
+        stats = self.stats()
+        counters = {
+            'received': "Valid MQTT messages handed to the writer queue (invalid ones: ingest_parse_failures_total).",
+            'enqueued': "Readings put on the writer queue.",
+            'dropped': "Readings dropped by the drop_oldest policy or after shutdown.",
+            'spilled': "Readings written to the spool because the queue was full.",
+            'committed': "Readings committed to MySQL by the writers.",
+            'failed': "Readings the writers could not commit and did not spool.",
+            'spooled': "Readings the writers spooled while MySQL was unavailable.",
+            'spool_replayed': "Spooled readings replayed into MySQL.",
+            'replay_rejected': "Spooled readings MySQL rejected during replay.",
+        }
+        gauges = {
+            'queue_depth': "Readings waiting on the writer queue.",
+            'queue_max': "Capacity of the writer queue.",
+            'spool_records': "Readings waiting in the spool (backlog).",
+            'spool_bytes': "Bytes of spool segments not yet replayed.",
+            'spool_oldest_age_s': "Age of the oldest reading in the spool, in seconds.",
+            'replay_rate_per_s': "Readings replayed from the spool per second.",
+            'db_available': "1 while writers write to MySQL directly, 0 while they spool.",
+        }
+        families = [metrics.family('ingest_messages_total' if key == 'received' else f"ingest_{key}_total",
+                                   'counter', help_text, stats[key])
+                    for key, help_text in counters.items() if key in stats]
+        families += [metrics.family(f"ingest_{key}", 'gauge', help_text, stats[key])
+                     for key, help_text in gauges.items() if key in stats]
+        return families
@@ -0,0 +1,386 @@
+# File: ingest_spool.py
+# Description: Durable, append-only spool (write-ahead log) for readings the listener could
+#              not commit, either because MySQL is down or because the queue overflowed under
+#              the 'spill' policy. Records are appended to numbered segment files in the spool
+#              directory; a SpoolReplayer thread writes them to MySQL in large batches once the
+#              database is reachable and deletes segments it has fully replayed.
+#
+#              Replay is idempotent: the read position is committed to the spool_checkpoints
+#              table (migration 004) in the same transaction as the replayed rows, so a crash
+#              between the commit and the local checkpoint file cannot replay a batch twice.
+#
+#              Segment format: one record per line, "<crc32 as 8 hex digits> <json>\n". A line
+#              without its newline (torn write at a crash) or with a bad checksum is skipped.
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+
+from ingest_batcher import UNAVAILABLE_ERRORS, ReadingBatcher
+
+SQL_LOAD_CHECKPOINT = "SELECT segment, position FROM spool_checkpoints WHERE spool_id = %s"
+SQL_SAVE_CHECKPOINT = """
+    INSERT INTO spool_checkpoints (spool_id, segment, position)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE segment = VALUES(segment), position = VALUES(position)
+"""
+
+SEGMENT_SUFFIX = '.seg'
+
+
+def to_record(device_id, latitude, longitude, readings, received_at):
+    return {'device_id': device_id, 'latitude': latitude, 'longitude': longitude,
+            'readings': readings, 'received_at': received_at.isoformat()}
+
+
+class SegmentSpool:
+    """ Append-only log of reading records split into segment files, with one reader. """
+
+    def __init__(self, directory, segment_bytes=64 << 20, fsync=True):
+        self.directory = directory
+        self.segment_bytes = max(1 << 16, int(segment_bytes))
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.spool_id = self._load_spool_id()
+        segments = self._segments()
+        self._committed = self._load_checkpoint(segments)
+        # Appends always start a fresh segment, so a torn tail of the last run stays sealed.
+        self._segment = (segments[-1] if segments else self._committed[0]) + 1
+        self._size = 0
+        self._file = None
+        self._pending = self._count_pending()
+        self._corrupt = set()           # (segment, offset) of lines skipped for a bad checksum
+        self.counters = {'appended': 0, 'replayed': 0}
+
+    # --- Files ---
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _load_spool_id(self):
+        # A fresh directory gets a new id, so a stale database checkpoint is never applied to it.
+        path = os.path.join(self.directory, 'spool.id')
+        if not os.path.exists(path):
+            self._write_atomically(path, uuid.uuid4().hex)
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip()
+
+    def _load_checkpoint(self, segments):
+        path = os.path.join(self.directory, 'checkpoint')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                segment, position = f.read().split()
+            return int(segment), int(position)
+        return (segments[0] if segments else 1), 0
+
+    def _write_atomically(self, path, text):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _count_pending(self):
+        count, (segment, offset) = 0, self._committed
+        for number in self._segments():
+            if number < segment:
+                continue
+            with open(self._path(number), 'rb') as f:
+                if number == segment:
+                    f.seek(offset)
+                count += sum(1 for line in f if line.endswith(b'\n'))
+        return count
+
+    # --- Writing ---
+    def append(self, records):
+        """ Durably append a list of record dicts (see to_record()). """
+        if not records:
+            return
+        data = b''.join(self._encode(record) for record in records)
+        with self._lock:
+            if self._file is not None and self._size >= self.segment_bytes:
+                self._file.close()
+                self._file = None
+                self._segment += 1
+                self._size = 0
+            if self._file is None:
+                self._file = open(self._path(self._segment), 'ab')
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._size += len(data)
+            self._pending += len(records)
+            self.counters['appended'] += len(records)
+
+    @staticmethod
+    def _encode(record):
+        body = json.dumps(record, separators=(',', ':')).encode()
+        return b'%08x %s\n' % (zlib.crc32(body), body)
+
+    @staticmethod
+    def _decode(line):
+        checksum, _, body = line[:-1].partition(b' ')
+        try:
+            if int(checksum, 16) != zlib.crc32(body):
+                return None
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    # --- Reading (single reader: the SpoolReplayer) ---
+    def read(self, max_records):
+        """
+        Up to `max_records` records after the committed position, plus the position just past
+        them. Nothing is consumed until commit() is called with that position.
+        """
+        with self._lock:
+            segment, offset = self._committed
+            active, active_size = self._segment, self._size
+        records = []
+        while segment <= active and len(records) < max_records:
+            path = self._path(segment)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < max_records:
+                        if segment == active and offset >= active_size:
+                            break       # only read what append() has finished writing
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            break       # end of segment, or a torn write in a sealed one
+                        record = self._decode(line)
+                        if record is None:
+                            self._corrupt.add((segment, offset))
+                        else:
+                            records.append(record)
+                        offset += len(line)
+            if len(records) >= max_records or segment == active:
+                break
+            segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    def commit(self, position, count):
+        """ Mark everything before `position` (from read()) as replayed and delete finished segments. """
+        with self._lock:
+            if position <= self._committed:
+                return
+            self._committed = position
+            self._pending = max(0, self._pending - count)
+            self.counters['replayed'] += count
+        self._write_atomically(os.path.join(self.directory, 'checkpoint'), f"{position[0]} {position[1]}")
+        for number in self._segments():
+            if number < position[0]:
+                os.remove(self._path(number))
+
+    def seek(self, position, count=0):
+        """ Skip ahead to a position that is already known to be replayed (database checkpoint). """
+        if position > self._committed:
+            self.commit(position, count)
+
+    def position(self):
+        with self._lock:
+            return self._committed
+
+    # --- Introspection ---
+    def backlog_bytes(self):
+        with self._lock:
+            segment, offset = self._committed
+        total = 0
+        for number in self._segments():
+            if number >= segment:
+                try:
+                    total += os.path.getsize(self._path(number))
+                except OSError:
+                    pass
+        return max(0, total - offset)
+
+    def oldest_age(self):
+        """ Seconds since the oldest unreplayed record was received, or None if the spool is empty. """
+        records, _ = self.read(1)
+        if not records:
+            return None
+        received_at = datetime.datetime.fromisoformat(records[0]['received_at'])
+        return max(0.0, (datetime.datetime.now() - received_at).total_seconds())
+
+    def stats(self):
+        age = self.oldest_age()
+        with self._lock:
+            pending = self._pending
+        return {
+            'spool_records': pending,
+            'spool_bytes': self.backlog_bytes(),
+            'spool_segments': len(self._segments()),
+            'spool_oldest_age_s': round(age, 1) if age is not None else None,
+            **{'spool_' + k: v for k, v in self.counters.items()},
+            'spool_corrupt': len(self._corrupt),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SpoolReplayer:
+    """
+    Background thread that replays the spool into MySQL in large batches. While the spool
+    is not empty the writers append to it instead of writing directly (`db_available` is
+    cleared), which keeps rows in arrival order and keeps MQTT ingest latency flat during
+    an outage; once the backlog is gone `db_available` is set again.
+    """
+
+    def __init__(self, spool, connect, db_available, batch_rows=5000, retry_seconds=5, poll_seconds=1.0,
+                 registry=None, rollups=False):
+        self.spool = spool
+        self.connect = connect          # callable returning a new connection or None (one attempt)
+        self.db_available = db_available
+        self.batch_rows = max(1, int(batch_rows))
+        self.retry_seconds = retry_seconds
+        self.poll_seconds = poll_seconds
+        self.registry = registry
+        self.rollups = rollups
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._rates = []                # (monotonic time, records) of recent replayed batches
+        self.counters = {'batches': 0, 'rejected': 0, 'replay_errors': 0}
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        batcher = None
+        while not self._stop.is_set():
+            if batcher is None:
+                batcher = self._open_batcher()
+                if batcher is None:
+                    self._stop.wait(self.retry_seconds)
+                    continue
+
+            committed = self.spool.position()
+            records, position = self.spool.read(self.batch_rows)
+            if not records:
+                self.spool.commit(position, 0)      # skipped corrupt lines / torn tails
+                if self.spool.position() == committed:
+                    self.db_available.set()         # caught up: writers go straight to MySQL again
+                    self._stop.wait(self.poll_seconds)
+                continue
+
+            if not self._replay(batcher, records, position):
+                if batcher.conn is None:
+                    batcher = None
+                    self._stop.wait(self.retry_seconds)
+
+        if batcher is not None and batcher.conn is not None:
+            batcher.conn.close()
+
+    def _open_batcher(self):
+        conn = self.connect()
+        if conn is None:
+            return None
+        try:
+            # The database checkpoint is authoritative: it is committed with the rows.
+            cursor = conn.cursor()
+            cursor.execute(SQL_LOAD_CHECKPOINT, (self.spool.spool_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is not None:
+                self.spool.seek((int(row[0]), int(row[1])))
+        except Exception as e:
+            self.last_error = str(e)
+            conn.close()
+            return None
+        return ReadingBatcher(conn, max_rows=self.batch_rows + 1, max_delay_ms=0, verbose=False,
+                              registry=self.registry, rollups=self.rollups)
+
+    def _replay(self, batcher, records, position):
+        """ Write one batch and move the checkpoint in the same transaction. Returns True on success. """
+        for record in records:
+            batcher.add(record['device_id'], record['latitude'], record['longitude'], record['readings'],
+                        datetime.datetime.fromisoformat(record['received_at']))
+        batches_before = batcher.stats['batches']
+        batcher.flush(statements=[(SQL_SAVE_CHECKPOINT, (self.spool.spool_id,) + position)])
+        if batcher.stats['batches'] > batches_before:
+            if batcher.last_refused:
+                # The rest of the batch is committed; only the readings MySQL refused are set aside.
+                self.last_error = str(batcher.last_refused[0][1])
+                self._reject(self._refused_records(records, batcher.last_refused))
+            self.spool.commit(position, len(records))
+            self.counters['batches'] += 1
+            self._rates.append((time.monotonic(), len(records)))
+            del self._rates[:-20]
+            return True
+
+        error = batcher.last_error
+        self.last_error = str(error)
+        self.counters['replay_errors'] += 1
+        if getattr(error, 'errno', None) in UNAVAILABLE_ERRORS or batcher.conn is None:
+            return False    # keep the batch; retried once the database is back
+        # Not even the rows MySQL accepts could be written apart from the others (a statement
+        # error or an unexpected failure): set the batch aside so it cannot block the spool forever.
+        self._reject(records)
+        self.spool.commit(position, len(records))
+        return False
+
+    @staticmethod
+    def _refused_records(records, refused):
+        """ The spool records behind the readings a salvaged flush left out (see ReadingBatcher.last_refused). """
+        def key(device_id, received_at, readings):
+            return device_id, received_at, json.dumps(readings, sort_keys=True, default=str)
+
+        by_reading = {}
+        for record in records:
+            by_reading.setdefault(key(record['device_id'], record['received_at'], record['readings']), []).append(record)
+        rejected = []
+        for row, _ in refused:
+            readings = {k: v for k, v in row.items() if k not in ('device_id', 'created_at')}
+            matches = by_reading.get(key(row['device_id'], row['created_at'].isoformat(), readings))
+            rejected.append(matches.pop() if matches else
+                            to_record(row['device_id'], None, None, readings, row['created_at']))
+        return rejected
+
+    def _reject(self, records):
+        path = os.path.join(self.spool.directory, 'rejected.jsonl')
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        self.counters['rejected'] += len(records)
+        print(f"❌ Spool replay rejected {len(records)} readings ({self.last_error}); saved to {path}")
+
+    def replay_rate(self):
+        """ Records per second over the recently replayed batches. """
+        rates = [r for r in self._rates if time.monotonic() - r[0] <= 60]
+        if len(rates) < 2:
+            return 0.0
+        return round(sum(n for _, n in rates[1:]) / max(1e-6, rates[-1][0] - rates[0][0]), 1)
+
+    def stats(self):
+        return {
+            **self.spool.stats(),
+            'replay_rate_per_s': self.replay_rate(),
+            'replay_batches': self.counters['batches'],
+            'replay_rejected': self.counters['rejected'],
+            'replay_errors': self.counters['replay_errors'],
+            'db_available': self.db_available.is_set(),
+        }
@@ -0,0 +1,218 @@
+# File: ingest_workers.py
+# Description: Multi-process ingestion for the MQTT listener (INGEST_WORKERS > 1), so the
+#              fleet's ingest rate is no longer bound by one interpreter and its GIL.
+#              Two modes:
+#                shared    - every worker process has its own MQTT session and subscribes to
+#                            $share/<group>/<topic>; the broker spreads messages across them
+#                            (Mosquitto >= 1.6, EMQX, HiveMQ, ...).
+#                dispatch  - for brokers without shared subscriptions: the parent process holds
+#                            the only MQTT session and forwards raw payloads to the workers,
+#                            sharded by device_id so each device is always handled by the
+#                            same worker (and its readings stay in order).
+#              Workers send their ingest stats (and metrics) to the parent, which prints them
+#              per worker, can write them to a JSON file and serves the metrics on /metrics.
+
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+
+import metrics
+import payload_codec
+
+WORKER_MODES = ('shared', 'dispatch')
+
+# Finds the device id without a full JSON parse; the worker still parses the whole payload.
+_DEVICE_ID_PATTERN = re.compile(rb'"device_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def shard_for(device_id, workers):
+    """ Stable worker index for a device (the same in every run and every process). """
+    if isinstance(device_id, str):
+        device_id = device_id.encode()
+    return zlib.crc32(device_id) % workers
+
+
+def peek_device_id(payload):
+    if payload[:2] == payload_codec.MAGIC:
+        return payload_codec.binary_device_id(payload)
+    match = _DEVICE_ID_PATTERN.search(payload)
+    if match:
+        return match.group(1)
+    try:
+        device_id = json.loads(payload).get('device_id')
+    except (ValueError, AttributeError):
+        return b''      # invalid payloads are rejected (and logged) by whichever worker gets them
+    return str(device_id).encode() if device_id is not None else b''
+
+
+class ShardDispatcher:
+    """
+    Forwards (topic, payload) pairs to per-worker multiprocessing queues, sharded by device_id.
+    Payloads are sent in small batches to keep the pickling/pipe cost per message low.
+    """
+
+    def __init__(self, inboxes, batch_size=100, max_delay=0.05):
+        self.inboxes = inboxes
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._buffers = [[] for _ in inboxes]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._run, name="shard-flusher", daemon=True)
+        self.counters = {'dispatched': [0] * len(inboxes)}
+
+    def start(self):
+        self._flusher.start()
+        return self
+
+    def dispatch(self, topic, payload):
+        index = shard_for(peek_device_id(payload), len(self.inboxes))
+        with self._lock:
+            buffer = self._buffers[index]
+            buffer.append((topic, payload))
+            self.counters['dispatched'][index] += 1
+            if len(buffer) >= self.batch_size:
+                self._buffers[index] = []
+            else:
+                return
+        self.inboxes[index].put(buffer)
+
+    def _flush_all(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, [[] for _ in self.inboxes]
+        for index, buffer in enumerate(buffers):
+            if buffer:
+                self.inboxes[index].put(buffer)
+
+    def _run(self):
+        while not self._stop.wait(self.max_delay):
+            self._flush_all()
+
+    def close(self):
+        """ Send what is buffered, then tell every worker that no more messages will come. """
+        self._stop.set()
+        self._flusher.join()
+        self._flush_all()
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+
+class WorkerSupervisor:
+    """
+    Starts `workers` processes running target(index, inbox, stats_queue, stop_event) and restarts
+    any that die. In dispatch mode each worker gets its own inbox queue; in shared mode inbox is None.
+    """
+
+    def __init__(self, target, workers, mode='shared', inbox_size=1000):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"Unknown worker mode '{mode}', expected one of {WORKER_MODES}")
+        self.target = target
+        self.workers = workers
+        self.mode = mode
+        self.stats_queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.inboxes = [multiprocessing.Queue(inbox_size) for _ in range(workers)] if mode == 'dispatch' else None
+        self._processes = [None] * workers
+        self.restarts = 0
+
+    def _spawn(self, index):
+        inbox = self.inboxes[index] if self.inboxes else None
+        process = multiprocessing.Process(target=self.target, name=f"ingest-worker-{index}",
+                                          args=(index, inbox, self.stats_queue, self.stop_event))
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        return self
+
+    def check(self):
+        """ Restart workers that exited without being asked to. Returns the number restarted. """
+        restarted = 0
+        if self.stop_event.is_set():
+            return 0
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                print(f"⚠️ Ingest worker {index} (pid {process.pid}) exited with code {process.exitcode}; restarting.")
+                self._spawn(index)
+                restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def stop(self, timeout=60):
+        """ Ask the workers to drain and exit; terminate any that do not finish in time. """
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+
+class StatsCollector:
+    """ Latest stats snapshot of every worker, as reported over the stats queue. """
+
+    def __init__(self, stats_queue, path=None):
+        self.stats_queue = stats_queue
+        self.path = path                # JSON file rewritten whenever new stats arrive, or None
+        self.workers = {}               # index -> {'pid': ..., 'updated': ..., **stats}
+        self.families = {}              # index -> the worker's latest metric families
+
+    def record(self, index, pid, stats, write=True, families=None):
+        self.workers[index] = {'pid': pid, 'updated': time.time(), **stats}
+        if families is not None:
+            self.families[index] = families
+        if write and self.path:
+            self.write(self.path)
+
+    def poll(self, timeout=0.0):
+        """ Take in everything reported so far. Returns True if anything new arrived. """
+        updated = False
+        while True:
+            try:
+                index, pid, stats, families = self.stats_queue.get(timeout=timeout if not updated else 0)
+            except queue.Empty:
+                break
+            self.record(index, pid, stats, write=False, families=families)
+            updated = True
+        if updated and self.path:
+            self.write(self.path)
+        return updated
+
+    def totals(self):
+        """ Sum of every numeric counter across workers (latency percentiles are left out). """
+        totals = {}
+        for stats in self.workers.values():
+            for key, value in stats.items():
+                if key in ('pid', 'updated', 'queue_max') or key.startswith('latency_') or key.endswith('_avg') \
+                        or isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def metric_families(self):
+        """ Every worker's metrics as reported last, labelled worker="<index>". """
+        return metrics.merge_families(self.families, 'worker')
+
+    def report(self):
+        lines = [f"📈 Ingest stats, {len(self.workers)} worker(s): {self.totals()}"]
+        for index in sorted(self.workers):
+            stats = self.workers[index]
+            lines.append(f"   worker {index} (pid {stats['pid']}): enqueued={stats.get('enqueued')} "
+                         f"committed={stats.get('committed')} spooled={stats.get('spooled')} "
+                         f"queue_depth={stats.get('queue_depth')} p95={stats.get('latency_ms_p95')} ms")
+        return '\n'.join(lines)
+
+    def write(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'updated': time.time(), 'totals': self.totals(),
+                       'workers': {str(i): s for i, s in sorted(self.workers.items())}}, f, indent=2)
+        os.replace(tmp, path)
@@ -0,0 +1,192 @@
+# File: latest_cache.py
+# Description: In-memory latest-value cache for the dashboard "latest" endpoints.
+#              Keeps, per device, the newest full reading row and, per (device, metric),
+#              the newest non-NULL value. The cache is refreshed incrementally from rows
+#              with an id greater than the last one seen (a primary-key range scan), at
+#              most once per `max_staleness` seconds no matter how many clients poll.
+#              "Newest" means the latest created_at (ties broken by id), not the highest id:
+#              a batched or replayed payload can insert older readings after newer ones.
+
+import threading
+import time
+
+import metrics
+
+METRIC_COLUMNS = (
+    'temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3', 'wind_speed_ms',
+    'water_level_cm', 'salinity_ppt', 'conductivity_us_cm', 'tds_ppm',
+)
+
+SQL_NEW_ROWS = f"""
+    SELECT id, device_id, {', '.join(METRIC_COLUMNS)}, created_at
+    FROM readings
+    WHERE id > %s
+    ORDER BY id
+    LIMIT %s;
+"""
+
+# Warm-up for a (device, metric) pair not seen in the recent tail, e.g. a sensor that has
+# been silent for a while. Only run once at startup.
+SQL_LATEST_METRIC = """
+    SELECT id, {metric}, created_at
+    FROM readings
+    WHERE device_id = %s AND {metric} IS NOT NULL
+    ORDER BY created_at DESC, id DESC LIMIT 1;
+"""
+
+
+class LatestValueCache:
+    """ Latest row per device and latest non-NULL value per (device, metric). """
+
+    def __init__(self, pool, warm_devices=(), max_staleness=2.0, overlap_ids=1000, page_size=5000):
+        self.pool = pool
+        self.warm_devices = list(warm_devices)  # devices whose metrics are looked up on first use
+        self.max_staleness = max_staleness
+        # Writer threads commit concurrently, so ids can become visible slightly out of
+        # order. Re-reading the last `overlap_ids` ids on every refresh catches late rows;
+        # apply() ignores anything older than what is already cached.
+        self.overlap_ids = overlap_ids
+        self.page_size = page_size
+
+        self._lock = threading.Lock()           # protects the maps below
+        self._refresh_lock = threading.Lock()   # only one thread talks to MySQL at a time
+        self._warm_lock = threading.Lock()
+        self._rows = {}         # device_id -> newest row dict
+        self._metrics = {}      # (device_id, metric) -> (id, value, created_at)
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._warm = False
+        self._recent_ids = set()    # ids applied within the overlap window, to spot late rows
+        self._listeners = []
+        self.counters = {'refreshes': 0, 'rows_applied': 0, 'hits': 0}
+
+    # --- Feeding the cache ---
+    def add_listener(self, callback):
+        """ Call `callback(rows)` with every batch of newly seen rows, whoever triggered the refresh. """
+        self._listeners.append(callback)
+
+    def apply(self, row):
+        """
+        Merge one reading row (dict with id, device_id, metric columns, created_at).
+        Returns True if the row had not been seen before.
+        """
+        device_id, row_id = row['device_id'], row['id']
+        with self._lock:
+            if row_id in self._recent_ids:
+                return False
+            self._recent_ids.add(row_id)
+            created_at = row['created_at']
+            current = self._rows.get(device_id)
+            if current is None or (current['created_at'], current['id']) < (created_at, row_id):
+                self._rows[device_id] = row
+            for metric in METRIC_COLUMNS:
+                value = row.get(metric)
+                if value is None:
+                    continue
+                known = self._metrics.get((device_id, metric))
+                if known is None or (known[2], known[0]) < (created_at, row_id):
+                    self._metrics[(device_id, metric)] = (row_id, value, created_at)
+            if row_id > self._last_id:
+                self._last_id = row_id
+            self.counters['rows_applied'] += 1
+            return True
+
+    def refresh(self, force=False, notify=True):
+        """
+        Pull rows newer than the last seen id if the cache is older than max_staleness.
+        Returns the list of new rows applied (empty if nothing changed or not due yet).
+        """
+        if not force and time.monotonic() - self._refreshed_at < self.max_staleness:
+            return []
+        # If another request is already refreshing, serve what we have instead of queueing.
+        if not self._refresh_lock.acquire(blocking=force):
+            return []
+        try:
+            start_id = max(0, self._last_id - self.overlap_ids)
+            new_rows = []
+            with self.pool.connection() as conn, metrics.phase('db'):
+                cursor = conn.cursor(dictionary=True)
+                while True:
+                    cursor.execute(SQL_NEW_ROWS, (start_id, self.page_size))
+                    page = cursor.fetchall()
+                    new_rows.extend(row for row in page if self.apply(row))
+                    if len(page) < self.page_size:
+                        break
+                    start_id = page[-1]['id']
+                cursor.close()
+            with self._lock:
+                horizon = self._last_id - self.overlap_ids
+                self._recent_ids = {row_id for row_id in self._recent_ids if row_id > horizon}
+            self._refreshed_at = time.monotonic()
+            self.counters['refreshes'] += 1
+        finally:
+            self._refresh_lock.release()
+        if notify and new_rows:
+            for callback in self._listeners:
+                callback(new_rows)
+        return new_rows
+
+    def warm_up(self, device_ids, tail_rows=50000):
+        """ Load the recent tail of readings, then fill any (device, metric) gaps individually. """
+        with self._refresh_lock:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM readings;")
+                self._last_id = max(0, cursor.fetchone()['max_id'] - tail_rows)
+                cursor.close()
+        self.refresh(force=True, notify=False)
+        with self._refresh_lock, self.pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            for device_id in device_ids:
+                for metric in METRIC_COLUMNS:
+                    if (device_id, metric) in self._metrics:
+                        continue
+                    cursor.execute(SQL_LATEST_METRIC.format(metric=metric), (device_id,))
+                    found = cursor.fetchone()
+                    if found:
+                        with self._lock:
+                            self._metrics.setdefault((device_id, metric),
+                                                     (found['id'], found[metric], found['created_at']))
+            cursor.close()
+        self._warm = True
+
+    def sync(self, force=False):
+        """ Warm the cache on first use, otherwise refresh it if it is due (or `force`). """
+        if not self._warm:
+            with self._warm_lock:
+                if not self._warm:
+                    self.warm_up(self.warm_devices)
+                    return []
+        return self.refresh(force=force)
+
+    # --- Reading the cache ---
+    def latest_row(self, device_id):
+        """ Newest reading row of a device (a copy), or None. """
+        self.sync()
+        with self._lock:
+            self.counters['hits'] += 1
+            row = self._rows.get(device_id)
+            return dict(row) if row else None
+
+    def latest_metric(self, device_ids, metric):
+        """ Newest non-NULL value of `metric` across `device_ids` as (value, created_at), or (None, None). """
+        self.sync()
+        with self._lock:
+            self.counters['hits'] += 1
+            candidates = [self._metrics[(d, metric)] for d in device_ids if (d, metric) in self._metrics]
+        if not candidates:
+            return None, None
+        _, value, created_at = max(candidates, key=lambda c: c[2])
+        return value, created_at
+
+    def latest_created_at(self, device_ids):
+        """ MAX(created_at) over the given devices' newest rows. """
+        self.sync()
+        with self._lock:
+            stamps = [self._rows[d]['created_at'] for d in device_ids if d in self._rows]
+        return max(stamps) if stamps else None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, devices=len(self._rows), metrics=len(self._metrics),
+                        last_id=self._last_id, age_seconds=round(time.monotonic() - self._refreshed_at, 3))
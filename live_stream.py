@@ -0,0 +1,153 @@
+# File: live_stream.py
+# Description: Server-Sent Events fan-out for the dashboards. One background thread asks the
+#              LatestValueCache for rows newer than the last seen id; every new row is pushed
+#              to the SSE clients subscribed to its device. The database is therefore polled
+#              once per interval in total, not once per open browser tab.
+
+import datetime
+import decimal
+import json
+import queue
+import threading
+import time
+
+
+def _to_json(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def format_event(event, data, event_id=None):
+    """ Encode one SSE message. """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=_to_json)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def reading_payload(row):
+    """ The JSON body of a 'reading' event: the row plus the labels the dashboards already use. """
+    payload = {key: value for key, value in row.items() if value is not None}
+    created_at = row.get('created_at')
+    if isinstance(created_at, datetime.datetime):
+        payload['time_utc'] = created_at.strftime('%Y-%m-%dT%H:%M:%S')
+        payload['time_label'] = created_at.strftime('%H:%M:%S')
+    return payload
+
+
+class _Subscriber:
+    __slots__ = ('devices', 'queue', 'lagged')
+
+    def __init__(self, devices, size):
+        self.devices = frozenset(devices)
+        self.queue = queue.Queue(maxsize=size)
+        self.lagged = False
+
+
+class ReadingBroadcaster:
+    """ Polls for new readings on one thread and fans them out to all connected SSE clients. """
+
+    def __init__(self, latest_cache, poll_interval=1.0, heartbeat_seconds=15, client_queue_size=256):
+        self.cache = latest_cache
+        self.poll_interval = poll_interval
+        self.heartbeat_seconds = heartbeat_seconds
+        self.client_queue_size = client_queue_size
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self.counters = {'events_sent': 0, 'clients_lagged': 0, 'poll_errors': 0}
+
+        # Rows found by any refresh (including ones triggered by regular HTTP requests) are pushed.
+        latest_cache.add_listener(self._publish)
+
+    # --- Client side ---
+    def stream(self, device_ids):
+        """ Generator of SSE text for a Flask streaming Response. """
+        subscriber = self._subscribe(device_ids)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    rows = subscriber.queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"    # also how we notice a disconnected client
+                    continue
+                if subscriber.lagged:
+                    # The client fell behind and events were discarded; make it re-fetch.
+                    subscriber.lagged = False
+                    yield format_event('resync', {})
+                    continue
+                for row in rows:
+                    self.counters['events_sent'] += 1
+                    yield format_event('reading', reading_payload(row), event_id=row.get('id'))
+        finally:
+            self._unsubscribe(subscriber)
+
+    def _subscribe(self, device_ids):
+        subscriber = _Subscriber(device_ids, self.client_queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sse-poller", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        return subscriber
+
+    def _unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    # --- Upstream change detection ---
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._subscribers:
+                    self._wakeup.wait()     # nobody is listening: don't poll the database
+            started = time.monotonic()
+            try:
+                self.cache.sync(force=True)
+            except Exception as e:
+                self.counters['poll_errors'] += 1
+                print(f"Live stream poll error: {e}")
+            time.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
+
+    def _publish(self, rows):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            matching = [row for row in rows if row['device_id'] in subscriber.devices]
+            if not matching:
+                continue
+            try:
+                subscriber.queue.put_nowait(matching)
+            except queue.Full:
+                # Slow client: drop its backlog and tell it to resynchronise over plain HTTP.
+                self._drain(subscriber.queue)
+                subscriber.lagged = True
+                try:
+                    subscriber.queue.put_nowait([])     # wake the client's generator
+                except queue.Full:
+                    pass
+                self.counters['clients_lagged'] += 1
+
+    @staticmethod
+    def _drain(q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stats(self):
+        return dict(self.counters, clients=self.client_count())
@@ -0,0 +1,349 @@
+# File: metrics.py
+# Description: Minimal Prometheus instrumentation shared by app.py, data hook api.py and the
+#              MQTT listener, without adding prometheus_client as a dependency. Counters, gauges
+#              and histograms are rendered in the Prometheus text format (version 0.0.4).
+#
+#              Hot-path cost is one dict lookup plus one uncontended lock per update (see
+#              Test/bench_metrics.py). Per-request phases (pool acquisition, DB, serialization)
+#              are accumulated in a thread-local and observed once when the request ends.
+#
+#              instrument_flask(app) adds the per-route histograms and a /metrics route;
+#              serve_metrics(port) exposes a registry from a process without a web server.
+
+import bisect
+import http.server
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds: from sub-millisecond cache hits to slow exports.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Rows per committed batch.
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+# --- Metric types ---
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', self.value)]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', 'bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def observe_many(self, values):
+        """ One lock round for a whole batch of observations. """
+        indexes = [bisect.bisect_left(self.bounds, value) for value in values]
+        with self._lock:
+            for index in indexes:
+                self.counts[index] += 1
+            self.sum += sum(values)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        out, cumulative = [], 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            out.append(('_bucket', cumulative, ('le', _format_value(bound))))
+        out.append(('_sum', total))
+        out.append(('_count', cumulative))
+        return out
+
+
+class Metric:
+    """ A named metric family; labels(*values) returns the child holding one series. """
+
+    def __init__(self, kind, name, help_text, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self._children = {}
+        self._lock = threading.Lock()
+        self._default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        if self.kind == 'histogram':
+            return _HistogramChild(self.buckets)
+        return _GaugeChild() if self.kind == 'gauge' else _CounterChild()
+
+    # Shortcuts for metrics without labels.
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def observe_many(self, values):
+        self._default.observe_many(values)
+
+    def collect(self):
+        """ (name, kind, help, [(sample name, {label: value}, value), ...]) """
+        samples = []
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            for sample in child.samples():
+                extra = dict([sample[2]]) if len(sample) > 2 else {}
+                samples.append((self.name + sample[0], {**labels, **extra}, sample[1]))
+        return self.name, self.kind, self.help, samples
+
+
+class Registry:
+    """ Metrics of one process plus collector callbacks evaluated at scrape time. """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help_text, labelnames, buckets=None):
+        # Idempotent, so a module can declare its metrics at import time even if imported twice.
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(kind, name, help_text, labelnames, buckets)
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered as a different {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        # Name counters with the _total suffix; it is not added here.
+        return self._get('counter', name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get('gauge', name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get('histogram', name, help_text, labelnames, buckets)
+
+    def register_collector(self, collect):
+        """ `collect()` returns metric families in the Metric.collect() shape; called on every scrape. """
+        self._collectors.append(collect)
+
+    def collect(self):
+        families = [metric.collect() for metric in list(self._metrics.values())]
+        for collect in self._collectors:
+            try:
+                families.extend(collect())
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+        return families
+
+    def render(self):
+        return render(self.collect())
+
+
+REGISTRY = Registry()
+
+
+def family(name, kind, help_text, value=None, samples=None):
+    """ A family for Registry collectors: one unlabelled `value`, or `samples` as {labels-dict-items: value}. """
+    if samples is None:
+        samples = [(name, {}, value)] if value is not None else []
+    else:
+        samples = [(name, dict(labels), v) for labels, v in samples.items() if v is not None]
+    return name, kind, help_text, samples
+
+
+def merge_families(families_by_source, label):
+    """ Combine the families of several processes into one set, each sample labelled label=<source>. """
+    merged = {}
+    for source, families in sorted(families_by_source.items()):
+        for name, kind, help_text, samples in families:
+            entry = merged.setdefault(name, (name, kind, help_text, []))
+            entry[3].extend((sample, {label: str(source), **labels}, value) for sample, labels, value in samples)
+    return list(merged.values())
+
+
+# --- Exposition ---
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(families):
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(v)}"' for key, v in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{sample_name} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Request phases ---
+_request = threading.local()
+
+
+def begin_request():
+    _request.phases = {}
+
+
+def end_request():
+    """ Seconds spent in each phase since begin_request() on this thread. """
+    phases = getattr(_request, 'phases', None)
+    _request.phases = None
+    return phases or {}
+
+
+def record_phase(name, seconds):
+    """ Add time to a phase of the current request; a no-op outside a request. """
+    phases = getattr(_request, 'phases', None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+class phase:
+    """ `with metrics.phase('db'):` counts the block's time towards the current request's DB time. """
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_phase(self.name, time.perf_counter() - self.started)
+        return False
+
+
+# --- Flask integration ---
+def instrument_flask(app, registry=REGISTRY):
+    """
+    Per-route request latency plus its split into phases (acquire, db, serialize, other),
+    and a /metrics route. Streamed bodies are written after the request is observed, so for
+    streaming routes the histograms cover the time to the first byte.
+    """
+    from flask import Response, g, request
+    from flask.json.provider import DefaultJSONProvider
+
+    duration = registry.histogram('http_request_duration_seconds',
+                                  "Time to handle a request, until its response is handed to the server.",
+                                  ('route', 'method', 'status'))
+    phases = registry.histogram('http_request_phase_seconds',
+                                "Time a request spent acquiring a pooled connection (acquire), in MySQL (db), "
+                                "encoding JSON (serialize), compressing the body (compress) and "
+                                "everything else (other).",
+                                ('route', 'phase'))
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        # jsonify() goes through here, so serialization is timed for every route.
+        def response(self, *args, **kwargs):
+            with phase('serialize'):
+                return super().response(*args, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        begin_request()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        spent = end_request()
+        duration.labels(route, request.method, str(response.status_code)).observe(elapsed)
+        for name, seconds in spent.items():
+            phases.labels(route, name).observe(seconds)
+        phases.labels(route, 'other').observe(max(0.0, elapsed - sum(spent.values())))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(registry.render(), mimetype=CONTENT_TYPE)
+
+    return app
+
+
+# --- Standalone exporter ---
+def serve_metrics(port, registry=REGISTRY, host='0.0.0.0'):
+    """ Serve GET /metrics on a daemon thread, for processes that are not web servers. """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass    # no access log on stdout for every scrape
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -1,44 +1,109 @@
 # File: mqtt_to_mysql.py
-# Version: 4.1 (Production Ready - Relational Model)
+# Version: 4.9 (Queued Batched Inserts + Durable Spool + Worker Processes + Metrics + Binary/Batched Payloads + Pluggable Storage + Alerts - Relational Model)
 # Description: Subscribes to MQTT, upserts device metadata, and dynamically inserts 
 #              time-series readings into a normalized, multi-table database.
+#              Readings are queued and written in batched transactions by a pool of
+#              writer threads (see ingest_queue.py and ingest_batcher.py). While MySQL is
+#              unreachable, readings go to an on-disk spool and are replayed later (ingest_spool.py).
+#              With INGEST_WORKERS > 1 the work is spread over several processes (ingest_workers.py).
+#              Besides one JSON reading per publish, nodes may send batches of timestamped
+#              readings and a compact binary encoding (payload_codec.py).
+#              Readings go to MySQL or, with STORAGE_BACKEND=sqlite, to an embedded SQLite
+#              file (storage.py), e.g. on an edge gateway without a MySQL server.
+#              Each reading is checked against threshold, rate-of-change and z-score rules as it
+#              arrives; alerts are stored in 'alerts' and published on MQTT (alert_engine.py).
 
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
-import mysql.connector
-from mysql.connector import Error
 import json
 import os
+import queue
+import signal
+import threading
 import time
 
+import alert_engine
+import metrics
+import payload_codec
+import storage
+from alert_engine import AlertEngine, AlertSink
+from device_registry import DeviceRegistry
+from ingest_queue import IngestQueue, WriterPool
+from ingest_spool import SegmentSpool
+from ingest_workers import ShardDispatcher, StatsCollector, WorkerSupervisor
+from storage import Error
+
 # --- Configuration ---
-DB_PASSWORD = os.getenv('MYSQL_PASSWORD', 'YourNewPassword') # Default password if not set
 
-MQTT_BROKER_IP = "localhost"
-MQTT_PORT = 1883
+MQTT_BROKER_IP = os.getenv('MQTT_BROKER_IP', "localhost")
+MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
 MQTT_TOPIC_TO_SUBSCRIBE = "iot/data/#"
+MQTT_CLIENT_ID = "relational-ingestion-service"
+
+# Database: STORAGE_BACKEND=mysql (MYSQL_HOST, MYSQL_PASSWORD, ...) or sqlite (STORAGE_SQLITE_PATH),
+# see storage.py.
+DB_CONFIG = storage.CONFIG
+
+# Batching: a transaction is committed after BATCH_MAX_ROWS messages or once the oldest
+# buffered message is BATCH_MAX_DELAY_MS old. BATCH_MAX_ROWS=1 restores per-message commits.
+BATCH_MAX_ROWS = int(os.getenv('INGEST_BATCH_MAX_ROWS', '50'))
+BATCH_MAX_DELAY_MS = int(os.getenv('INGEST_BATCH_MAX_DELAY_MS', '1000'))
+
+# Queue between the MQTT callback and the database writer threads (see ingest_queue.py).
+QUEUE_MAX_SIZE = int(os.getenv('INGEST_QUEUE_MAX_SIZE', '10000'))
+QUEUE_POLICY = os.getenv('INGEST_QUEUE_POLICY', 'block')         # block | drop_oldest | spill
+WRITER_THREADS = int(os.getenv('INGEST_WRITER_THREADS', '2'))
+STATS_INTERVAL_SECONDS = int(os.getenv('INGEST_STATS_INTERVAL', '60'))  # 0 disables
+
+# Durable spool (write-ahead log) for readings that cannot be committed right now: MySQL is
+# down, or the queue is full under the 'spill' policy. Replayed in batches of REPLAY_BATCH_ROWS.
+SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', 'ingest_spool')
+SPOOL_SEGMENT_MB = int(os.getenv('INGEST_SPOOL_SEGMENT_MB', '64'))
+SPOOL_FSYNC = os.getenv('INGEST_SPOOL_FSYNC', '1') == '1'
+REPLAY_BATCH_ROWS = int(os.getenv('INGEST_REPLAY_BATCH_ROWS', '5000'))
+
+# Worker processes (see ingest_workers.py). 1 = everything in this process.
+#   shared   - each worker subscribes to $share/<INGEST_SHARE_GROUP>/iot/data/# itself
+#   dispatch - this process subscribes and shards messages to the workers by device_id
+WORKER_PROCESSES = int(os.getenv('INGEST_WORKERS', '1'))
+WORKER_MODE = os.getenv('INGEST_WORKER_MODE', 'shared')
+SHARE_GROUP = os.getenv('INGEST_SHARE_GROUP', 'ingest')
+# Per-worker stats are also written to this JSON file when set.
+STATS_FILE = os.getenv('INGEST_STATS_FILE', '')
+
+# Prometheus metrics are served on http://<host>:INGEST_METRICS_PORT/metrics (0 disables).
+# With worker processes the parent serves every worker's metrics, refreshed this often.
+METRICS_PORT = int(os.getenv('INGEST_METRICS_PORT', '9108'))
+METRICS_PUSH_SECONDS = 5
 
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'unified_sensor_db',
-    'user': 'root',
-    'password': 'saintgits'
-}
+# Devices are only written when their location changes or last_seen is older than this.
+DEVICE_STALE_SECONDS = int(os.getenv('INGEST_DEVICE_STALE_SECONDS', '60'))
+
+# Maintain the readings_1m / _1h / _1d rollup tables (migration 003) in each batch transaction.
+MAINTAIN_ROLLUPS = os.getenv('INGEST_ROLLUPS', '1') == '1'
+
+# Alerting (see alert_engine.py): every reading is checked against the rules in ALERT_RULES_FILE
+# (a JSON list; the built-in defaults without one) before it is queued. Alerts are inserted into
+# the 'alerts' table (migration 005) and published on <ALERT_TOPIC_PREFIX>/<device_id>.
+ALERTS_ENABLED = os.getenv('INGEST_ALERTS', '1') == '1'
+ALERT_RULES_FILE = os.getenv('ALERT_RULES_FILE', '')
+ALERT_TOPIC_PREFIX = os.getenv('ALERT_TOPIC_PREFIX', 'iot/alerts')
 
 # (The db_connect and on_connect functions are identical to the previous version)
-def db_connect(config):
-    """ Connect to the MySQL database with retry logic. """
+def db_connect(config, attempts=5):
+    """ Connect to the database with retry logic. """
     conn = None
     attempt = 1
-    while not conn and attempt <= 5:
+    while not conn and attempt <= attempts:
         try:
-            conn = mysql.connector.connect(**config)
+            conn = storage.connect(config)
             if conn.is_connected():
-                print("✅ MySQL connection successful.")
+                print(f"✅ {storage.describe(config)} connection successful.")
                 return conn
         except Error as e:
-            print(f"⚠️ MySQL connection error (Attempt {attempt}/5): {e}")
-            time.sleep(5)
+            print(f"⚠️ Database connection error (Attempt {attempt}/{attempts}): {e}")
+            if attempt < attempts:
+                time.sleep(5)
             attempt += 1
     return None
 
@@ -46,103 +111,273 @@ def on_connect(client, userdata, flags, rc, properties=None):
     """ Callback for when the client connects to the MQTT broker. """
     if rc == 0:
         print("✅ Connected to MQTT Broker!")
-        client.subscribe(MQTT_TOPIC_TO_SUBSCRIBE)
-        print(f"👂 Subscribed to topic: {MQTT_TOPIC_TO_SUBSCRIBE}")
+        client.subscribe(userdata['topic'])
+        print(f"👂 Subscribed to topic: {userdata['topic']}")
     else:
         print(f"❌ Failed to connect to MQTT Broker, return code {rc}\n")
 
 
-# --- THIS IS THE NEW, UPGRADED on_message FUNCTION ---
+# Whitelist of all possible valid sensor keys, to prevent junk data (shared with payload_codec).
+ALLOWED_SENSOR_KEYS = payload_codec.ALLOWED_SENSOR_KEYS
+
+# Valid messages are counted by the IngestQueue (ingest_messages_total) under the lock it takes anyway.
+PARSE_FAILURES = metrics.REGISTRY.counter('ingest_parse_failures_total', "Messages that could not be ingested.",
+                                          ('reason',))
+# Children looked up once, so counting costs no label lookup per message.
+INVALID_JSON = PARSE_FAILURES.labels('invalid_json')
+INVALID_FORMAT = PARSE_FAILURES.labels('invalid_format')
+INVALID_BINARY = PARSE_FAILURES.labels('invalid_binary')
+UNEXPECTED_ERROR = PARSE_FAILURES.labels('error')
+
+def parse_message(payload, topic='', content_type=None):
+    """
+    Decode a JSON or binary payload into [(device_id, latitude, longitude, readings, received_at), ...]
+    (one entry per reading; received_at is None for 'now'), or None if the message is malformed.
+    """
+    return payload_codec.decode(payload, topic, content_type)
+
+
 def on_message(client, userdata, msg):
-    """ Callback for when a PUBLISH message is received. Handles relational data insertion. """
-    conn = userdata['db_conn']
-    print(f"\n📩 Message received-> Topic: {msg.topic}")
-    
+    """ Callback for when a PUBLISH message is received. Parses it and hands it to the writer queue. """
+    # MQTT 5 publishers can label binary payloads with a content type; 3.1.1 has no properties.
+    content_type = getattr(msg.properties, 'ContentType', None) if msg.properties else None
+    handle_payload(userdata['queue'], msg.topic, msg.payload, content_type, userdata.get('alerts'))
+
+def on_dispatch_message(client, userdata, msg):
+    """ Dispatch mode: forward the raw payload to the worker process that owns its device. """
+    userdata['dispatcher'].dispatch(msg.topic, msg.payload)
+
+def handle_payload(ingest_queue, topic, payload, content_type=None, alerts=None):
+    """ Parse one MQTT payload, put its reading(s) on the writer queue and check them for alerts. """
     try:
-        payload_str = msg.payload.decode()
-        data = json.loads(payload_str)
-        
-        device_id = data.get('device_id')
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        sensor_readings = data.get('sensors', {})
-        
-        if not device_id or not isinstance(sensor_readings, dict):
-            print("❌ Error: Invalid data format. 'device_id' and 'sensors' object required. Ignoring.")
+        parsed = parse_message(payload, topic, content_type)
+        if parsed is None:
+            INVALID_FORMAT.inc()
+            print(f"❌ Error: Invalid data format on {topic}. 'device_id' and a 'sensors' object "
+                  f"(or a 'readings' list of them) required. Ignoring.")
             return
 
-        cursor = conn.cursor()
-
-        # Step 1: UPSERT device metadata into the 'devices' table.
-        # This registers the device or updates its location/last_seen time.
-        sql_upsert_device = """
-            INSERT INTO devices (device_id, latitude, longitude)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE 
-                latitude = VALUES(latitude), 
-                longitude = VALUES(longitude),
-                last_seen = CURRENT_TIMESTAMP;
-        """
-        cursor.execute(sql_upsert_device, (device_id, latitude, longitude))
-        
-        # Step 2: Dynamically prepare the INSERT for the 'readings' table.
-        # This is the magic that handles any type of sensor.
-        columns = ['device_id']
-        values = [device_id]
-        
-        # Define a whitelist of all possible valid sensor keys to prevent junk data
-        allowed_keys = [
-            'temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3',
-            'wind_speed_ms', 'water_level_cm', 'salinity_ppt',
-            'conductivity_us_cm', 'tds_ppm' # <-- ADD THESE TWO KEYS
-        ]
-        
-        for key, value in sensor_readings.items():
-            if key in allowed_keys and value is not None:
-                columns.append(key)
-                values.append(value)
-        
-        # Only proceed if we have at least one valid sensor reading
-        if len(columns) > 1:
-            placeholders = ', '.join(['%s'] * len(values))
-            sql_insert_reading = f"INSERT INTO readings ({', '.join(columns)}) VALUES ({placeholders});"
-            
-            cursor.execute(sql_insert_reading, tuple(values))
-            print(f"✔️ Successfully processed & stored data for device: {device_id}")
-        else:
-            print(f"ℹ️ Message from {device_id} contained no valid sensor readings to store.")
-
-        conn.commit()
-        cursor.close()
-
-    except json.JSONDecodeError:
-        print(f"❌ Error: Received message is not valid JSON. Ignoring.\nPayload: {msg.payload.decode()}")
-    except Error as e:
-        if e.errno == mysql.connector.errorcode.CR_SERVER_GONE_ERROR:
-            print("⚠️ MySQL server connection lost. Reconnecting...")
-            userdata['db_conn'] = db_connect(DB_CONFIG)
-            if userdata['db_conn']:
-                print("✅ Reconnected to MySQL.")
-            else:
-                print("❌ Failed to reconnect to MySQL. Shutting down.")
-                client.loop_stop()
-        else:
-            print(f"❌ Database insertion error: {e}")
+        # No database work happens on the network-loop thread; writer threads commit the
+        # device upsert and reading INSERT in batches.
+        for device_id, latitude, longitude, readings, received_at in parsed:
+            if not readings:
+                print(f"ℹ️ Message from {device_id} contained no valid sensor readings to store.")
+            ingest_queue.put(device_id, latitude, longitude, readings, received_at)
+            if alerts is not None and readings:
+                alerts.evaluate(device_id, readings, received_at)
+
+    except payload_codec.PayloadError as e:
+        INVALID_BINARY.inc()
+        print(f"❌ Error: Invalid binary payload on {topic}: {e}. Ignoring.")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        INVALID_JSON.inc()
+        print(f"❌ Error: Received message is not valid JSON. Ignoring.\nPayload: {payload!r}")
     except Exception as e:
+        UNEXPECTED_ERROR.inc()
         print(f"❌ An unexpected error occurred: {e}")
 
-if __name__ == '__main__':
-    # (The __main__ block is identical to the previous version)
+def pipeline_stats(pool, alerts):
+    return {**pool.stats(), **alerts.stats()} if alerts is not None else pool.stats()
+
+def report_stats(pool, alerts, stop_event):
+    """ Periodically print queue depth, drop count, enqueue-to-commit latency, spool backlog and alerts. """
+    collector = StatsCollector(None, STATS_FILE or None)
+    while not stop_event.wait(STATS_INTERVAL_SECONDS):
+        stats = pipeline_stats(pool, alerts)
+        print(f"📈 Ingest stats: {stats}")
+        if STATS_FILE:
+            collector.record(0, os.getpid(), stats)
+
+def start_pipeline(spool_dir):
+    """ Spool, device registry, queue and writer threads of one ingestion process. """
+    spool = SegmentSpool(spool_dir, segment_bytes=SPOOL_SEGMENT_MB << 20, fsync=SPOOL_FSYNC)
+
+    # Writers open their own connections below. If the database is unreachable the listener
+    # still starts and spools everything until MySQL is back.
+    device_registry = DeviceRegistry(DEVICE_STALE_SECONDS)
     db_connection = db_connect(DB_CONFIG)
     if db_connection is None:
-        print("Could not connect to the database. Exiting.")
-        exit()
+        print("⚠️ Could not connect to the database. Spooling readings to disk until it is reachable.")
+    else:
+        print(f"🗂️ Loaded {device_registry.load(db_connection)} known devices (last_seen refreshed every {DEVICE_STALE_SECONDS}s).")
+        db_connection.close()
 
-    client_userdata = {'db_conn': db_connection}
-    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id="relational-ingestion-service", userdata=client_userdata)
-    
+    ingest_queue = IngestQueue(QUEUE_MAX_SIZE, QUEUE_POLICY, spool)
+    # Writers and the replayer reconnect with a single attempt: while MySQL is down they must
+    # not stall for the full retry loop, the spool absorbs the readings instead.
+    writer_pool = WriterPool(ingest_queue, lambda: db_connect(DB_CONFIG, attempts=1), workers=WRITER_THREADS,
+                             batch_rows=BATCH_MAX_ROWS, batch_delay_ms=BATCH_MAX_DELAY_MS,
+                             registry=device_registry, rollups=MAINTAIN_ROLLUPS,
+                             spool=spool, replay_batch_rows=REPLAY_BATCH_ROWS).start()
+    metrics.REGISTRY.register_collector(writer_pool.metric_families)
+    print(f"📦 {WRITER_THREADS} writer thread(s), batches of up to {BATCH_MAX_ROWS} messages or {BATCH_MAX_DELAY_MS} ms, "
+          f"queue of {QUEUE_MAX_SIZE} ({QUEUE_POLICY} when full), spool in '{spool_dir}' "
+          f"({spool.stats()['spool_records']} readings waiting).")
+    return ingest_queue, writer_pool
+
+def start_alerting(client_id):
+    """
+    Rule engine of one ingestion process, with the sink that stores and publishes its alerts
+    over a publish-only MQTT session. Returns (engine, publisher), or (None, None) when
+    alerting is off or the rules cannot be loaded; ingestion runs either way.
+    """
+    if not ALERTS_ENABLED:
+        return None, None
+    try:
+        rules = alert_engine.load_rules(ALERT_RULES_FILE)
+    except (OSError, ValueError) as e:
+        print(f"❌ Alerting disabled, could not load rules from '{ALERT_RULES_FILE}': {e}")
+        return None, None
+
+    publisher = mqtt.Client(CallbackAPIVersion.VERSION2, client_id=client_id)
+    publisher.connect_async(MQTT_BROKER_IP, MQTT_PORT, 60)
+    publisher.loop_start()      # reconnects by itself; QoS 1 alerts are queued meanwhile
+    sink = AlertSink(lambda: db_connect(DB_CONFIG, attempts=1),
+                     lambda topic, payload: publisher.publish(topic, payload, qos=1),
+                     ALERT_TOPIC_PREFIX).start()
+    engine = AlertEngine(rules, sink)
+    metrics.REGISTRY.register_collector(engine.metric_families)
+    print(f"🚨 {len(rules)} alert rule(s) from {ALERT_RULES_FILE or 'the defaults'}, "
+          f"alerts published on {ALERT_TOPIC_PREFIX}/<device_id>.")
+    return engine, publisher
+
+def stop_alerting(engine, publisher):
+    """ Store and publish the alerts still queued, then close the publisher session. """
+    if engine is None:
+        return
+    engine.sink.stop()
+    publisher.disconnect()
+    publisher.loop_stop()
+
+def start_metrics_server(registry):
+    """ Serve /metrics on METRICS_PORT; ingestion carries on without it if the port is taken. """
+    try:
+        metrics.serve_metrics(METRICS_PORT, registry)
+        print(f"📊 Metrics on http://0.0.0.0:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"⚠️ Could not serve metrics on port {METRICS_PORT}: {e}")
+
+def make_client(client_id, topic, userdata, on_message_callback):
+    userdata['topic'] = topic
+    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id=client_id, userdata=userdata)
     client.on_connect = on_connect
-    client.on_message = on_message
+    client.on_message = on_message_callback
+    return client
+
+
+# --- Multi-process mode (INGEST_WORKERS > 1) ---
+def run_worker(index, inbox, stats_queue, stop_event):
+    """ Body of one worker process: its own spool, queue and writer threads. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # the parent coordinates shutdown
+    ingest_queue, writer_pool = start_pipeline(os.path.join(SPOOL_DIR, f"worker-{index}"))
+    # In shared mode a device's readings may reach any worker, so its rolling (rate, z-score)
+    # state is split between them; dispatch mode keeps each device on one worker.
+    alerts, publisher = start_alerting(f"{MQTT_CLIENT_ID}-alerts-{index}")
+
+    def publish_stats():
+        families = metrics.REGISTRY.collect() if METRICS_PORT else None
+        stats_queue.put((index, os.getpid(), pipeline_stats(writer_pool, alerts), families))
+
+    # With metrics enabled the parent needs fresher numbers than the periodic stats line.
+    report_every = min(STATS_INTERVAL_SECONDS or METRICS_PUSH_SECONDS, METRICS_PUSH_SECONDS) if METRICS_PORT \
+        else STATS_INTERVAL_SECONDS
+
+    client = None
+    try:
+        if inbox is None:
+            # Shared subscription: the broker hands this session its share of the messages.
+            client = make_client(f"{MQTT_CLIENT_ID}-{index}", f"$share/{SHARE_GROUP}/{MQTT_TOPIC_TO_SUBSCRIBE}",
+                                 {'queue': ingest_queue, 'alerts': alerts}, on_message)
+            client.connect(MQTT_BROKER_IP, MQTT_PORT, 60)
+            client.loop_start()
+            publish_stats()
+            while not stop_event.wait(report_every or 1):
+                if report_every:
+                    publish_stats()
+        else:
+            publish_stats()
+            next_report = time.monotonic() + report_every
+            while True:
+                try:
+                    batch = inbox.get(timeout=1)
+                except queue.Empty:
+                    if stop_event.is_set():
+                        break   # the parent is stopping and the dispatcher never closed
+                    batch = []
+                if batch is None:
+                    break       # the dispatcher has closed
+                for topic, payload in batch:
+                    handle_payload(ingest_queue, topic, payload, alerts=alerts)
+                if report_every and time.monotonic() >= next_report:
+                    next_report = time.monotonic() + report_every
+                    publish_stats()
+    except Exception as e:
+        print(f"❌ Ingest worker {index} failed: {e}")
+        raise
+    finally:
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+        writer_pool.stop()
+        stop_alerting(alerts, publisher)
+        publish_stats()
+
+def run_workers():
+    """ Parent process of the multi-process mode: supervises the workers and reports their stats. """
+    supervisor = WorkerSupervisor(run_worker, WORKER_PROCESSES, WORKER_MODE, inbox_size=QUEUE_MAX_SIZE).start()
+    collector = StatsCollector(supervisor.stats_queue, STATS_FILE or None)
+    print(f"🧵 Started {WORKER_PROCESSES} ingest worker processes ({WORKER_MODE} mode).")
+    if METRICS_PORT:
+        # Only the workers' metrics (labelled worker="<n>") plus the supervisor's own.
+        registry = metrics.Registry()
+        registry.register_collector(collector.metric_families)
+        registry.register_collector(lambda: [
+            metrics.family('ingest_worker_restarts_total', 'counter', "Worker processes restarted after dying.",
+                           supervisor.restarts)])
+        start_metrics_server(registry)
+
+    client, dispatcher = None, None
+    try:
+        if WORKER_MODE == 'dispatch':
+            dispatcher = ShardDispatcher(supervisor.inboxes).start()
+            client = make_client(MQTT_CLIENT_ID, MQTT_TOPIC_TO_SUBSCRIBE, {'dispatcher': dispatcher},
+                                 on_dispatch_message)
+            client.connect(MQTT_BROKER_IP, MQTT_PORT, 60)
+            client.loop_start()
+        print("🚀 MQTT Ingestion Service started. Waiting for messages...")
+        next_report = time.monotonic() + STATS_INTERVAL_SECONDS
+        while True:
+            collector.poll(timeout=1)
+            supervisor.check()
+            if STATS_INTERVAL_SECONDS and time.monotonic() >= next_report:
+                next_report = time.monotonic() + STATS_INTERVAL_SECONDS
+                print(collector.report())
+    except ConnectionRefusedError:
+        print("\n❌ Connection to MQTT Broker was refused. Is Mosquitto running?")
+    except KeyboardInterrupt:
+        print("\n🛑 MQTT Ingestion Service stopping.")
+    finally:
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+        if dispatcher is not None:
+            dispatcher.close()
+        supervisor.stop()
+        collector.poll()
+        print(f"💾 Workers drained. Final ingest stats:\n{collector.report()}")
+
+def run_single():
+    """ Everything in this process: the MQTT network loop plus the writer threads. """
+    ingest_queue, writer_pool = start_pipeline(SPOOL_DIR)
+    alerts, publisher = start_alerting(f"{MQTT_CLIENT_ID}-alerts")
+    if METRICS_PORT:
+        start_metrics_server(metrics.REGISTRY)
+
+    stats_stop = threading.Event()
+    if STATS_INTERVAL_SECONDS > 0:
+        threading.Thread(target=report_stats, args=(writer_pool, alerts, stats_stop), daemon=True).start()
+
+    client = make_client(MQTT_CLIENT_ID, MQTT_TOPIC_TO_SUBSCRIBE, {'queue': ingest_queue, 'alerts': alerts}, on_message)
     
     try:
         client.connect(MQTT_BROKER_IP, MQTT_PORT, 60)
@@ -150,5 +385,20 @@ if __name__ == '__main__':
         client.loop_forever()
     except ConnectionRefusedError:
         print("\n❌ Connection to MQTT Broker was refused. Is Mosquitto running?")
+    except KeyboardInterrupt:
+        print("\n🛑 MQTT Ingestion Service stopping.")
     except Exception as e:
-        print(f"\n❌ A critical error occurred: {e}")
\ No newline at end of file
+        print(f"\n❌ A critical error occurred: {e}")
+    finally:
+        # Flush-on-shutdown: writers drain everything still queued (to MySQL or the spool) before exiting.
+        stats_stop.set()
+        writer_pool.stop()
+        stop_alerting(alerts, publisher)
+        print(f"💾 Writers drained. Final ingest stats: {pipeline_stats(writer_pool, alerts)}")
+
+
+if __name__ == '__main__':
+    if WORKER_PROCESSES > 1:
+        run_workers()
+    else:
+        run_single()
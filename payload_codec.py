@@ -0,0 +1,228 @@
+# File: payload_codec.py
+# Description: Decoding of sensor node payloads for the MQTT listener. Three kinds are accepted:
+#                JSON single  - {"device_id", "latitude", "longitude", "sensors": {...}} as the
+#                               sketches in sensor_nodes/ send today (optional "ts")
+#                JSON batch   - the same envelope with "readings": [{"ts": ..., "sensors": {...}}, ...]
+#                binary       - the compact layout below, one or many readings per publish
+#              Binary payloads are recognised by their magic bytes, by the topic ending in
+#              BINARY_TOPIC_SUFFIX (e.g. iot/data/air/bin) or by an MQTT 5 content type of
+#              BINARY_CONTENT_TYPE; everything else is parsed as JSON.
+#
+#              Binary layout, version 1 (little-endian, as written by an ESP32):
+#                'SN'  u8 version=1  u8 flags  u8 N  N bytes device_id (UTF-8)
+#                [f32 latitude  f32 longitude]          if flags & FLAG_LOCATION
+#                u16 metric mask  u16 reading count R    bit i of the mask = SENSOR_FIELDS[i]
+#                R x (u32 timestamp, one f32 per mask bit; NaN = not measured)
+#              A single air reading is 55 bytes against ~240 for the JSON the sketch builds.
+#
+#              Timestamps ("ts" in JSON, u32 in binary): 0 or absent = time of receipt,
+#              below 1e9 = seconds before receipt (nodes without a clock), otherwise unix seconds.
+#              A negative or non-finite "ts" is invalid and also means time of receipt.
+#
+#              Sensor values must be finite: JSON NaN/Infinity values are left out like nulls,
+#              and a binary payload with an infinite value is rejected (PayloadError).
+#              A latitude/longitude that is not a number within +-90/+-180 becomes None
+#              (location unknown); the readings of the message are still stored.
+
+import datetime
+import json
+import math
+import struct
+import time
+
+MAGIC = b'SN'
+BINARY_VERSION = 1
+BINARY_CONTENT_TYPE = 'application/x-sensor-readings'
+BINARY_TOPIC_SUFFIX = '/bin'
+FLAG_LOCATION = 0x01
+
+# Wire order of the binary metric mask: never reorder, append new metrics at the end.
+SENSOR_FIELDS = (
+    'temperature_c', 'humidity_pct', 'pm2_5_ug_m3', 'pm10_ug_m3', 'wind_speed_ms',
+    'water_level_cm', 'salinity_ppt', 'conductivity_us_cm', 'tds_ppm',
+)
+# Whitelist of valid sensor keys, to keep junk data out of the readings table.
+ALLOWED_SENSOR_KEYS = frozenset(SENSOR_FIELDS)
+
+MAX_READINGS_PER_PAYLOAD = 1000
+MAX_DEVICE_ID_LENGTH = 255      # devices.device_id is VARCHAR(255)
+MAX_CLOCK_SKEW_SECONDS = 300    # timestamps further in the future are replaced by the receive time
+RELATIVE_TIMESTAMP_LIMIT = 1000000000
+# The readings columns are DECIMAL(n, 2), so float32 noise (28.4 -> 28.399999618...) is rounded
+# off. round(v * 100) / 100 gives the same double as round(v, 2) at a fraction of the cost.
+DECIMAL_SCALE = 100
+LOCATION_SCALE = 1000000
+
+_HEADER = struct.Struct('<2sBBB')       # magic, version, flags, device_id length
+_LOCATION = struct.Struct('<ff')
+_COUNTS = struct.Struct('<HH')          # metric mask, reading count
+_layouts = {}                           # metric mask -> (field names, Struct of one reading)
+
+
+class PayloadError(ValueError):
+    """ A binary payload that does not follow the layout. """
+
+
+def reading_time(timestamp, received):
+    """ Naive local datetime for a payload timestamp (see the header), or None for 'when received'. """
+    if not timestamp or timestamp < 0 or not math.isfinite(timestamp):
+        return None
+    if timestamp < RELATIVE_TIMESTAMP_LIMIT:
+        return datetime.datetime.fromtimestamp(received - timestamp)
+    if timestamp > received + MAX_CLOCK_SKEW_SECONDS:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def coordinate(value, limit):
+    """ A latitude (limit 90) or longitude (limit 180) as a float, or None if it is missing or invalid. """
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and -limit <= value <= limit else None
+
+
+# --- JSON ---
+def _sensors(sensor_readings):
+    # json.loads() accepts NaN and Infinity, which no DECIMAL column (or alert rule) can take.
+    return {key: value for key, value in sensor_readings.items()
+            if key in ALLOWED_SENSOR_KEYS and value is not None
+            and not (isinstance(value, float) and not math.isfinite(value))}
+
+
+def _json_time(timestamp, received):
+    return reading_time(timestamp, received) if isinstance(timestamp, (int, float)) else None
+
+
+def decode_json(payload):
+    """
+    [(device_id, latitude, longitude, readings, received_at), ...] from a JSON payload, or None
+    if it lacks a device_id (a non-empty string) or its sensors. Raises ValueError/UnicodeDecodeError
+    for bad JSON.
+    """
+    data = json.loads(payload.decode())
+    if not isinstance(data, dict):
+        return None
+    device_id = data.get('device_id')
+    if not isinstance(device_id, str) or not device_id or len(device_id) > MAX_DEVICE_ID_LENGTH:
+        return None
+    latitude, longitude = coordinate(data.get('latitude'), 90), coordinate(data.get('longitude'), 180)
+
+    batch = data.get('readings')
+    if batch is None:
+        sensor_readings = data.get('sensors', {})
+        if not isinstance(sensor_readings, dict):
+            return None
+        received_at = _json_time(data.get('ts'), time.time()) if 'ts' in data else None
+        return [(device_id, latitude, longitude, _sensors(sensor_readings), received_at)]
+
+    if not isinstance(batch, list) or len(batch) > MAX_READINGS_PER_PAYLOAD:
+        return None
+    received = time.time()
+    messages = []
+    for entry in batch:
+        sensor_readings = entry.get('sensors') if isinstance(entry, dict) else None
+        if not isinstance(sensor_readings, dict):
+            return None
+        messages.append((device_id, latitude, longitude, _sensors(sensor_readings),
+                         _json_time(entry.get('ts'), received)))
+    return messages
+
+
+# --- Binary ---
+def _layout(mask):
+    """ Field names and the Struct of one reading (u32 timestamp + one f32 per field) for a metric mask. """
+    layout = _layouts.get(mask)
+    if layout is None:
+        if mask >> len(SENSOR_FIELDS):
+            raise PayloadError(f"unknown metric bits in mask {mask:#06x}")
+        fields = tuple(f for i, f in enumerate(SENSOR_FIELDS) if mask >> i & 1)
+        layout = _layouts[mask] = (fields, struct.Struct('<I' + 'f' * len(fields)))
+    return layout
+
+
+def decode_binary(payload):
+    """ Like decode_json() for the binary layout; raises PayloadError if the payload does not follow it. """
+    try:
+        magic, version, flags, id_length = _HEADER.unpack_from(payload, 0)
+        if magic != MAGIC:
+            raise PayloadError("missing 'SN' magic")
+        if version != BINARY_VERSION:
+            raise PayloadError(f"unsupported version {version}")
+        if not id_length:
+            raise PayloadError("empty device_id")
+        offset = _HEADER.size + id_length
+        device_id = payload[_HEADER.size:offset].decode()
+        latitude = longitude = None
+        if flags & FLAG_LOCATION:
+            latitude, longitude = _LOCATION.unpack_from(payload, offset)
+            # NaN (no fix) or out of range: the location is unknown, the readings are still good.
+            latitude, longitude = coordinate(latitude, 90), coordinate(longitude, 180)
+            if latitude is not None:
+                latitude = round(latitude * LOCATION_SCALE) / LOCATION_SCALE
+            if longitude is not None:
+                longitude = round(longitude * LOCATION_SCALE) / LOCATION_SCALE
+            offset += _LOCATION.size
+        mask, count = _COUNTS.unpack_from(payload, offset)
+        offset += _COUNTS.size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise PayloadError(f"truncated or malformed header: {e}")
+
+    fields, record = _layout(mask)
+    if count > MAX_READINGS_PER_PAYLOAD:
+        raise PayloadError(f"{count} readings in one payload (at most {MAX_READINGS_PER_PAYLOAD})")
+    if len(payload) - offset != count * record.size:
+        raise PayloadError(f"{len(payload) - offset} bytes of readings, expected {count} x {record.size}")
+
+    received = time.time()
+    messages = []
+    for offset in range(offset, len(payload), record.size):
+        timestamp, *values = record.unpack_from(payload, offset)
+        if math.inf in values or -math.inf in values:
+            raise PayloadError(f"infinite value in reading {len(messages) + 1}")
+        readings = {field: round(value * DECIMAL_SCALE) / DECIMAL_SCALE
+                    for field, value in zip(fields, values) if value == value}     # NaN: not measured
+        messages.append((device_id, latitude, longitude, readings, reading_time(timestamp, received)))
+    return messages
+
+
+def binary_device_id(payload):
+    """ device_id bytes from a binary header (b'' if malformed), for sharding without a full decode. """
+    try:
+        _, _, _, id_length = _HEADER.unpack_from(payload, 0)
+    except struct.error:
+        return b''
+    return bytes(payload[_HEADER.size:_HEADER.size + id_length])
+
+
+def is_binary(payload, topic='', content_type=None):
+    return payload[:2] == MAGIC or content_type == BINARY_CONTENT_TYPE or topic.endswith(BINARY_TOPIC_SUFFIX)
+
+
+def decode(payload, topic='', content_type=None):
+    """ Messages of one MQTT payload in whichever encoding it uses (see the header). """
+    if payload[:1] != b'{' and is_binary(payload, topic, content_type):     # JSON objects skip the checks
+        return decode_binary(payload)
+    return decode_json(payload)
+
+
+def encode_binary(device_id, readings, latitude=None, longitude=None):
+    """
+    Binary payload for [(timestamp, {field: value}), ...]; the inverse of decode_binary(),
+    for simulators, benchmarks and as a reference for firmware.
+    """
+    present = set().union(*(values for _, values in readings)) if readings else set()
+    mask = sum(1 << i for i, field in enumerate(SENSOR_FIELDS) if field in present)
+    fields, record = _layout(mask)
+    device = device_id.encode()
+    parts = [_HEADER.pack(MAGIC, BINARY_VERSION, FLAG_LOCATION if latitude is not None else 0, len(device)), device]
+    if latitude is not None:
+        parts.append(_LOCATION.pack(latitude, longitude))
+    parts.append(_COUNTS.pack(mask, len(readings)))
+    nan = float('nan')
+    for timestamp, values in readings:
+        parts.append(record.pack(int(timestamp or 0), *(nan if values.get(f) is None else values[f] for f in fields)))
+    return b''.join(parts)
@@ -0,0 +1,263 @@
+# File: readings_stats.py
+# Description: Per-device, per-metric statistics over a time window for the /stats endpoint
+#              of data hook api.py: count, min, max, mean and (population) stddev, plus
+#              percentiles, either for the whole window or per fixed-size bucket.
+#
+#              Two engines compute the same numbers:
+#                sql    - everything but percentiles is pushed down into one GROUP BY query,
+#                         so only one row per device and bucket leaves MySQL
+#                numpy  - raw values are read in fetch batches into float64 columns (NaN for
+#                         NULL) and each metric is reduced with one sort plus reduceat(), which
+#                         is what percentiles need; memory is ~8 bytes per value in the window
+#              The numpy engine needs numpy (`pip install numpy`); without it a request
+#              defaults to no percentiles and explicit percentiles are refused.
+
+import datetime
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from latest_cache import METRIC_COLUMNS
+
+ENGINES = ('sql', 'numpy')
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+MAX_BUCKETS = 10000     # per device; keeps a response (and the numpy group keys) bounded
+# Largest (group key * value span) still sorted as one float64 key: rounding stays below 0.001,
+# well under the 0.01 resolution of the DECIMAL columns. Beyond it numpy.lexsort() is used.
+_COMPOSITE_KEY_LIMIT = 2.0 ** 43
+
+_BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_BUCKET_PATTERN = re.compile(r'^(\d+)([smhd])$')
+
+
+# --- Request arguments ---
+def parse_window(start, end):
+    """
+    Half-open [start, end) datetimes from YYYY-MM-DD or YYYY-MM-DDTHH:MM[:SS] strings.
+    A bare end date includes that whole day, as end_date does for /readings.
+    """
+    try:
+        first = datetime.datetime.fromisoformat(start or '')
+        last = datetime.datetime.fromisoformat(end or '')
+    except ValueError:
+        raise ValueError("start_date and end_date are required (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS).")
+    if len(end) == 10:
+        last += datetime.timedelta(days=1)
+    if last <= first:
+        raise ValueError("end_date is before start_date.")
+    return first, last
+
+
+def parse_bucket(text, start, end):
+    """ Bucket length in seconds for '90s', '15m', '1h', '1d', ...; None for 'all' (the whole window). """
+    if not text or text == 'all':
+        return None
+    match = _BUCKET_PATTERN.match(text)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("bucket must be 'all' or a length such as 300s, 15m, 1h or 1d.")
+    seconds = int(match.group(1)) * _BUCKET_UNITS[match.group(2)]
+    if (end - start).total_seconds() / seconds > MAX_BUCKETS:
+        raise ValueError(f"bucket is too small for this window (at most {MAX_BUCKETS} buckets).")
+    return seconds
+
+
+def parse_metrics(text):
+    if not text:
+        return METRIC_COLUMNS
+    metrics = tuple(m for m in text.split(',') if m)
+    unknown = [m for m in metrics if m not in METRIC_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown metric(s) {', '.join(unknown)}; expected some of {', '.join(METRIC_COLUMNS)}.")
+    return metrics
+
+
+def parse_percentiles(text):
+    """
+    Percentiles (0-100) from '50,90,99'; an empty value asks for none. When absent, the
+    default is DEFAULT_PERCENTILES with numpy installed and none (the sql engine) without.
+    """
+    if text is None:
+        return DEFAULT_PERCENTILES if numpy is not None else ()
+    try:
+        percentiles = tuple(sorted({float(p) for p in text.split(',') if p}))
+    except ValueError:
+        raise ValueError("percentiles must be numbers between 0 and 100, e.g. 50,90,99.")
+    if any(p < 0 or p > 100 for p in percentiles):
+        raise ValueError("percentiles must be numbers between 0 and 100, e.g. 50,90,99.")
+    return percentiles
+
+
+def choose_engine(requested, percentiles):
+    """ 'sql' unless percentiles are wanted; raises ValueError for a combination that cannot be served. """
+    engine = requested or ('numpy' if percentiles else 'sql')
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}.")
+    if engine == 'sql' and percentiles:
+        raise ValueError("percentiles are computed by the numpy engine; pass percentiles= with engine=sql.")
+    if engine == 'numpy' and numpy is None:
+        raise ValueError("percentiles and engine=numpy need numpy (pip install numpy); pass percentiles= "
+                         "for count/min/max/mean/stddev from MySQL.")
+    return engine
+
+
+# --- Queries ---
+def _where(device_ids, start, end):
+    where = ["created_at >= %s", "created_at < %s"]
+    params = [start, end]
+    if device_ids:
+        where.append(f"device_id IN ({', '.join(['%s'] * len(device_ids))})")
+        params += list(device_ids)
+    return ' AND '.join(where), params
+
+
+def aggregate_query(device_ids, metrics, start, end, bucket_seconds):
+    """ SQL and params for the sql engine: one row per device and bucket with every aggregate. """
+    where, params = _where(device_ids, start, end)
+    aggregates = ', '.join(f"COUNT({m}), MIN({m}), MAX({m}), AVG({m}), STDDEV_POP({m})" for m in metrics)
+    if bucket_seconds:
+        bucket = "FLOOR(TIMESTAMPDIFF(SECOND, %s, created_at) / %s)"
+        params = [start, bucket_seconds] + params
+        group_by = "device_id, bucket"
+    else:
+        bucket, group_by = "0", "device_id"
+    sql = (f"SELECT device_id, {bucket} AS bucket, {aggregates} FROM readings "
+           f"WHERE {where} GROUP BY {group_by} ORDER BY {group_by}")
+    return sql, tuple(params)
+
+
+def columns_query(device_ids, metrics, start, end):
+    """
+    SQL and params for the numpy engine: device, seconds since `start` and each metric as a
+    DOUBLE (`+ 0E0`), so the connector hands back floats instead of building Decimals.
+    """
+    where, params = _where(device_ids, start, end)
+    values = ', '.join(f"{m} + 0E0" for m in metrics)
+    sql = f"SELECT device_id, TIMESTAMPDIFF(SECOND, %s, created_at), {values} FROM readings WHERE {where}"
+    return sql, tuple([start] + params)
+
+
+# --- Results ---
+def _group(results, device_id, bucket, start, bucket_seconds):
+    key = (device_id, bucket)
+    group = results.get(key)
+    if group is None:
+        bucket_start = start + datetime.timedelta(seconds=bucket * bucket_seconds) if bucket_seconds else start
+        group = results[key] = {'device_id': device_id, 'bucket_start': bucket_start, 'metrics': {}}
+    return group
+
+
+def _number(value):
+    return None if value is None else round(float(value), 4)
+
+
+def from_aggregate_rows(rows, metrics, start, bucket_seconds):
+    """ Rows of aggregate_query() -> response groups, ordered by device and bucket. """
+    results = {}
+    for device_id, bucket, *values in rows:
+        for i, metric in enumerate(metrics):
+            count, low, high, mean, stddev = values[5 * i:5 * i + 5]
+            if not count:
+                continue
+            group = _group(results, device_id, int(bucket), start, bucket_seconds)
+            group['metrics'][metric] = {'count': count, 'min': _number(low), 'max': _number(high),
+                                        'mean': _number(mean), 'stddev': _number(stddev)}
+    return list(results.values())
+
+
+class ColumnBatches:
+    """ Fetch batches of columns_query() rows gathered into numpy columns. """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.device_ids = {}        # device_id -> integer code
+        self.rows = 0
+        self._codes, self._offsets = [], []
+        self._values = {metric: [] for metric in metrics}
+
+    def add(self, rows):
+        device_ids, offsets, *values = zip(*rows)
+        codes = self.device_ids
+        self._codes.append(numpy.fromiter((codes.setdefault(d, len(codes)) for d in device_ids),
+                                          numpy.int64, len(rows)))
+        self._offsets.append(numpy.array(offsets, dtype=numpy.int64))
+        for metric, column in zip(self.metrics, values):
+            try:
+                floats = numpy.fromiter(column, numpy.float64, len(column))
+            except TypeError:
+                floats = numpy.array(column, dtype=numpy.float64)   # has NULLs: None -> NaN, slower
+            self._values[metric].append(floats)
+        self.rows += len(rows)
+
+    def columns(self):
+        """ (device codes, seconds since start, {metric: float64 values with NaN for NULL}). """
+        if not self.rows:
+            empty = numpy.empty(0)
+            return empty.astype(numpy.int64), empty.astype(numpy.int64), {m: empty for m in self.metrics}
+        return (numpy.concatenate(self._codes), numpy.concatenate(self._offsets),
+                {metric: numpy.concatenate(parts) for metric, parts in self._values.items()})
+
+
+def _group_order(keys, values):
+    """
+    Indexes that sort by (key, value). One argsort of key * span + value is several times
+    faster than numpy.lexsort() on two columns, and exact while the composite stays small.
+    """
+    low, high = values.min(), values.max()
+    span = (high - low) + 1.0
+    if (float(keys.max()) + 1.0) * span >= _COMPOSITE_KEY_LIMIT:
+        return numpy.lexsort((values, keys))
+    return numpy.argsort(keys * span + (values - low))
+
+
+def summarize(device_ids, codes, offsets, values, start, end, bucket_seconds, percentiles):
+    """
+    Reduce numpy columns to response groups. Per metric the non-NULL values are sorted by
+    (group, value) once; group boundaries then give count/min/max directly, sum and the
+    squared deviations come from reduceat(), and percentiles interpolate linearly between
+    the two nearest ranks (numpy.percentile's default) without a per-group loop.
+    """
+    names = [None] * len(device_ids)
+    for device_id, code in device_ids.items():
+        names[code] = device_id
+    buckets_per_device = 1
+    keys = codes
+    if bucket_seconds:
+        buckets_per_device = int(-(-(end - start).total_seconds() // bucket_seconds))
+        keys = codes * buckets_per_device + offsets // bucket_seconds
+
+    results = {}
+    for metric, column in values.items():
+        present = ~numpy.isnan(column)
+        group_keys, group_values = keys[present], column[present]
+        if not len(group_values):
+            continue
+        order = _group_order(group_keys, group_values)
+        group_keys, group_values = group_keys[order], group_values[order]
+        firsts = numpy.flatnonzero(numpy.concatenate(([True], group_keys[1:] != group_keys[:-1])))
+        counts = numpy.diff(numpy.append(firsts, len(group_keys)))
+        means = numpy.add.reduceat(group_values, firsts) / counts
+        deviations = group_values - numpy.repeat(means, counts)
+        stddevs = numpy.sqrt(numpy.add.reduceat(deviations * deviations, firsts) / counts)
+        lasts = firsts + counts - 1
+        quantiles = []
+        for p in percentiles:
+            rank = (counts - 1) * (p / 100.0)
+            below = numpy.floor(rank).astype(numpy.int64)
+            above = numpy.minimum(below + 1, counts - 1)
+            low, high = group_values[firsts + below], group_values[firsts + above]
+            quantiles.append((f"p{p:g}", low + (high - low) * (rank - below)))
+
+        stats = zip(group_keys[firsts].tolist(), counts.tolist(), group_values[firsts].tolist(),
+                    group_values[lasts].tolist(), means.tolist(), stddevs.tolist(),
+                    *(q.tolist() for _, q in quantiles))
+        for key, count, low, high, mean, stddev, *points in stats:
+            device, bucket = divmod(key, buckets_per_device)
+            group = _group(results, names[device], bucket, start, bucket_seconds)
+            entry = {'count': count, 'min': _number(low), 'max': _number(high),
+                     'mean': _number(mean), 'stddev': _number(stddev)}
+            entry.update((name, _number(point)) for (name, _), point in zip(quantiles, points))
+            group['metrics'][metric] = entry
+    return sorted(results.values(), key=lambda g: (g['device_id'], g['bucket_start']))
@@ -0,0 +1,144 @@
+# File: rollups.py
+# Description: Incrementally maintained per-device rollups (migration 003).
+#              Ingestion side: rollup_upserts() turns one batch of raw rows into one multi-row
+#              INSERT ... ON DUPLICATE KEY UPDATE per rollup table, merging min/max/sum/count
+#              into the existing bucket rows inside the batch's transaction.
+#              Query side: choose_resolution() and rollup_query() back the
+#              /readings?resolution=raw|1m|1h|1d|auto parameter in data hook api.py.
+
+import datetime
+import math
+
+from latest_cache import METRIC_COLUMNS
+
+# resolution -> (table, bucket length in seconds), finest first
+RESOLUTIONS = {
+    '1m': ('readings_1m', 60),
+    '1h': ('readings_1h', 3600),
+    '1d': ('readings_1d', 86400),
+}
+
+_AGG_COLUMNS = [f"{m}_{part}" for m in METRIC_COLUMNS for part in ('min', 'max', 'sum', 'count')]
+
+
+def bucket_start(ts, seconds):
+    if seconds == 60:
+        return ts.replace(second=0, microsecond=0)
+    if seconds == 3600:
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _upsert_sql(table):
+    columns = ['device_id', 'bucket_start', 'samples'] + _AGG_COLUMNS
+    updates = ['samples = samples + VALUES(samples)']
+    for m in METRIC_COLUMNS:
+        # LEAST/GREATEST return NULL if either side is NULL, hence the COALESCE on both sides.
+        updates.append(f"{m}_min = LEAST(COALESCE({m}_min, VALUES({m}_min)), COALESCE(VALUES({m}_min), {m}_min))")
+        updates.append(f"{m}_max = GREATEST(COALESCE({m}_max, VALUES({m}_max)), COALESCE(VALUES({m}_max), {m}_max))")
+        updates.append(f"{m}_sum = {m}_sum + VALUES({m}_sum)")
+        updates.append(f"{m}_count = {m}_count + VALUES({m}_count)")
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+
+
+UPSERT_SQL = {resolution: _upsert_sql(table) for resolution, (table, _) in RESOLUTIONS.items()}
+
+
+def rollup_upserts(groups):
+    """
+    Aggregate a batch of raw rows, given as ReadingBatcher groups
+    {(device_id, created_at, metric, ...): [row tuple, ...]}, into
+    [(sql, [params, ...]), ...] with one entry per rollup table.
+    """
+    statements = []
+    for resolution, (_, seconds) in RESOLUTIONS.items():
+        buckets = {}    # (device_id, bucket_start) -> [samples, {metric: [min, max, sum, count]}]
+        for columns, rows in groups.items():
+            metric_positions = [(i, columns[i]) for i in range(2, len(columns))]
+            for row in rows:
+                key = (row[0], bucket_start(row[1], seconds))
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = [0, {}]
+                bucket[0] += 1
+                for i, metric in metric_positions:
+                    try:
+                        value = float(row[i])
+                    except (TypeError, ValueError):
+                        continue    # left for MySQL to accept or reject in the raw INSERT
+                    agg = bucket[1].get(metric)
+                    if agg is None:
+                        bucket[1][metric] = [value, value, value, 1]
+                    else:
+                        agg[0] = min(agg[0], value)
+                        agg[1] = max(agg[1], value)
+                        agg[2] += value
+                        agg[3] += 1
+        params = []
+        # Sorted so concurrent writers lock bucket rows in the same order.
+        for (device_id, start), (samples, aggs) in sorted(buckets.items(),
+                                                          key=lambda item: (str(item[0][0]), item[0][1])):
+            values = [device_id, start, samples]
+            for m in METRIC_COLUMNS:
+                values += aggs.get(m, [None, None, 0.0, 0])
+            params.append(tuple(values))
+        statements.append((UPSERT_SQL[resolution], params))
+    return statements
+
+
+# --- Query side ---
+def choose_resolution(start, end, max_points):
+    """
+    Finest rollup whose bucket count over [start, end) fits in `max_points`; falls back to the
+    coarsest one. Returns 'raw' if the range is unbounded.
+    """
+    if start is None or end is None:
+        return 'raw'
+    span = max(1.0, (end - start).total_seconds())
+    for resolution, (_, seconds) in RESOLUTIONS.items():
+        if math.ceil(span / seconds) <= max_points:
+            return resolution
+    return list(RESOLUTIONS)[-1]
+
+
+def rollup_query(resolution, device_id=None, start_date=None, end_date=None, order='DESC', limit=None):
+    """ SQL and params returning one row per (device, bucket) with min/max/avg/count per metric. """
+    table, _ = RESOLUTIONS[resolution]
+    metrics = ',\n               '.join(
+        f"r.{m}_min AS {m}_min, r.{m}_max AS {m}_max, "
+        f"r.{m}_sum / NULLIF(r.{m}_count, 0) AS {m}_avg, r.{m}_count AS {m}_count"
+        for m in METRIC_COLUMNS)
+    sql = f"""
+        SELECT r.device_id, r.bucket_start, r.samples,
+               {metrics},
+               d.friendly_name, d.device_type, d.latitude, d.longitude
+        FROM {table} r
+        LEFT JOIN devices d ON r.device_id = d.device_id
+    """
+    where, params = [], []
+    if device_id:
+        where.append("r.device_id = %s")
+        params.append(device_id)
+    if start_date:
+        where.append("r.bucket_start >= %s")
+        params.append(start_date)
+    if end_date:
+        where.append("r.bucket_start < %s + INTERVAL 1 DAY")
+        params.append(end_date)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY r.bucket_start {'ASC' if order.upper() == 'ASC' else 'DESC'}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql, tuple(params)
+
+
+def parse_day(value):
+    """ 'YYYY-MM-DD' (optionally with a time part) -> datetime, or None. """
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
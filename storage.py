@@ -0,0 +1,409 @@
+# File: storage.py
+# Description: Storage backend shared by app.py, data hook api.py and mqtt listener.py.
+#              STORAGE_BACKEND selects where readings live:
+#                mysql  - the MySQL server of db/db.sql (default)
+#                sqlite - one embedded SQLite file in WAL mode (STORAGE_SQLITE_PATH), for an
+#                         edge gateway without a MySQL server and for benchmarks/CI runs.
+#                         The schema (db/sqlite_schema.sql) is created on first use.
+#              Both hand out connections with the mysql-connector surface the rest of the code
+#              uses (cursor(dictionary=/raw=/buffered=), execute/executemany/fetch*, commit,
+#              rollback, start_transaction, ping, is_connected). The SQLite connection rewrites
+#              the MySQL dialect of the existing queries (ON DUPLICATE KEY UPDATE, INTERVAL,
+#              TIMESTAMPDIFF, NOW(), LEAST/GREATEST, STDDEV_POP) into SQLite built-ins and
+#              raises Error with the MySQL errno of the nearest MySQL failure, so the retry and
+#              spooling decisions of ingest_batcher.py apply to both backends unchanged.
+#              Differences to keep in mind with SQLite: DECIMAL columns come back as floats,
+#              there is one writer at a time (writer threads wait up to SQLITE_BUSY_TIMEOUT),
+#              and db/migrate.py / db/partition_maintenance.py remain MySQL-only.
+
+import datetime
+import decimal
+import math
+import os
+import re
+import sqlite3
+import threading
+import types
+
+try:
+    import mysql.connector
+    from mysql.connector import Error, errorcode
+except ImportError:     # an SQLite-only install does not need the MySQL driver
+    mysql = None
+
+    class Error(Exception):
+        """ Stand-in for mysql.connector.Error: a message and a MySQL errno. """
+
+        def __init__(self, msg=None, errno=None, values=None, sqlstate=None):
+            super().__init__(msg)
+            self.msg = msg
+            self.errno = -1 if errno is None else errno
+            self.sqlstate = sqlstate
+
+        def __str__(self):
+            return f"{self.errno}: {self.msg}" if self.errno != -1 else str(self.msg)
+
+    errorcode = types.SimpleNamespace(
+        CR_SERVER_GONE_ERROR=2006, CR_SERVER_LOST=2013, CR_CONN_HOST_ERROR=2003, CR_CONNECTION_ERROR=2002,
+        ER_LOCK_DEADLOCK=1213, ER_LOCK_WAIT_TIMEOUT=1205, ER_NO_REFERENCED_ROW_2=1452, ER_DUP_ENTRY=1062,
+        ER_PARSE_ERROR=1064, ER_NO_SUCH_TABLE=1146,
+    )
+
+# --- Configuration ---
+BACKEND = os.getenv('STORAGE_BACKEND', 'mysql')
+
+MYSQL_CONFIG = {
+    'host': os.getenv('MYSQL_HOST', 'localhost'),
+    'database': os.getenv('MYSQL_DATABASE', 'unified_sensor_db'),
+    'user': os.getenv('MYSQL_USER', 'root'),
+    'password': os.getenv('MYSQL_PASSWORD', 'saintgits'),
+}
+
+SQLITE_PATH = os.getenv('STORAGE_SQLITE_PATH', 'sensor_data.db')
+SQLITE_BUSY_TIMEOUT = float(os.getenv('STORAGE_SQLITE_BUSY_TIMEOUT', '10'))    # seconds to wait for the write lock
+SQLITE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'sqlite_schema.sql')
+
+
+def backend_config(backend=None):
+    """ Connection config for `backend` (STORAGE_BACKEND by default), as accepted by connect(). """
+    backend = backend or BACKEND
+    if backend == 'mysql':
+        return dict(MYSQL_CONFIG, backend='mysql')
+    if backend == 'sqlite':
+        return {'backend': 'sqlite', 'path': SQLITE_PATH}
+    raise ValueError(f"unknown STORAGE_BACKEND {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def connect(config=None, **options):
+    """
+    Open a connection. `config` comes from backend_config() (CONFIG by default); a dict
+    without a 'backend' key is a plain mysql.connector config. `options` are added to it,
+    e.g. autocommit=True.
+    """
+    config = dict(CONFIG if config is None else config, **options)
+    return BACKENDS[config.pop('backend', 'mysql')](**config)
+
+
+def describe(config=None):
+    """ 'MySQL unified_sensor_db@localhost' / 'SQLite sensor_data.db' for log lines. """
+    config = CONFIG if config is None else config
+    if config.get('backend', 'mysql') == 'sqlite':
+        return f"SQLite {config['path']}"
+    return f"MySQL {config.get('database')}@{config.get('host')}"
+
+
+def _connect_mysql(**config):
+    if mysql is None:
+        raise Error(msg="mysql-connector-python is not installed (pip install mysql-connector-python)",
+                    errno=errorcode.CR_CONNECTION_ERROR)
+    return mysql.connector.connect(**config)
+
+
+# --- SQLite: types ---
+# Timestamps are stored as local 'YYYY-MM-DD HH:MM:SS' text like MySQL's TIMESTAMP shows them,
+# so range predicates compare as strings and the (device_id, created_at) index is used.
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' ', 'seconds'))
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(decimal.Decimal, float)
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATETIME', lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+
+# floor() and sqrt() are built in when SQLite was compiled with its math functions (most builds
+# since 3.35); older or stripped builds get these, which run per row in Python and are slower.
+_MATH_FALLBACKS = {
+    'floor': lambda value: None if value is None else math.floor(value),
+    'sqrt': lambda value: None if value is None else math.sqrt(value),
+}
+# unixepoch() arrived in 3.38; strftime('%s') gives the same seconds at about twice the cost.
+_HAS_UNIXEPOCH = sqlite3.sqlite_version_info >= (3, 38, 0)
+
+
+# --- SQLite: dialect ---
+_PLACEHOLDER = re.compile(r'%s')
+# MySQL's LEAST/GREATEST are SQLite's multi-argument min()/max(): both return NULL if any argument is.
+_LEAST_GREATEST = re.compile(r'\b(LEAST|GREATEST)\(', re.IGNORECASE)
+_NOW = re.compile(r'\bNOW\(\)|\bCURRENT_TIMESTAMP\b', re.IGNORECASE)
+_INTERVAL = re.compile(r'(\?|[\w.]+)\s*\+\s*INTERVAL\s+(\d+)\s+(SECOND|MINUTE|HOUR|DAY)\b', re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE)
+_INSERT_TABLE = re.compile(r'\bINSERT\s+INTO\s+(\w+)', re.IGNORECASE)
+_VALUES_REF = re.compile(r'\bVALUES\((\w+)\)', re.IGNORECASE)
+_TIMESTAMPDIFF = re.compile(r'\bTIMESTAMPDIFF\(\s*SECOND\s*,', re.IGNORECASE)
+_STDDEV_POP = re.compile(r'\bSTDDEV_POP\(', re.IGNORECASE)
+
+
+def _split_call(sql, start):
+    """ (arguments, end) of the call whose '(' is at sql[start]: top-level comma-separated args. """
+    depth, args, begin = 0, [], start + 1
+    for i in range(start, len(sql)):
+        char = sql[i]
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(sql[begin:i].strip())
+                return args, i + 1
+        elif char == ',' and depth == 1:
+            args.append(sql[begin:i].strip())
+            begin = i + 1
+    raise Error(msg=f"unbalanced parentheses in: {sql}", errno=errorcode.ER_PARSE_ERROR)
+
+
+def _rewrite_calls(sql, pattern, rewrite):
+    """ Replace every call `pattern` matches (up to its name) with rewrite(arguments). """
+    while True:
+        match = pattern.search(sql)
+        if not match:
+            return sql
+        args, end = _split_call(sql, sql.index('(', match.start()))
+        sql = f"{sql[:match.start()]}{rewrite(args)}{sql[end:]}"
+
+
+def _epoch(value):
+    return f"unixepoch({value})" if _HAS_UNIXEPOCH else f"CAST(strftime('%s', {value}) AS INTEGER)"
+
+
+def _timestampdiff(args):
+    _, since, until = args
+    return f"({_epoch(until)} - {_epoch(since)})"
+
+
+def _stddev_pop(args):
+    # sqrt(E[x^2] - E[x]^2) with built-in aggregates: a Python aggregate would cost a callback per
+    # row. The cancellation error is far below the 2 decimals of the readings columns.
+    (value,) = args
+    return f"sqrt(max(avg(({value}) * ({value})) - avg({value}) * avg({value}), 0))"
+
+
+class _Dialect:
+    """ Per-database-file schema setup and a cache of MySQL -> SQLite statement translations. """
+
+    def __init__(self, db):
+        with open(SQLITE_SCHEMA, encoding='utf-8') as schema:
+            db.executescript(schema.read())
+        self.primary_keys = {}      # table -> (column, ...), the ON CONFLICT target of its upserts
+        for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            columns = sorted((pk, name) for _, name, _, _, _, pk in db.execute(f"PRAGMA table_info({table})") if pk)
+            self.primary_keys[table] = tuple(name for _, name in columns)
+        self._translated = {}
+
+    def translate(self, sql):
+        translated = self._translated.get(sql)
+        if translated is None:
+            if len(self._translated) > 2048:
+                self._translated.clear()
+            translated = self._translated[sql] = self._translate(sql)
+        return translated
+
+    def _translate(self, sql):
+        sql = _PLACEHOLDER.sub('?', sql)
+        sql = _rewrite_calls(sql, _TIMESTAMPDIFF, _timestampdiff)
+        sql = _rewrite_calls(sql, _STDDEV_POP, _stddev_pop)
+        sql = _LEAST_GREATEST.sub(lambda m: 'min(' if m.group(1).upper() == 'LEAST' else 'max(', sql)
+        sql = _NOW.sub("datetime('now', 'localtime')", sql)
+        sql = _INTERVAL.sub(lambda m: f"datetime({m.group(1)}, '+{m.group(2)} {m.group(3).lower()}')", sql)
+        duplicate = _ON_DUPLICATE.search(sql)
+        if duplicate:
+            table = _INSERT_TABLE.search(sql).group(1)
+            target = self.primary_keys.get(table)
+            updates = _VALUES_REF.sub(r'excluded.\1', sql[duplicate.end():])
+            sql = f"{sql[:duplicate.start()]}ON CONFLICT{'(' + ', '.join(target) + ')' if target else ''} " \
+                  f"DO UPDATE SET{updates}"
+        return sql
+
+
+_dialects = {}
+_dialects_lock = threading.Lock()
+
+
+def _dialect(path, db):
+    key = os.path.abspath(path)
+    with _dialects_lock:
+        dialect = _dialects.get(key)
+        if dialect is None:
+            dialect = _dialects[key] = _Dialect(db)
+        return dialect
+
+
+# --- SQLite: errors ---
+def _as_error(e):
+    """ Error with the errno of the MySQL failure the SQLite exception corresponds to. """
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        errno = errorcode.ER_NO_REFERENCED_ROW_2 if 'FOREIGN KEY' in message else errorcode.ER_DUP_ENTRY
+    elif 'locked' in message or 'busy' in message:
+        errno = errorcode.ER_LOCK_WAIT_TIMEOUT          # another writer held the lock: retry
+    elif isinstance(e, sqlite3.ProgrammingError) and 'closed' in message:
+        errno = errorcode.CR_SERVER_GONE_ERROR
+    elif 'unable to open' in message or 'disk I/O' in message or 'disk is full' in message:
+        errno = errorcode.CR_CONNECTION_ERROR           # storage unusable right now: spool and retry
+    else:
+        errno = errorcode.ER_PARSE_ERROR if isinstance(e, sqlite3.OperationalError) else -1
+    error = Error(msg=message, errno=errno)
+    error.__cause__ = e
+    return error
+
+
+def _raw(value):
+    """ A value as the text bytes a raw mysql-connector cursor returns. """
+    if value is None or isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+# --- SQLite: connection ---
+class SqliteCursor:
+    """ sqlite3 cursor with the mysql-connector options in use: dictionary rows or raw bytes. """
+
+    def __init__(self, connection, dictionary=False, raw=False):
+        self._connection = connection
+        self._cursor = connection._db.cursor()
+        self._dictionary = dictionary
+        self._raw = raw
+
+    def execute(self, operation, params=()):
+        try:
+            self._cursor.execute(self._connection.dialect.translate(operation), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def executemany(self, operation, seq_params):
+        try:
+            self._cursor.executemany(self._connection.dialect.translate(operation), seq_params)
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def _rows(self, rows):
+        if self._dictionary:
+            names = [column[0] for column in self._cursor.description]
+            return [dict(zip(names, row)) for row in rows]
+        if self._raw:
+            return [tuple(_raw(value) for value in row) for row in rows]
+        return rows
+
+    def fetchone(self):
+        try:
+            row = self._cursor.fetchone()
+        except sqlite3.Error as e:
+            raise _as_error(e)
+        return None if row is None else self._rows([row])[0]
+
+    def fetchmany(self, size=1):
+        try:
+            return self._rows(self._cursor.fetchmany(size))
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def fetchall(self):
+        try:
+            return self._rows(self._cursor.fetchall())
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    """
+    One connection to the SQLite file at `path`. Transactions begin IMMEDIATE, i.e. take the
+    write lock up front, so two writer threads queue on the busy timeout instead of failing
+    to upgrade a read lock. Safe to hand between threads (one user at a time, as the pool does).
+    """
+
+    def __init__(self, path=SQLITE_PATH, autocommit=False, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        try:
+            self._db = sqlite3.connect(path, timeout=busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                                       isolation_level=None if autocommit else 'IMMEDIATE',
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            # WAL + NORMAL: a commit is durable once the WAL is synced at checkpoints; a power cut
+            # can lose the last transactions but never corrupts the file.
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            for name, function in _MATH_FALLBACKS.items():
+                try:
+                    self._db.execute(f"SELECT {name}(1)")
+                except sqlite3.OperationalError:
+                    self._db.create_function(name, 1, function, deterministic=True)
+            self.dialect = _dialect(path, self._db)
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def cursor(self, dictionary=False, raw=False, buffered=None):
+        if self._db is None:
+            raise Error(msg="SQLite connection is closed", errno=errorcode.CR_SERVER_GONE_ERROR)
+        return SqliteCursor(self, dictionary=dictionary, raw=raw)
+
+    def commit(self):
+        try:
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def rollback(self):
+        try:
+            self._db.rollback()
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def start_transaction(self):
+        """ Begin a transaction explicitly, so a SAVEPOINT nests inside it instead of opening (and committing) its own. """
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    @property
+    def in_transaction(self):
+        return self._db is not None and self._db.in_transaction
+
+    # Results are read lazily from the file; nothing is ever left pending on a "wire".
+    unread_result = False
+
+    def consume_results(self):
+        pass
+
+    def is_connected(self):
+        return self._db is not None
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if self._db is None:
+            raise Error(msg="SQLite connection is closed", errno=errorcode.CR_SERVER_GONE_ERROR)
+        try:
+            self._db.execute("SELECT 1").fetchone()
+        except sqlite3.Error as e:
+            raise _as_error(e)
+
+    def close(self):
+        if self._db is not None:
+            db, self._db = self._db, None
+            db.close()
+
+
+BACKENDS = {
+    'mysql': _connect_mysql,
+    'sqlite': SqliteConnection,
+}
+
+CONFIG = backend_config()